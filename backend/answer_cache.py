@@ -0,0 +1,236 @@
+"""Caché semántica de respuestas indexada por la pregunta independiente"""
+
+import re
+import time
+import asyncio
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+from settings import get_settings
+
+
+@dataclass
+class CachedAnswer:
+    """Respuesta almacenada junto con el costo que tuvo generarla."""
+    question: str
+    answer: str
+    embedding: np.ndarray
+    documents: list = field(default_factory=list)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_cost_usd: float = 0.0
+    created_at: float = 0.0
+    generation: Optional[int] = None
+
+
+@dataclass
+class CacheLookup:
+    """
+    Resultado de una búsqueda: la entrada encontrada (si hay), el embedding calculado y la
+    generación de la base de conocimientos vigente al buscar.
+    """
+    entry: Optional[CachedAnswer]
+    embedding: Optional[np.ndarray]
+    similarity: float = 0.0
+    generation: Optional[int] = None
+
+
+def normalize_question(question: str) -> str:
+    """Normaliza una pregunta: minúsculas, sin tildes, sin signos de puntuación y espacios simples."""
+    text = unicodedata.normalize("NFKD", question.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+class SemanticAnswerCache:
+    """
+    Caché de respuestas para preguntas repetidas.
+
+    Primero busca una coincidencia exacta de la pregunta normalizada y, si no existe,
+    la pregunta más parecida por similitud coseno de embeddings por encima de
+    `similarity_threshold`. Las entradas expiran a los `ttl_seconds` y el tamaño está
+    acotado a `max_entries` (se descarta la entrada usada hace más tiempo).
+
+    Con `generation_source` (la generación compartida de la base de conocimientos, ver
+    `database.fetch_kb_generation`), la caché la consulta cada `generation_check_seconds`
+    como máximo y se vacía si otra sincronización la cambió, aunque haya corrido en otro
+    proceso. Las respuestas generadas con una generación anterior no se guardan.
+    """
+
+    def __init__(self, embeddings, max_entries: int, ttl_seconds: float, similarity_threshold: float,
+                 generation_source: Optional[Callable[[], int]] = None, generation_check_seconds: float = 5.0):
+        self._embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.generation_check_seconds = generation_check_seconds
+        self._generation_source = generation_source
+        self._generation: Optional[int] = None
+        self._generation_checked_at: Optional[float] = None
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: list[str] = []
+        self._lock = threading.Lock()
+        self._counters = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "stale_discards": 0,
+            "saved_cost_usd": 0.0,
+        }
+
+    async def lookup(self, question: str) -> CacheLookup:
+        """Busca una respuesta para la pregunta; calcula su embedding solo si no hay coincidencia exacta."""
+        key = normalize_question(question)
+        generation = await self._check_generation()
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._record_hit("exact_hits", entry)
+                return CacheLookup(entry=entry, embedding=entry.embedding, similarity=1.0, generation=generation)
+
+        embedding = self._normalize(await self._embeddings.aembed_query(question))
+
+        with self._lock:
+            matrix, keys = self._similarity_matrix()
+            if matrix is not None:
+                similarities = matrix @ embedding
+                best = int(np.argmax(similarities))
+                similarity = float(similarities[best])
+                entry = self._entries.get(keys[best])
+                if entry is not None and similarity >= self.similarity_threshold:
+                    self._entries.move_to_end(keys[best])
+                    self._record_hit("semantic_hits", entry)
+                    return CacheLookup(entry=entry, embedding=embedding, similarity=similarity, generation=generation)
+            self._counters["misses"] += 1
+        return CacheLookup(entry=None, embedding=embedding, generation=generation)
+
+    def store(self, question: str, embedding: np.ndarray, answer: str, documents: list,
+              prompt_tokens: int, completion_tokens: int, total_cost_usd: float,
+              generation: Optional[int] = None):
+        """
+        Guarda una respuesta recién generada. `generation` es la de la búsqueda que la precedió:
+        si la base de conocimientos cambió mientras se generaba, la respuesta se descarta.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            if generation != self._generation:
+                self._counters["stale_discards"] += 1
+                return
+            self._entries[key] = CachedAnswer(
+                question=question,
+                answer=answer,
+                embedding=embedding,
+                documents=documents,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_cost_usd=total_cost_usd,
+                created_at=time.monotonic(),
+                generation=generation,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self, generation: Optional[int] = None):
+        """
+        Vacía la caché (por ejemplo, cuando cambia la base de conocimientos). Si se indica la
+        nueva `generation`, la adopta sin esperar a la próxima consulta.
+        """
+        with self._lock:
+            self._flush()
+            if generation is not None:
+                self._generation = generation
+                self._generation_checked_at = time.monotonic()
+
+    def stats(self) -> dict:
+        """Devuelve el tamaño y los contadores de la caché."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "kb_generation": self._generation,
+                **self._counters,
+            }
+
+    async def _check_generation(self) -> Optional[int]:
+        """
+        Consulta la generación compartida (como máximo una vez cada `generation_check_seconds`)
+        y vacía la caché si cambió. Si la consulta falla, conserva la última conocida.
+        """
+        if self._generation_source is None:
+            return self._generation
+        now = time.monotonic()
+        if self._generation_checked_at is not None and now - self._generation_checked_at < self.generation_check_seconds:
+            return self._generation
+        self._generation_checked_at = now
+        try:
+            generation = await asyncio.to_thread(self._generation_source)
+        except Exception as e:
+            print(f"⚠️ No se pudo consultar la generación de la base de conocimientos: {str(e)}")
+            return self._generation
+        with self._lock:
+            if generation != self._generation:
+                if self._generation is not None:
+                    self._flush()
+                self._generation = generation
+            return self._generation
+
+    def _flush(self):
+        self._entries.clear()
+        self._matrix = None
+        self._counters["invalidations"] += 1
+
+    def _record_hit(self, counter: str, entry: CachedAnswer):
+        self._counters[counter] += 1
+        self._counters["saved_cost_usd"] += entry.total_cost_usd
+
+    def _expire(self, now: float):
+        """Elimina las entradas vencidas."""
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at >= self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _similarity_matrix(self) -> tuple[Optional[np.ndarray], list[str]]:
+        """Construye (solo cuando cambió la caché) la matriz de embeddings normalizados."""
+        if self._matrix is None and self._entries:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.vstack([self._entries[key].embedding for key in self._matrix_keys])
+        return self._matrix, self._matrix_keys
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+
+# Instancia global de la caché
+_answer_cache = None
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Obtiene la caché semántica de respuestas (singleton)."""
+    global _answer_cache
+    if _answer_cache is None:
+        from azure_ai_search import get_embeddings  # Importación diferida para evitar ciclos
+        from database import fetch_kb_generation
+        settings = get_settings()
+        _answer_cache = SemanticAnswerCache(
+            embeddings=get_embeddings(),
+            max_entries=settings.answer_cache_max_entries,
+            ttl_seconds=settings.answer_cache_ttl_seconds,
+            similarity_threshold=settings.answer_cache_similarity_threshold,
+            generation_source=fetch_kb_generation,
+            generation_check_seconds=settings.answer_cache_generation_check_seconds,
+        )
+    return _answer_cache
@@ -1,55 +1,195 @@
 from langchain_openai import AzureOpenAIEmbeddings  
+from langchain_core.embeddings import Embeddings
 from langchain.vectorstores.azuresearch import AzureSearch  
-from langchain.document_loaders import AzureBlobStorageContainerLoader  
-from langchain.text_splitter import RecursiveCharacterTextSplitter  
+from langchain.document_loaders import AzureBlobStorageFileLoader  
+from langchain_core.documents import Document
+from azure.storage.blob import ContainerClient
+import hashlib
 from settings import get_settings
+from answer_cache import get_answer_cache
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from database import load_kb_manifest, bump_kb_generation
+from ingestion import IngestionPipeline, IngestionConfig
+from vector_index import LocalVectorIndex, get_local_vector_index
+from rate_limits import RateLimitedEmbeddings, get_embeddings_scheduler
+from chunking import build_text_splitter, get_chunk_deduplicator
   
 
 # Obtener configuraciones desde settings.py  
 settings = get_settings()  
   
-# Initialize OpenAI embeddings with Azure    
-embeddings: AzureOpenAIEmbeddings = AzureOpenAIEmbeddings(
-    api_version=settings.azure_openai_api_version,
-    azure_endpoint=settings.azure_openai_endpoint,
-    api_key=settings.azure_openai_api_key,
-    azure_deployment='text-embedding-3-small',
-    model='text-embedding-3-small'
-)
+# OpenAI embeddings with Azure (se crean al primer uso: el cliente valida las credenciales al construirse)
+EMBEDDING_MODEL: str = 'text-embedding-3-small'
+EMBEDDING_COST_PER_1K_TOKENS: float = 0.00002  # USD, precio de lista de text-embedding-3-small
+_embeddings = None
+
+def get_embeddings() -> Embeddings:
+    """Obtiene el cliente de embeddings de Azure OpenAI, sujeto a la cuota del deployment."""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = RateLimitedEmbeddings(
+            AzureOpenAIEmbeddings(
+                api_version=settings.azure_openai_api_version,
+                azure_endpoint=settings.azure_openai_endpoint,
+                api_key=settings.azure_openai_api_key,
+                azure_deployment=EMBEDDING_MODEL,
+                model=EMBEDDING_MODEL,
+                max_retries=0  # Los reintentos los hace el planificador de cuota
+            ),
+            get_embeddings_scheduler()
+        )
+    return _embeddings
   
-# Initialize Azure Search vector store 
+# Embeddings de ingesta: consultan primero la caché persistente en disco
+_ingestion_embeddings = None
+
+def get_ingestion_embeddings() -> CachedEmbeddings:
+    """Obtiene los embeddings con caché persistente usados para indexar documentos."""
+    global _ingestion_embeddings
+    if _ingestion_embeddings is None:
+        _ingestion_embeddings = CachedEmbeddings(
+            embeddings=get_embeddings(),
+            cache=EmbeddingCache(settings.embedding_cache_path),
+            model=EMBEDDING_MODEL
+        )
+    return _ingestion_embeddings
+
+# Azure Search vector store y cliente de Blob Storage (se crean al primer uso:  
+# AzureSearch consulta el índice al construirse y no debe hacerlo al importar el módulo)  
 vector_store_address: str = f"https://{settings.azure_search_name}.search.windows.net"
-vector_store: AzureSearch = AzureSearch(
-    azure_search_endpoint=vector_store_address,
-    azure_search_key=settings.azure_search_api_key,
-    index_name=settings.azure_search_index_name,
-    embedding_function=embeddings.embed_query
-)
-  
-# Load documents from Azure Blob Storage  
-conn_str: str = settings.azure_storage_connection_string  
-loader: AzureBlobStorageContainerLoader = AzureBlobStorageContainerLoader(  
-    conn_str=conn_str,  
-    container=settings.azure_storage_container_name
-)  
-  
-def update_knowledge_base(force_update: bool = False):  
-    """  
-    Verifica si la base de conocimientos ya tiene documentos. 
-    Si no tiene o se fuerza, carga los documentos desde Azure Blob Storage y los sube al vector store Azure AI Search.
-    """  
-    # Verificar si ya hay documentos en el vector store  
-    existing_documents = vector_store.similarity_search("test", k=1)  # Realiza una busqueda de prueba  
-    if existing_documents and force_update == False:
-        print("✅ La base de conocimientos ya tiene documentos. No se requiere actualización.")  
-        return
-  
-    # Si no hay documentos, cargar y procesar los nuevos  
-    print("⚠️ La base de conocimientos está vacía. Cargando documentos...")
-    documents: list = loader.load()  
-    text_splitter: RecursiveCharacterTextSplitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)  
-    splitted_documents = text_splitter.split_documents(documents=documents)  
-  
-    # Subir los documentos al vector store  
-    vector_store.add_documents(documents=splitted_documents)  
-    print("✅ Base de conocimientos actualizada con éxito.")
\ No newline at end of file
+_vector_store = None
+_container_client = None
+
+def get_vector_store() -> AzureSearch | LocalVectorIndex:
+    """Obtiene el vector store configurado: Azure AI Search o el índice vectorial local."""
+    global _vector_store
+    if settings.retriever_backend == "local":
+        return get_local_vector_index()
+    if _vector_store is None:
+        _vector_store = AzureSearch(
+            azure_search_endpoint=vector_store_address,
+            azure_search_key=settings.azure_search_api_key,
+            index_name=settings.azure_search_index_name,
+            embedding_function=get_ingestion_embeddings()
+        )
+    return _vector_store
+
+def get_container_client() -> ContainerClient:
+    """Obtiene el cliente del contenedor de documentos en Azure Blob Storage."""
+    global _container_client
+    if _container_client is None:
+        _container_client = ContainerClient.from_connection_string(
+            conn_str=settings.azure_storage_connection_string,
+            container_name=settings.azure_storage_container_name
+        )
+    return _container_client
+
+
+def _load_blob(blob_name: str) -> tuple[list[Document], str]:
+    """Descarga y procesa un blob; devuelve sus documentos y el hash de su contenido."""
+    loader = AzureBlobStorageFileLoader(
+        conn_str=settings.azure_storage_connection_string,
+        container=settings.azure_storage_container_name,
+        blob_name=blob_name
+    )
+    documents = loader.load()
+    for document in documents:
+        document.metadata["source"] = blob_name  # El loader guarda la ruta temporal de descarga
+    content_hash = hashlib.sha256("\0".join(doc.page_content for doc in documents).encode("utf-8")).hexdigest()
+    return documents, content_hash
+
+
+def _indexed_ids(vector_store: AzureSearch | LocalVectorIndex) -> list[str]:
+    """IDs de todos los chunks presentes en el índice."""
+    if isinstance(vector_store, LocalVectorIndex):
+        return vector_store.list_ids()
+    results = vector_store.client.search(search_text="*", select=["id"])  # "id" es el campo clave del índice
+    return [result["id"] for result in results]
+
+
+def _purge_orphan_chunks(vector_store: AzureSearch | LocalVectorIndex, known_ids: set) -> int:
+    """Elimina del índice los chunks que no pertenecen a ningún blob del manifiesto."""
+    orphan_ids = [chunk_id for chunk_id in _indexed_ids(vector_store) if chunk_id not in known_ids]
+    if orphan_ids:
+        vector_store.delete(ids=orphan_ids)
+    return len(orphan_ids)
+
+
+def get_ingestion_config() -> IngestionConfig:
+    """Configuración del pipeline de ingesta a partir de settings.py."""
+    return IngestionConfig(
+        parse_workers=settings.ingestion_parse_workers,
+        embed_workers=settings.ingestion_embed_workers,
+        upload_workers=settings.ingestion_upload_workers,
+        embed_batch_size=settings.ingestion_embed_batch_size,
+        upload_batch_size=settings.ingestion_upload_batch_size,
+        queue_size=settings.ingestion_queue_size,
+        max_retries=settings.ingestion_max_retries
+    )
+
+
+def update_knowledge_base(force_update: bool = False) -> dict:
+    """
+    Sincroniza de forma incremental el contenedor de Azure Blob Storage con Azure AI Search.
+
+    Compara cada blob con el manifiesto (ETag y hash de contenido) y solo procesa los blobs
+    nuevos o modificados: embebe y sube únicamente los chunks que no estaban indexados y
+    elimina los que ya no existen. Los chunks de blobs eliminados también se borran del índice.
+    Con `force_update` se reprocesan todos los blobs y se eliminan los chunks huérfanos.
+    El procesamiento se hace en streaming con el pipeline de `ingestion.py`; los chunks se
+    miden en tokens y los casi duplicados no se embeben ni se indexan (ver `chunking.py`).
+
+    Returns:
+        dict: Resumen de la sincronización (blobs agregados, actualizados, sin cambios,
+        eliminados y fallidos, chunks subidos y borrados, tamaño del índice, duplicados
+        descartados con su ahorro en embeddings, y throughput por etapa).
+    """
+    vector_store = get_vector_store()
+    text_splitter = build_text_splitter(EMBEDDING_MODEL, settings.chunk_tokens, settings.chunk_overlap_tokens)
+    pipeline = IngestionPipeline(
+        vector_store=vector_store,
+        container_client=get_container_client(),
+        embeddings=get_ingestion_embeddings(),
+        load_blob=_load_blob,
+        text_splitter=text_splitter,
+        config=get_ingestion_config(),
+        deduplicator=get_chunk_deduplicator(EMBEDDING_MODEL)
+    )
+    summary = pipeline.run(force_update=force_update)
+
+    if force_update:
+        indexed_ids = {chunk_id for entry in load_kb_manifest().values() for chunk_id in entry["chunk_ids"]}
+        summary["chunks_deleted"] += _purge_orphan_chunks(vector_store, indexed_ids)
+
+    # El índice local libera las filas de los chunks reemplazados o eliminados
+    if isinstance(vector_store, LocalVectorIndex) and summary["chunks_deleted"]:
+        vector_store.compact()
+
+    # Las respuestas en caché pueden depender de documentos que cambiaron: la nueva generación
+    # compartida hace que los demás workers también vacíen su caché
+    if summary["chunks_upserted"] or summary["chunks_deleted"]:
+        get_answer_cache().invalidate(bump_kb_generation())
+
+    summary["embedding_cache"] = get_ingestion_embeddings().stats()
+    if "dedup" in summary:
+        summary["dedup"]["embedding_cost_saved_usd"] = round(
+            summary["dedup"]["embedding_tokens_saved"] / 1000 * EMBEDDING_COST_PER_1K_TOKENS, 6
+        )
+    print(
+        f"✅ Base de conocimientos sincronizada en {summary['duration_seconds']} s: "
+        f"{len(summary['added'])} agregados, {len(summary['updated'])} actualizados, "
+        f"{len(summary['unchanged'])} sin cambios, {len(summary['removed'])} eliminados, "
+        f"{len(summary['failed'])} fallidos "
+        f"({summary['chunks_upserted']} chunks subidos, {summary['chunks_deleted']} chunks borrados)."
+    )
+    print(f"   • índice: {summary['index']['chunks']} chunks, {summary['index']['tokens']} tokens")
+    if "dedup" in summary:
+        print(f"   • duplicados: {summary['dedup']['duplicates_dropped']} chunks descartados, "
+              f"{summary['dedup']['embedding_tokens_saved']} tokens de embeddings ahorrados "
+              f"(USD {summary['dedup']['embedding_cost_saved_usd']})")
+    if summary["requeued"]:
+        print(f"   • {len(summary['requeued'])} blobs se reprocesarán en la próxima sincronización")
+    for name, stats in summary["stages"].items():
+        print(f"   • {name}: {stats['items']} {stats['unit']} "
+              f"({stats[stats['unit'] + '_per_second']} {stats['unit']}/s, {stats['retries']} reintentos)")
+    return summary
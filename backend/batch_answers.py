@@ -0,0 +1,175 @@
+"""Respuestas en lote a preguntas independientes (sin historial) para evaluaciones offline"""
+
+import time
+import asyncio
+from typing import AsyncIterator, Callable, Optional
+from langchain_core.documents import Document
+from answer_cache import normalize_question
+from chatbot_app import (
+    condense_question, retrieve_documents, pack_context, generate_shared, summarize_documents, build_logs
+)
+from memory_store import Conversation
+from concurrency import QueueTimeoutError, get_llm_limiter
+from rate_limits import RateLimitExceeded, get_llm_scheduler
+from metrics import stage_timer
+
+
+# Contadores acumulados de los lotes atendidos por este proceso
+batch_stats: dict = {"batches": 0, "questions": 0, "errors": 0, "retrievals": 0, "retrievals_shared": 0}
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile))], 2)
+
+
+class BatchRunner:
+    """
+    Responde un lote de preguntas independientes con paralelismo acotado.
+
+    Cada pregunta se responde sin historial ni caché de respuestas (para evaluar el prompt y el
+    índice actuales) y ocupa un cupo del limitador de concurrencia y de la cuota del LLM, igual
+    que una solicitud de chat. Las preguntas cuya forma reformulada y normalizada coincide
+    comparten una sola recuperación; las generaciones simultáneas idénticas se comparten a
+    través del coalescedor. Si la cuota o la cola rechazan una pregunta, se espera lo indicado
+    y se reintenta hasta `max_attempts` veces antes de informarla como error.
+    """
+
+    def __init__(self, rag_chain, max_concurrency: int, max_attempts: int, on_logs: Callable[[dict], None]):
+        self.rag_chain = rag_chain
+        self.max_attempts = max_attempts
+        self.on_logs = on_logs
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._retrievals: dict[str, asyncio.Task] = {}
+        # Recuperaciones iniciadas, incluidas las fallidas que ya se quitaron de `_retrievals`
+        self._retrieval_count = 0
+        self._llm_limiter = get_llm_limiter()
+        self._llm_scheduler = get_llm_scheduler()
+
+    async def run(self, session_id: str, questions: list[tuple[Optional[str], str]]) -> AsyncIterator[dict]:
+        """
+        Emite un resultado por pregunta (`result` o `error`) a medida que terminan, sin respetar el
+        orden de entrada (cada uno trae su `index`), y al final un resumen del lote (`summary`).
+        Si se deja de consumir, las preguntas pendientes se cancelan.
+        """
+        started = time.perf_counter()
+        results: asyncio.Queue = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(self._run_item(session_id, index, item_id, question, results))
+            for index, (item_id, question) in enumerate(questions)
+        ]
+        summary = {"type": "summary", "session_id": session_id, "questions": len(questions), "answered": 0,
+                   "errors": 0, "retrievals": 0, "retrievals_shared": 0, "coalesced": 0,
+                   "prompt_tokens": 0, "completion_tokens": 0, "total_cost_usd": 0.0}
+        latencies: list[float] = []
+        try:
+            for _ in tasks:
+                result = await results.get()
+                latencies.append(result["latency_ms"])
+                if result["type"] == "result":
+                    summary["answered"] += 1
+                    summary["retrievals_shared"] += result["retrieval_shared"]
+                    summary["coalesced"] += result["usage"]["coalesced"]
+                    for key in ("prompt_tokens", "completion_tokens", "total_cost_usd"):
+                        summary[key] += result["usage"][key]
+                else:
+                    summary["errors"] += 1
+                yield result
+        finally:
+            for task in tasks + list(self._retrievals.values()):
+                task.cancel()
+
+        summary["retrievals"] = self._retrieval_count
+        summary["total_cost_usd"] = round(summary["total_cost_usd"], 6)
+        summary["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        summary["latency_ms"] = {"p50": _percentile(latencies, 0.5), "p95": _percentile(latencies, 0.95),
+                                 "max": _percentile(latencies, 1.0)}
+        batch_stats["batches"] += 1
+        batch_stats["questions"] += len(questions)
+        batch_stats["errors"] += summary["errors"]
+        batch_stats["retrievals"] += summary["retrievals"]
+        batch_stats["retrievals_shared"] += summary["retrievals_shared"]
+        yield summary
+
+    async def _run_item(self, session_id: str, index: int, item_id: Optional[str], question: str,
+                        results: asyncio.Queue):
+        submitted = time.perf_counter()
+        started = None
+        base = {"index": index, "id": item_id, "question": question}
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self._semaphore:
+                    started = started or time.perf_counter()
+                    # Cada pregunta es una solicitud propia: el límite por sesión no frena el lote
+                    with self._llm_scheduler.admission(f"{session_id}#{index}"):
+                        async with self._llm_limiter.slot():
+                            result = await self._answer(session_id, question)
+                break
+            except (RateLimitExceeded, QueueTimeoutError) as e:
+                if attempt >= self.max_attempts:
+                    result = {"type": "error", "error": f"Sin capacidad tras {attempt} intentos: {str(e)}",
+                              "retry_after": getattr(e, "retry_after", None)}
+                    break
+                # La cola del limitador ya esperó su timeout; la cuota indica cuánto esperar
+                await asyncio.sleep(getattr(e, "retry_after", 0))
+            except Exception as e:
+                result = {"type": "error", "error": f"Error al generar la respuesta: {str(e)}"}
+                break
+        # Latencia desde que la pregunta obtuvo un cupo del lote; la espera previa se informa aparte
+        started = started or time.perf_counter()
+        result.update(base, attempts=attempt, queued_ms=round((started - submitted) * 1000, 2),
+                      latency_ms=round((time.perf_counter() - started) * 1000, 2))
+        results.put_nowait(result)
+
+    async def _answer(self, session_id: str, question: str) -> dict:
+        timings: dict = {}
+        with stage_timer("condense", timings):
+            standalone_question, _ = await condense_question(self.rag_chain, question, Conversation())
+        with stage_timer("retrieve", timings):
+            documents, shared = await self._shared_retrieval(standalone_question)
+        with stage_timer("generate", timings):
+            answer, usage = await generate_shared(self.rag_chain, standalone_question, documents)
+
+        self.on_logs(build_logs(session_id, question, answer, usage["prompt_tokens"], usage["completion_tokens"],
+                                usage["cost"], saved_cost_usd=usage["saved_cost_usd"], stage_timings_ms=timings,
+                                coalesced=usage["coalesced"]))
+        return {
+            "type": "result",
+            "standalone_question": standalone_question,
+            "answer": answer,
+            "documents": summarize_documents(documents),
+            "retrieval_shared": shared,
+            "usage": {
+                "prompt_tokens": usage["prompt_tokens"],
+                "completion_tokens": usage["completion_tokens"],
+                "total_cost_usd": usage["cost"],
+                "saved_cost_usd": usage["saved_cost_usd"],
+                "coalesced": usage["coalesced"],
+            },
+            "stage_timings_ms": timings,
+        }
+
+    async def _shared_retrieval(self, standalone_question: str) -> tuple[list[Document], bool]:
+        """Documentos recuperados y empaquetados para la pregunta, compartidos entre preguntas equivalentes."""
+        key = normalize_question(standalone_question)
+        task = self._retrievals.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.create_task(self._retrieve_and_pack(standalone_question))
+            self._retrievals[key] = task
+            self._retrieval_count += 1
+            # Si la recuperación falla, el reintento de otra pregunta equivalente la vuelve a intentar
+            task.add_done_callback(
+                lambda done: self._retrievals.pop(key, None) if not done.cancelled() and done.exception() else None
+            )
+        # shield: si una pregunta se cancela, la recuperación sigue para las demás que la esperan
+        return await asyncio.shield(task), shared
+
+    async def _retrieve_and_pack(self, standalone_question: str) -> list[Document]:
+        documents = await retrieve_documents(self.rag_chain, standalone_question)
+        with stage_timer("pack"):
+            return pack_context(self.rag_chain, standalone_question, documents)
@@ -0,0 +1,114 @@
+"""
+Evaluación offline: envía un conjunto de preguntas a `/api/chat/batch` y guarda las respuestas.
+
+Las preguntas se leen de un archivo de texto (una por línea) o JSONL (objetos con
+`user_question` o `question`, y opcionalmente `id`). Se envían en lotes de hasta
+`--batch-size` preguntas; las respuestas se escriben en NDJSON a medida que llegan y al
+final se imprime el resumen (respuestas, errores, recuperaciones compartidas, costo y latencia).
+
+Uso:
+    python batch_eval.py preguntas.txt --output respuestas.ndjson
+    python batch_eval.py preguntas.jsonl --url https://mi-backend.azurewebsites.net --concurrency 8
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Responde en lote un conjunto de preguntas de evaluación.")
+    parser.add_argument("questions", help="Archivo de preguntas (.txt, una por línea, o .jsonl)")
+    parser.add_argument("--url", default="http://localhost:8000", help="URL base del backend")
+    parser.add_argument("--output", default="batch_answers.ndjson", help="Archivo NDJSON de respuestas")
+    parser.add_argument("--concurrency", type=int, help="Preguntas simultáneas (por defecto, BATCH_MAX_CONCURRENCY del servidor)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Preguntas por solicitud")
+    return parser.parse_args()
+
+
+def load_questions(path: str) -> list[dict]:
+    """Lee las preguntas del archivo; en JSONL conserva el `id` de cada una si lo trae."""
+    questions = []
+    with open(path, encoding="utf-8") as questions_file:
+        for line_number, line in enumerate(questions_file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                question = item.get("user_question") or item.get("question")
+                if not question:
+                    raise ValueError(f"La línea {line_number} no tiene `user_question` ni `question`.")
+                questions.append({"id": str(item.get("id", line_number)), "user_question": question})
+            else:
+                questions.append({"id": str(line_number), "user_question": line})
+    return questions
+
+
+async def run_batch(client, args: argparse.Namespace, questions: list[dict], output_file, offset: int) -> dict:
+    """Envía un lote, escribe cada respuesta al llegar y devuelve el resumen del servidor."""
+    payload = {"questions": questions, "max_concurrency": args.concurrency}
+    summary: dict = {}
+    async with client.stream("POST", "/api/chat/batch", json=payload) as response:
+        if response.status_code != 200:
+            detail = (await response.aread()).decode("utf-8", errors="replace")
+            raise RuntimeError(f"El servidor respondió {response.status_code}: {detail}")
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            result = json.loads(line)
+            if result["type"] == "summary":
+                summary = result
+                continue
+            result["index"] += offset
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output_file.flush()
+            status = "✅" if result["type"] == "result" else "❌"
+            print(f"{status} [{result['index'] + 1}] {result['latency_ms']:.0f} ms  {result['question'][:70]}")
+    return summary
+
+
+async def run_evaluation(args: argparse.Namespace) -> list[dict]:
+    import httpx
+
+    questions = load_questions(args.questions)
+    summaries = []
+    # Sin timeout de lectura: un lote grande puede tardar minutos en terminar
+    timeout = httpx.Timeout(30.0, read=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            for offset in range(0, len(questions), args.batch_size):
+                batch = questions[offset:offset + args.batch_size]
+                summaries.append(await run_batch(client, args, batch, output_file, offset))
+    return summaries
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    try:
+        summaries = asyncio.run(run_evaluation(args))
+    except Exception as e:
+        print(f"❌ La evaluación falló: {str(e)}")
+        sys.exit(1)
+
+    total = {key: sum(summary.get(key, 0) for summary in summaries)
+             for key in ("questions", "answered", "errors", "retrievals", "retrievals_shared", "coalesced",
+                         "prompt_tokens", "completion_tokens", "total_cost_usd")}
+    print(f"\n✅ {total['answered']} de {total['questions']} preguntas respondidas en "
+          f"{time.perf_counter() - started:.1f} s ({total['errors']} errores).")
+    print(f"   • Recuperaciones: {total['retrievals']} ({total['retrievals_shared']} preguntas compartieron una)")
+    print(f"   • Generaciones compartidas: {total['coalesced']}")
+    print(f"   • Tokens: {total['prompt_tokens']} de prompt, {total['completion_tokens']} de respuesta; "
+          f"costo USD {round(total['total_cost_usd'], 4)}")
+    for summary in summaries:
+        latency = summary.get("latency_ms", {})
+        print(f"   • Lote {summary.get('session_id')}: p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms")
+    print(f"📄 Respuestas guardadas en {args.output}")
+    sys.exit(1 if total["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
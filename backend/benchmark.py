@@ -0,0 +1,589 @@
+"""
+Benchmark de carga del backend contra servicios locales simulados.
+
+Levanta la aplicación de `main.py` con uvicorn en un puerto local y reemplaza cada
+dependencia externa por un doble en proceso con latencia y errores configurables:
+
+- Azure OpenAI (chat y embeddings): modelos falsos con respuestas fijas y streaming por palabra.
+- Azure AI Search: índice vectorial local (`vector_index.py`) con un corpus sintético.
+- Turso: archivo SQLite local abierto con libsql, con latencia por sentencia.
+- Blob Storage no participa en las rutas de chat, por lo que no se simula.
+
+Luego genera tráfico concurrente de varias sesiones (/chat, /chat/stream, historial y
+estadísticas) y guarda en JSON el throughput, la latencia p50/p95/p99 por endpoint,
+los errores y el crecimiento de memoria del proceso.
+
+Uso:
+    python benchmark.py --sessions 50 --turns 4 --concurrency 16 --output results.json
+    python benchmark.py --llm-latency-ms 1200 --llm-error-rate 0.05 --baseline results.json
+    python benchmark.py --llm-tpm 60000 --no-client-quota   # cuota de Azure sin planificador en el cliente
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import hashlib
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Optional
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark de carga del chatbot con servicios simulados.")
+    parser.add_argument("--sessions", type=int, default=40, help="Sesiones simuladas")
+    parser.add_argument("--turns", type=int, default=4, help="Preguntas por sesión")
+    parser.add_argument("--concurrency", type=int, default=16, help="Solicitudes de chat simultáneas")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="Fracción de preguntas por /chat/stream")
+    parser.add_argument("--think-time-ms", type=float, default=0, help="Pausa entre turnos de una sesión")
+    parser.add_argument("--llm-latency-ms", type=float, default=600, help="Latencia hasta el primer token del LLM")
+    parser.add_argument("--llm-token-latency-ms", type=float, default=5, help="Latencia entre tokens del LLM")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Probabilidad de error del LLM")
+    parser.add_argument("--llm-tpm", type=int, default=0, help="Cuota simulada del deployment en tokens por minuto (0 = sin cuota)")
+    parser.add_argument("--no-client-quota", action="store_true",
+                        help="No informar la cuota al planificador del cliente (solo los 429 del servicio)")
+    parser.add_argument("--max-client-retries", type=int, default=3,
+                        help="Reintentos del cliente simulado ante un 429 (respetando Retry-After)")
+    parser.add_argument("--embedding-latency-ms", type=float, default=40, help="Latencia de los embeddings")
+    parser.add_argument("--search-latency-ms", type=float, default=30, help="Latencia de la búsqueda")
+    parser.add_argument("--search-error-rate", type=float, default=0.0, help="Probabilidad de error de la búsqueda")
+    parser.add_argument("--db-latency-ms", type=float, default=5, help="Latencia por sentencia en la base de datos")
+    parser.add_argument("--history-delay-ms", type=float, default=1000, help="Espera antes de leer el historial")
+    parser.add_argument("--corpus-size", type=int, default=2000, help="Chunks del corpus sintético")
+    parser.add_argument("--answer-cache", action="store_true", help="Habilitar la caché semántica de respuestas")
+    parser.add_argument("--session-store", choices=("memory", "database", "sqlite"), default="memory",
+                        help="Almacén del historial de sesiones")
+    parser.add_argument("--seed", type=int, default=7, help="Semilla del generador de tráfico")
+    parser.add_argument("--output", default="benchmark_results.json", help="Archivo JSON de resultados")
+    parser.add_argument("--baseline", help="Resultados anteriores con los que comparar")
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace, workdir: str):
+    """Apunta la configuración a los recursos locales antes de importar la aplicación."""
+    os.environ.update({
+        "RETRIEVER_BACKEND": "local",
+        "LOCAL_INDEX_PATH": os.path.join(workdir, "vector_index"),
+        "DATABASE_URL": os.path.join(workdir, "benchmark.db"),
+        "TURSO_API_TOKEN": "local",
+        "LOG_WRITER_SPILL_PATH": os.path.join(workdir, "pending_logs.jsonl"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        "SESSION_STORE_BACKEND": args.session_store,
+        "SESSION_STORE_SQLITE_PATH": os.path.join(workdir, "sessions.sqlite3"),
+        "AZURE_OPENAI_TPM": str(0 if args.no_client_quota else args.llm_tpm),
+        "RATE_LIMIT_COMPLETION_TOKENS": "40",  # Largo de la respuesta fija del modelo simulado
+        "ENVIRONMENT": "benchmark",
+    })
+    # Las credenciales no se usan (todos los servicios son locales), pero deben existir
+    for name in ("AZURE_OPENAI_API_KEY", "AZURE_SEARCH_API_KEY", "AZURE_STORAGE_CONNECTION_STRING"):
+        os.environ.setdefault(name, "benchmark")
+    os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://benchmark.openai.azure.com")
+    os.environ.setdefault("AZURE_SEARCH_ENDPOINT", "https://benchmark.search.windows.net")
+    os.environ.setdefault("AZURE_SEARCH_NAME", "benchmark")
+
+
+# Servicios simulados
+
+class InjectedServiceError(Exception):
+    """Error transitorio inyectado por el benchmark (se comporta como un 503 del servicio)."""
+    status_code = 503
+
+
+class ThrottledError(Exception):
+    """429 simulado de Azure OpenAI, con la espera en la cabecera retry-after-ms."""
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("Cuota de tokens del deployment excedida (simulada)")
+        self.response = SimpleNamespace(status_code=429, headers={"retry-after-ms": str(int(retry_after * 1000))})
+
+
+class SimulatedQuota:
+    """Cuota de tokens por minuto del deployment, evaluada como Azure en ventanas de 10 segundos."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.rate = tokens_per_minute / 60
+        self.capacity = self.rate * 10
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.throttled = 0
+
+    def charge(self, tokens: int):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens > self.level:
+            self.throttled += 1
+            raise ThrottledError((tokens - self.level) / self.rate)
+        self.level -= tokens
+
+
+def build_fakes(args: argparse.Namespace) -> dict:
+    """Crea los dobles de Azure OpenAI y Azure AI Search (requiere el entorno ya configurado)."""
+    import numpy as np
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+    from vector_index import LocalVectorRetriever
+
+    def maybe_fail(error_rate: float, service: str):
+        if error_rate and random.random() < error_rate:
+            raise InjectedServiceError(f"Error inyectado en {service}")
+
+    quota = SimulatedQuota(args.llm_tpm)
+
+    class FakeEmbeddings(Embeddings):
+        """Vectores deterministas por texto, con latencia por llamada."""
+
+        def __init__(self, dim: int = 256, latency_ms: float = 0):
+            self.dim = dim
+            self.latency = latency_ms / 1000
+
+        def _vector(self, text: str) -> list[float]:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).normal(size=self.dim)
+            return (vector / np.linalg.norm(vector)).tolist()
+
+        def embed_documents(self, texts: list[str]) -> list[list[float]]:
+            time.sleep(self.latency)
+            return [self._vector(text) for text in texts]
+
+        def embed_query(self, text: str) -> list[float]:
+            time.sleep(self.latency)
+            return self._vector(text)
+
+        async def aembed_query(self, text: str) -> list[float]:
+            await asyncio.sleep(self.latency)
+            return self._vector(text)
+
+    class FakeChatModel(BaseChatModel):
+        """Modelo de chat con respuesta fija, latencia configurable y errores inyectados."""
+
+        model_name: str = "gpt-4o-mini"
+        latency_ms: float = 0
+        token_latency_ms: float = 0
+        error_rate: float = 0.0
+        answer: str = (
+            "📦 Para calcular el punto de reorden multiplica la demanda diaria promedio por el tiempo "
+            "de entrega del proveedor y suma el stock de seguridad. Revisa el resultado cada mes 📊."
+        )
+
+        @property
+        def _llm_type(self) -> str:
+            return "benchmark-fake"
+
+        def _usage(self, messages) -> dict:
+            """Uso aproximado (una palabra = un token), como lo reportaría Azure OpenAI."""
+            prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+            completion_tokens = len(self.answer.split())
+            return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens}
+
+        def _result(self, messages) -> ChatResult:
+            return ChatResult(
+                generations=[ChatGeneration(message=AIMessage(content=self.answer))],
+                llm_output={"token_usage": self._usage(messages), "model_name": self.model_name},
+            )
+
+        def _admit(self, messages):
+            # Como Azure, la cuota se cobra (o se rechaza con 429) antes de generar, con el prompt
+            # estimado en ~4 caracteres por token más la respuesta
+            prompt_chars = sum(len(str(message.content)) for message in messages)
+            quota.charge(prompt_chars // 4 + len(self.answer.split()))
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            self._admit(messages)
+            time.sleep(self.latency_ms / 1000)
+            maybe_fail(self.error_rate, "Azure OpenAI")
+            return self._result(messages)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            self._admit(messages)
+            await asyncio.sleep(self.latency_ms / 1000)
+            maybe_fail(self.error_rate, "Azure OpenAI")
+            return self._result(messages)
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            self._admit(messages)
+            await asyncio.sleep(self.latency_ms / 1000)
+            maybe_fail(self.error_rate, "Azure OpenAI")
+            for word in self.answer.split(" "):
+                await asyncio.sleep(self.token_latency_ms / 1000)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            usage = self._usage(messages)
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata={
+                "input_tokens": usage["prompt_tokens"],
+                "output_tokens": usage["completion_tokens"],
+                "total_tokens": usage["total_tokens"],
+            }))
+
+    class LatencyRetriever(LocalVectorRetriever):
+        """Retriever local con la latencia y los errores de un servicio remoto."""
+
+        latency_ms: float = 0
+        error_rate: float = 0.0
+
+        async def _aget_relevant_documents(self, query: str, *, run_manager=None):
+            documents = await super()._aget_relevant_documents(query, run_manager=run_manager)
+            await asyncio.sleep(self.latency_ms / 1000)
+            maybe_fail(self.error_rate, "Azure AI Search")
+            return documents
+
+    return {
+        "embeddings": FakeEmbeddings(latency_ms=args.embedding_latency_ms),
+        "llm": FakeChatModel(
+            latency_ms=args.llm_latency_ms,
+            token_latency_ms=args.llm_token_latency_ms,
+            error_rate=args.llm_error_rate,
+        ),
+        "retriever_class": LatencyRetriever,
+        "quota": quota,
+    }
+
+
+class _SlowConnection:
+    """Conexión a la base de datos que agrega latencia a cada sentencia."""
+
+    def __init__(self, conn, latency: float):
+        self._conn = conn
+        self._latency = latency
+
+    def execute(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._conn.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._conn.executemany(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+
+# Corpus sintético para el índice local
+TOPICS: list = [
+    "punto de reorden", "stock de seguridad", "rotación de inventario", "bodegaje", "flujo de caja",
+    "clasificación ABC", "reabastecimiento", "inventario cíclico", "merma", "margen bruto",
+    "proveedores", "costo de almacenamiento", "fecha de vencimiento", "método FIFO", "demanda estacional",
+]
+QUESTION_TEMPLATES: list = [
+    "¿Cómo calculo el {topic} en mi minimarket?",
+    "¿Qué es el {topic} y por qué importa en una tienda?",
+    "Dame un ejemplo práctico de {topic} para un pequeño negocio.",
+    "¿Cada cuánto debo revisar el {topic} de mi bodega?",
+    "¿y eso cómo se aplica?",
+    "¿Puedes explicarlo con otro ejemplo?",
+]
+
+
+def seed_corpus(index, embeddings, size: int):
+    """Llena el índice local con chunks sintéticos sobre los temas del asistente."""
+    batch = []
+    for i in range(size):
+        topic = TOPICS[i % len(TOPICS)]
+        text = (f"Guía {i}: el {topic} ayuda a planificar las compras de la tienda. "
+                f"Registra las ventas diarias, revisa el {topic} cada semana y ajusta los pedidos "
+                f"según la demanda y el tiempo de entrega del proveedor.")
+        batch.append((text, {"source": f"guia_{i // 20}.pdf"}, f"bench-{i}"))
+    for start in range(0, len(batch), 500):
+        chunk = batch[start:start + 500]
+        vectors = [embeddings._vector(text) for text, _, _ in chunk]
+        index.add_embeddings(
+            text_embeddings=[(text, vector) for (text, _, _), vector in zip(chunk, vectors)],
+            metadatas=[metadata for _, metadata, _ in chunk],
+            keys=[key for _, _, key in chunk],
+        )
+
+
+# Medición
+
+def rss_bytes() -> int:
+    """Memoria residente actual del proceso (o la máxima, si /proc no está disponible)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Recorder:
+    """Acumula latencias, códigos de estado y errores por endpoint."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.status_codes: dict[str, dict[str, int]] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, status: Optional[int | str]):
+        """`status` es el código HTTP, None si falló la conexión o un texto para otros errores."""
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        codes = self.status_codes.setdefault(endpoint, {})
+        key = str(status) if status is not None else "connection_error"
+        codes[key] = codes.get(key, 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, wall_seconds: float) -> dict:
+        import numpy as np
+
+        endpoints = {}
+        for endpoint, values in self.latencies.items():
+            samples = np.asarray(values) * 1000
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "status_codes": self.status_codes[endpoint],
+                "throughput_rps": round(len(values) / wall_seconds, 2),
+                "latency_ms": {
+                    "mean": round(float(samples.mean()), 2),
+                    "p50": round(float(np.percentile(samples, 50)), 2),
+                    "p95": round(float(np.percentile(samples, 95)), 2),
+                    "p99": round(float(np.percentile(samples, 99)), 2),
+                    "max": round(float(samples.max()), 2),
+                },
+            }
+        return endpoints
+
+
+async def sample_memory(samples: list, interval: float = 0.25):
+    while True:
+        samples.append(rss_bytes())
+        await asyncio.sleep(interval)
+
+
+async def timed_request(client, recorder: Recorder, endpoint: str, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        recorder.record(endpoint, time.perf_counter() - started, response.status_code)
+        return response
+    except Exception:
+        recorder.record(endpoint, time.perf_counter() - started, None)
+        return None
+
+
+async def timed_stream(client, recorder: Recorder, payload: dict):
+    """
+    Mide /chat/stream completo y el tiempo hasta el primer token. Un stream que responde 200
+    pero emite `event: error` se registra como fallido (`stream_error`).
+    """
+    started = time.perf_counter()
+    first_token = None
+    stream_error = False
+    try:
+        async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+            async for line in response.aiter_lines():
+                if line == "event: error":
+                    stream_error = True
+                if first_token is None and line == "event: token":
+                    first_token = time.perf_counter() - started
+                    recorder.record("/api/chat/stream (primer token)", first_token, response.status_code)
+            status = "stream_error" if stream_error else response.status_code
+            recorder.record("/api/chat/stream", time.perf_counter() - started, status)
+        return response
+    except Exception:
+        recorder.record("/api/chat/stream", time.perf_counter() - started, None)
+        return None
+
+
+async def run_session(client, recorder: Recorder, semaphore: asyncio.Semaphore, args: argparse.Namespace,
+                      session_id: str, rng: random.Random):
+    for turn in range(args.turns):
+        template = QUESTION_TEMPLATES[rng.randrange(4)] if turn == 0 else rng.choice(QUESTION_TEMPLATES)
+        payload = {"session_id": session_id, "user_question": template.format(topic=rng.choice(TOPICS))}
+        use_stream = rng.random() < args.stream_ratio
+        for attempt in range(args.max_client_retries + 1):
+            async with semaphore:
+                if use_stream:
+                    response = await timed_stream(client, recorder, payload)
+                else:
+                    response = await timed_request(client, recorder, "/api/chat", "POST", "/api/chat", json=payload)
+            if response is None or response.status_code != 429 or attempt == args.max_client_retries:
+                break
+            # El cliente respeta Retry-After en vez de reintentar de inmediato
+            await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+        if args.think_time_ms:
+            await asyncio.sleep(args.think_time_ms / 1000)
+    # Los logs se escriben en lote: esperar un ciclo del escritor antes de leer el historial
+    await asyncio.sleep(args.history_delay_ms / 1000)
+    await timed_request(client, recorder, "/api/chat/history/{session_id}", "GET",
+                        f"/api/chat/history/{session_id}", params={"limit": 20})
+
+
+def parse_stage_metrics(exposition: str) -> dict:
+    """Duración media y total por etapa a partir de `chatbot_stage_duration_seconds` en /metrics."""
+    sums, counts = {}, {}
+    for line in exposition.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"chatbot_stage_duration_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split("\"}", 1)
+                target[stage] = float(value)
+    return {
+        stage: {"count": int(counts[stage]), "mean_ms": round(sums[stage] / counts[stage] * 1000, 2) if counts[stage] else 0.0}
+        for stage in sums if stage in counts
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_baseline(results: dict, baseline_path: str):
+    """Imprime la variación de throughput y p95 respecto de una ejecución anterior."""
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"\n📈 Comparación con {baseline_path} ({baseline.get('git_commit')}):")
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        p95_delta = current["latency_ms"]["p95"] - previous["latency_ms"]["p95"]
+        rps_delta = current["throughput_rps"] - previous["throughput_rps"]
+        print(f"   • {endpoint}: p95 {current['latency_ms']['p95']} ms ({p95_delta:+.1f}), "
+              f"{current['throughput_rps']} rps ({rps_delta:+.2f})")
+
+
+async def run_benchmark(args: argparse.Namespace, workdir: str) -> dict:
+    configure_environment(args, workdir)
+    fakes = build_fakes(args)
+
+    # Reemplazar los clientes de Azure antes de que la aplicación los use
+    import azure_ai_search
+    from rate_limits import RateLimitedEmbeddings, get_embeddings_scheduler
+    azure_ai_search._embeddings = RateLimitedEmbeddings(fakes["embeddings"], get_embeddings_scheduler())
+    import database
+    real_open_connection = database._open_connection
+    database._open_connection = lambda: _SlowConnection(real_open_connection(), args.db_latency_ms / 1000)
+
+    from vector_index import get_local_vector_index
+    index = get_local_vector_index()
+    seed_corpus(index, fakes["embeddings"], args.corpus_size)
+
+    import uvicorn
+    import httpx
+    import main
+    from langchain.chains import ConversationalRetrievalChain
+    from chatbot_app import initialize_rag_chat_chain
+    from registry import get_component_registry
+    from settings import get_settings
+
+    settings = get_settings()
+    prompt = initialize_rag_chat_chain().combine_docs_chain.llm_chain.prompt
+    get_component_registry().override("rag_chain", ConversationalRetrievalChain.from_llm(
+        llm=fakes["llm"],
+        retriever=fakes["retriever_class"](
+            index=index,
+            embeddings=fakes["embeddings"],
+            k=settings.retriever_top_k,
+            latency_ms=args.search_latency_ms,
+            error_rate=args.search_error_rate,
+        ),
+        combine_docs_chain_kwargs={"prompt": prompt},
+    ))
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    recorder = Recorder()
+    memory_samples: list = [rss_bytes()]
+    sampler = asyncio.create_task(sample_memory(memory_samples))
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+
+    print(f"🚀 Benchmark: {args.sessions} sesiones x {args.turns} turnos, concurrencia {args.concurrency}.")
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_session(client, recorder, semaphore, args, f"bench-{i}", random.Random(rng.random()))
+            for i in range(args.sessions)
+        ))
+        wall_seconds = time.perf_counter() - started
+        await timed_request(client, recorder, "/api/chat/stats", "GET", "/api/chat/stats")
+        stats_response = await client.get("/api/chat/stats")
+        app_stats = stats_response.json() if stats_response.status_code == 200 else None
+        metrics_response = await client.get("/metrics")
+        stages = parse_stage_metrics(metrics_response.text) if metrics_response.status_code == 200 else None
+
+    sampler.cancel()
+    memory_samples.append(rss_bytes())
+    server.should_exit = True
+    await server_task
+
+    chat_requests = sum(len(recorder.latencies.get(endpoint, [])) for endpoint in ("/api/chat", "/api/chat/stream"))
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "wall_seconds": round(wall_seconds, 3),
+        "chat_throughput_rps": round(chat_requests / wall_seconds, 2),
+        "endpoints": recorder.summary(wall_seconds),
+        "memory": {
+            "rss_start_mb": round(memory_samples[0] / 2**20, 1),
+            "rss_end_mb": round(memory_samples[-1] / 2**20, 1),
+            "rss_peak_mb": round(max(memory_samples) / 2**20, 1),
+            "rss_growth_mb": round((memory_samples[-1] - memory_samples[0]) / 2**20, 1),
+        },
+        "stages": stages,
+        "service_throttled": fakes["quota"].throttled,
+        "app_stats": app_stats,
+    }
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory(prefix="chatbot-benchmark-") as workdir:
+        results = asyncio.run(run_benchmark(args, workdir))
+
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, ensure_ascii=False, indent=2, default=str)
+
+    print(f"\n✅ {results['chat_throughput_rps']} solicitudes de chat por segundo en {results['wall_seconds']} s.")
+    for endpoint, summary in results["endpoints"].items():
+        latency = summary["latency_ms"]
+        print(f"   • {endpoint}: {summary['requests']} solicitudes, {summary['errors']} errores, "
+              f"p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms")
+    for stage, summary in (results["stages"] or {}).items():
+        print(f"   • Etapa {stage}: {summary['count']} ejecuciones, media {summary['mean_ms']} ms")
+    if args.llm_tpm:
+        print(f"   • Cuota simulada de {args.llm_tpm} TPM: {results['service_throttled']} respuestas 429 del servicio")
+    print(f"   • Memoria: {results['memory']['rss_start_mb']} MB -> {results['memory']['rss_end_mb']} MB "
+          f"(pico {results['memory']['rss_peak_mb']} MB)")
+    print(f"📄 Resultados guardados en {args.output}")
+
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
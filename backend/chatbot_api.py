@@ -1,13 +1,31 @@
-from typing import Optional
+import json
+import math
+import uuid
+from typing import Callable, Optional
+from contextlib import aclosing
 from datetime import datetime, timedelta
-from models import ChatResponse, ChatRequest
-from database import init_db, store_logs, get_db_connection
-from chatbot_app import initialize_rag_chat_chain, generate_response, generate_logs
-from fastapi import FastAPI, HTTPException, APIRouter, Depends, BackgroundTasks
+from models import ChatResponse, ChatRequest, BatchRequest
+from database import (
+    fetch_session_logs, delete_session_logs,
+    count_active_sessions, fetch_usage_rollups, get_db_pool
+)
+from chatbot_app import (
+    generate_response_with_logs, stream_response_with_logs, condense_stats, coalescer, history_summarizer
+)
+from batch_answers import BatchRunner, batch_stats
+from registry import get_component_registry
+from settings import get_settings
+from concurrency import get_llm_limiter, QueueTimeoutError
+from rate_limits import RateLimitExceeded, get_llm_scheduler, get_embeddings_scheduler
+from log_writer import get_log_writer
+from retention import get_retention_scheduler
+import metrics
+from fastapi import FastAPI, HTTPException, APIRouter, Depends, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
 
-# Inicializar la base de datos
-init_db()
+settings = get_settings()
 
 # Inicializar FastAPI
 app = FastAPI()
@@ -15,51 +33,216 @@ app = FastAPI()
 # Inicializar el router
 router = APIRouter()
 
-# Inicializar cadena conversacional RAG
-rag_chain = initialize_rag_chat_chain()
+# Cadena RAG, caché de respuestas y clientes (se crean en el lifespan de main.py o al primer uso)
+components = get_component_registry()
+
+
+# Límite de ejecuciones simultáneas de la cadena RAG
+llm_limiter = get_llm_limiter()
+
+# Admisión según la cuota (RPM/TPM) del deployment de Azure OpenAI
+llm_scheduler = get_llm_scheduler()
+
+# Escritor de logs en lote (se inicia en el lifespan de main.py)
+log_writer = get_log_writer()
+
+# Retención periódica de logs (se programa en el lifespan de main.py)
+retention_scheduler = get_retention_scheduler()
+
+# Gauges calculados al momento de exponer las métricas
+metrics.LLM_IN_FLIGHT.set_function(lambda: llm_limiter.stats()["in_flight"])
+metrics.LLM_WAITING.set_function(lambda: llm_limiter.stats()["waiting"])
+metrics.LOG_QUEUE.set_function(lambda: log_writer.stats()["queued"])
+metrics.DB_POOL_IN_USE.set_function(lambda: get_db_pool().stats()["in_use"])
+
+
+def rate_limited(e: RateLimitExceeded) -> HTTPException:
+    """429 con la espera sugerida, para que el cliente no reintente de inmediato."""
+    return HTTPException(
+        status_code=429,
+        detail=f"Demasiadas solicitudes: {str(e)}",
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+
+def record_logs(costs_logs: dict):
+    """Suma la interacción a las métricas y encola sus logs para escribirlos en Turso."""
+    metrics.observe_interaction(costs_logs)
+    log_writer.submit(costs_logs)
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que al terminar cierra su generador y llama a `on_close`, también si el
+    cliente se desconecta antes de que empiece el cuerpo (el `finally` de un generador que
+    nunca se inició no se ejecuta).
+    """
+
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                self.on_close()
 
 
 # Fast API
 @router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
+async def chat_endpoint(request: ChatRequest):
     """
     Endpoint para interactuar con el chatbot y guardar automáticamente los logs en la base de datos.
     """
     try:
-        # Generar la respuesta del modelo
-        response = generate_response(rag_chain, request.user_question, request.session_id)
-
-        # Generar los logs
-        costs_logs = generate_logs(rag_chain, request.user_question, request.session_id)
-
-        # Guardar los logs en la base de datos Turso  
-        store_logs(costs_logs)
+        # Generar la respuesta del modelo y sus logs en una sola ejecución de la cadena
+        rag_chain = await components.aget("rag_chain")
+        answer_cache = await components.aget("answer_cache")
+        session_store = await components.aget("session_store")
+        with llm_scheduler.admission(request.session_id):
+            async with llm_limiter.slot():
+                response, costs_logs = await generate_response_with_logs(rag_chain, session_store, answer_cache, request.user_question, request.session_id)
 
-        # Programar una tarea en segundo plano para limpiar conversaciones antiguas
-        background_tasks.add_task(clean_old_logs, max_age_hours=72)
+        # Encolar los logs; se guardan en Turso en lote fuera de la solicitud
+        record_logs(costs_logs)
 
         # Devolver solo la respuesta al cliente
         return ChatResponse(llm_answer=response)
 
+    except RateLimitExceeded as e:
+        raise rate_limited(e)
+    except QueueTimeoutError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"El servicio está ocupado: {str(e)}",
+            headers={"Retry-After": str(int(e.timeout))}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+@router.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """
+    Endpoint para interactuar con el chatbot recibiendo la respuesta token a token (SSE).
+    Envía primero los metadatos de recuperación y registra los logs al terminar el stream.
+    """
+    try:
+        rag_chain = await components.aget("rag_chain")
+        answer_cache = await components.aget("answer_cache")
+        session_store = await components.aget("session_store")
+        admission = llm_scheduler.admit(request.session_id)
+    except RateLimitExceeded as e:
+        raise rate_limited(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    try:
+        await llm_limiter.acquire()
+    except QueueTimeoutError as e:
+        llm_scheduler.release(admission)
+        raise HTTPException(
+            status_code=503,
+            detail=f"El servicio está ocupado: {str(e)}",
+            headers={"Retry-After": str(int(e.timeout))}
+        )
+
+    async def event_stream():
+        try:
+            # aclosing cancela la generación en curso si el cliente se desconecta
+            with llm_scheduler.bind(admission):
+                async with aclosing(stream_response_with_logs(
+                    rag_chain, session_store, answer_cache, request.user_question, request.session_id, record_logs
+                )) as events:
+                    async for event in events:
+                        if await http_request.is_disconnected():
+                            break
+                        yield format_sse(event["event"], event["data"])
+        except RateLimitExceeded as e:
+            yield format_sse("error", {"detail": f"Demasiadas solicitudes: {str(e)}",
+                                       "retry_after": math.ceil(e.retry_after)})
+        except Exception as e:
+            yield format_sse("error", {"detail": f"Error: {str(e)}"})
+
+    def release():
+        llm_scheduler.release(admission)
+        llm_limiter.release()
+
+    return ReleasingStreamingResponse(
+        event_stream(),
+        on_close=release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/chat/batch")
+async def chat_batch_endpoint(request: BatchRequest, http_request: Request):
+    """
+    Endpoint para responder en lote preguntas independientes (sin historial ni caché de respuestas),
+    pensado para evaluaciones offline. Devuelve NDJSON: una línea por pregunta a medida que termina,
+    con su respuesta, documentos, uso de tokens y latencia, y al final una línea con el resumen del lote.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="El lote no tiene preguntas.")
+    if len(request.questions) > settings.batch_max_questions:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote supera el máximo de {settings.batch_max_questions} preguntas; divídelo en varios."
+        )
+    rag_chain = await components.aget("rag_chain")
+    max_concurrency = min(request.max_concurrency or settings.batch_max_concurrency, settings.batch_max_concurrency)
+    runner = BatchRunner(rag_chain, max(max_concurrency, 1), settings.batch_item_max_attempts, record_logs)
+    # Siempre una sesión nueva: los logs del lote no se mezclan con los de una conversación existente
+    session_id = f"batch-{uuid.uuid4().hex[:12]}"
+    questions = [(question.id, question.user_question) for question in request.questions]
+
+    async def ndjson_lines():
+        # aclosing cancela las preguntas pendientes si el cliente se desconecta
+        async with aclosing(runner.run(session_id, questions)) as results:
+            async for result in results:
+                if await http_request.is_disconnected():
+                    break
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/chat/history/{session_id}")
-async def get_conversation_history(session_id: str):
+async def get_conversation_history(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """
-    Endpoint para recuperar el historial de una conversación específica.
+    Endpoint para recuperar el historial de una conversación específica, paginado.
+    `cursor` es el `next_cursor` de la página anterior y `fields` una lista de columnas
+    separadas por comas.
     """
     try:
-        conn = get_db_connection()
-        result = conn.execute("SELECT * FROM logs WHERE session_id = ?;", (session_id,))
-        logs = result.fetchall()
+        requested_fields = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        try:
+            logs, next_cursor = await run_in_threadpool(
+                fetch_session_logs, session_id, limit, cursor, requested_fields
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        if not logs:
+        if not logs and cursor is None:
             raise HTTPException(status_code=404, detail=f"No se encontró historial para la sesión {session_id}")
 
-        return {"session_id": session_id, "logs": logs}
+        return {"session_id": session_id, "logs": logs, "next_cursor": next_cursor}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al recuperar el historial: {str(e)}")
 
@@ -69,13 +252,16 @@ async def delete_conversation(session_id: str):
     Endpoint para eliminar el historial de una conversación específica.
     """
     try:
-        conn = get_db_connection()
-        result = conn.execute("DELETE FROM logs WHERE session_id = ?;", (session_id,))
-        if result.rowcount == 0:
+        deleted_rows = await run_in_threadpool(delete_session_logs, session_id)
+        session_store = await components.aget("session_store")
+        await session_store.aclear(session_id)
+        if deleted_rows == 0:
             raise HTTPException(status_code=404, detail=f"No se encontró historial para la sesión {session_id}")
 
         return {"message": f"Historial de la sesión {session_id} eliminado exitosamente"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al eliminar el historial: {str(e)}")
 
@@ -83,14 +269,30 @@ async def delete_conversation(session_id: str):
 async def get_chat_stats():
     """
     Endpoint para obtener estadísticas del servicio de chat.
+    El uso de las últimas 24 horas se lee de los agregados por hora, sin recorrer los logs.
     """
     try:
-        conn = get_db_connection()
-        result = conn.execute("SELECT COUNT(DISTINCT session_id) AS active_sessions FROM logs;")
-        active_sessions = result.fetchone()[0]
+        since = (datetime.utcnow() - timedelta(hours=24)).isoformat()
+        active_sessions = await run_in_threadpool(count_active_sessions, since)
+        usage = await run_in_threadpool(fetch_usage_rollups, "hour", since)
+        answer_cache = await components.aget("answer_cache")
+        session_store = await components.aget("session_store")
 
         return {
             "active_sessions": active_sessions,
+            "usage_last_24h": summarize_usage(usage),
+            "memory": session_store.stats(),
+            "llm_concurrency": llm_limiter.stats(),
+            "rate_limits": {"llm": llm_scheduler.stats(), "embeddings": get_embeddings_scheduler().stats()},
+            "condense": dict(condense_stats),
+            "answer_cache": answer_cache.stats() if answer_cache else None,
+            "coalescing": coalescer.stats() if coalescer else None,
+            "history_summaries": history_summarizer.stats() if history_summarizer else None,
+            "batch": dict(batch_stats),
+            "db_pool": get_db_pool().stats(),
+            "log_writer": log_writer.stats(),
+            "retention": retention_scheduler.stats(),
+            "components": components.stats(),
             "service_status": "healthy",
             "timestamp": datetime.utcnow().isoformat()
         }
@@ -98,14 +300,47 @@ async def get_chat_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas: {str(e)}")
 
+@router.get("/chat/stats/usage")
+async def get_usage_stats(
+    granularity: str = Query("hour", pattern="^(hour|day)$"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    deployment: Optional[str] = None
+):
+    """
+    Endpoint para consultar el uso (solicitudes, sesiones, tokens y costo) por hora o por día.
+    `start` y `end` son fechas ISO 8601 en UTC; ambos extremos se incluyen.
+    """
+    try:
+        buckets = await run_in_threadpool(fetch_usage_rollups, granularity, start, end, deployment)
+        return {
+            "granularity": granularity,
+            "start": start,
+            "end": end,
+            "deployment": deployment,
+            "totals": summarize_usage(buckets),
+            "buckets": buckets
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener el uso: {str(e)}")
+
 @router.post("/chat/cleanup")
 async def cleanup_conversations(max_age_hours: int = 72):
-    """Endpoint para limpiar conversaciones antiguas."""
+    """
+    Endpoint para limpiar conversaciones antiguas.
+    Ejecuta una pasada del trabajo de retención; se omite si ya hay una en curso.
+    """
     try:
-        conn = get_db_connection()
-        cutoff_time = datetime.utcnow() - timedelta(hours=max_age_hours)
-        conn.execute("DELETE FROM logs WHERE date_processed < ?;", (cutoff_time.isoformat(),))
-        return {"message": f"Conversaciones más antiguas que {max_age_hours} horas eliminadas exitosamente"}
+        result = await retention_scheduler.run_once(max_age_hours=max_age_hours)
+        if result["status"] == "failed":
+            raise HTTPException(status_code=500, detail=f"Error al limpiar conversaciones: {result['error']}")
+        if result["status"] == "skipped":
+            return {"message": f"Limpieza omitida: {result['reason']}", **result}
+        return {"message": f"Conversaciones más antiguas que {max_age_hours} horas eliminadas exitosamente", **result}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al limpiar conversaciones: {str(e)}")
 
@@ -123,13 +358,19 @@ async def health_check():
     except Exception as e:
         raise HTTPException(status_code=503, detail="El servicio de chat no está saludable")
 
-def clean_old_logs(max_age_hours: int):
+def summarize_usage(buckets: list) -> dict:
     """
-    Limpia los registros antiguos de la base de datos.
+    Suma los agregados de uso de varios buckets. Las sesiones no se pueden sumar entre buckets
+    (una sesión puede aparecer en varios); se informa el máximo por bucket.
     """
-    try:
-        conn = get_db_connection()
-        cutoff_time = datetime.utcnow() - timedelta(hours=max_age_hours)
-        conn.execute("DELETE FROM logs WHERE date_processed < ?;", (cutoff_time.isoformat(),))
-    except Exception as e:
-        print(f"Error al limpiar registros antiguos: {str(e)}")
\ No newline at end of file
+    totals = {
+        metric: sum(bucket[metric] for bucket in buckets)
+        for metric in ("requests", "prompt_tokens", "completion_tokens", "total_tokens",
+                       "total_cost_usd", "cache_hits", "saved_cost_usd")
+    }
+    totals["max_sessions_per_bucket"] = max((bucket["sessions"] for bucket in buckets), default=0)
+    return totals
+
+def format_sse(event: str, data: dict) -> str:
+    """Formatea un evento server-sent events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
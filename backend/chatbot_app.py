@@ -1,18 +1,47 @@
 from langchain.retrievers import AzureCognitiveSearchRetriever
 from langchain.chains import ConversationalRetrievalChain
 from langchain.chat_models import AzureChatOpenAI
-from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.prompts import MessagesPlaceholder
 from langchain.callbacks import get_openai_callback
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+from langchain_community.callbacks.manager import openai_callback_var
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.prompt_values import PromptValue
+from langchain_core.prompts import format_document
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Optional
 from datetime import datetime, timezone
+import time
 from settings import get_settings  # Importar configuraciones centralizadas
+from answer_cache import SemanticAnswerCache, CacheLookup
+from vector_index import LocalVectorRetriever, get_local_vector_index
+from context_packing import get_context_packer, count_tokens, tokenize
+from coalescing import GenerationFlight, RequestCoalescer, get_request_coalescer
+from conversation_history import select_history, get_history_summarizer
+from memory_store import Conversation
+from rate_limits import RateLimitExceeded, estimate_tokens, get_llm_scheduler
+from metrics import stage_timer
 
 
 # Obtener configuraciones desde settings.py  
 settings = get_settings()
 
+# Selección de los documentos que entran al prompt (None: se usan todos los recuperados)
+context_packer = get_context_packer() if settings.context_packing_enabled else None
+
+# Generaciones compartidas entre solicitudes idénticas en curso (None: cada solicitud genera la suya)
+coalescer = get_request_coalescer() if settings.coalescing_enabled else None
+
+# Resumen incremental de los turnos que salen de la ventana del historial (None: se descartan)
+history_summarizer = get_history_summarizer() if settings.history_summary_enabled else None
+
+# Turnos y reintentos de las llamadas al LLM según la cuota del deployment
+llm_scheduler = get_llm_scheduler()
+
 
 def initialize_rag_chat_chain():
     """  
@@ -57,69 +86,458 @@ def initialize_rag_chat_chain():
         azure_endpoint=settings.azure_openai_endpoint,  
         api_key=settings.azure_openai_api_key,  
         azure_deployment=settings.azure_openai_deployment_name,  
-        deployment_name='chat'  
-    )  
-  
-    # Inicializar el retriever  
-    retriever: AzureCognitiveSearchRetriever = AzureCognitiveSearchRetriever(  
-        service_name=settings.azure_search_name,  
-        index_name=settings.azure_search_index_name,  
-        api_key=settings.azure_search_api_key,  
-        content_key='content',  
-        top_k=10  
+        deployment_name='chat',  
+        max_retries=0  # Los reintentos los hace el planificador de cuota (rate_limits.py)  
     )  
   
-    # Inicializar memoria de conversación  
-    chat_memory: ConversationBufferMemory = ConversationBufferMemory(  
-        memory_key="chat_history",  
-        return_messages=True  
-    )  
+    # Inicializar el retriever (Azure AI Search o índice vectorial local)  
+    if settings.retriever_backend == "local":  
+        from azure_ai_search import get_embeddings  
+        retriever: BaseRetriever = LocalVectorRetriever(  
+            index=get_local_vector_index(),  
+            embeddings=get_embeddings(),  
+            k=settings.retriever_top_k  
+        )  
+    else:  
+        retriever: BaseRetriever = AzureCognitiveSearchRetriever(  
+            service_name=settings.azure_search_name,  
+            index_name=settings.azure_search_index_name,  
+            api_key=settings.azure_search_api_key,  
+            content_key='content',  
+            top_k=settings.retriever_top_k  
+        )  
   
-    # Cadena conversacional RAG  
+    # Cadena conversacional RAG (sin memoria propia: el historial se pasa por sesión)  
     rag_chain: ConversationalRetrievalChain = ConversationalRetrievalChain.from_llm(  
         llm=llm,  
-        memory=chat_memory,  
         retriever=retriever,  
         combine_docs_chain_kwargs={'prompt': prompt}  
     )
 
-    return rag_chain  
-  
+    return rag_chain
+
+
+def warm_up_rag_chain(rag_chain, embeddings=None) -> dict:
+    """
+    Ejecuta una consulta mínima contra cada servicio (búsqueda, embeddings y LLM con un token)
+    para abrir las conexiones antes de la primera solicitud real. Devuelve el tiempo de cada paso en ms.
+    """
+    timings: dict = {}
+    question = "¿Cómo organizo el inventario?"
+    with stage_timer("warmup_retrieve", timings):
+        rag_chain.retriever.invoke(question)
+    if embeddings is not None:
+        with stage_timer("warmup_embed", timings):
+            embeddings.embed_query(question)
+    with stage_timer("warmup_llm", timings):
+        rag_chain.combine_docs_chain.llm_chain.llm.invoke("Hola", max_tokens=1)
+    return timings
+
+
+# Palabras que indican que la pregunta depende de turnos anteriores (sin tildes)  
+FOLLOW_UP_WORDS: set = {  
+    "eso", "esto", "ese", "esa", "esos", "esas", "este", "esta", "estos", "estas", "ello",  
+    "aquello", "aquel", "aquella", "anterior", "anteriores", "mismo", "misma", "dicho", "dicha",  
+    "tambien", "ademas", "otro", "otra", "otros", "otras", "ultimo", "ultima", "previo", "previa",  
+}  
+FOLLOW_UP_OPENERS: set = {"y", "pero", "entonces", "o", "ahora", "mas", "luego"}  
+FOLLOW_UP_SUFFIXES: tuple = ("melo", "mela", "selo", "sela", "noslo", "nosla")  
+MIN_STANDALONE_WORDS: int = 4  
+
+# Contadores de la etapa de reformulación  
+condense_stats: dict = {"rewritten": 0, "skipped_no_history": 0, "skipped_standalone": 0}  
+
+
+def is_standalone_question(question: str) -> bool:  
+    """  
+    Heurística local: la pregunta se entiende sin el historial si no es demasiado corta,  
+    no empieza con un conector de seguimiento ("¿y...?", "entonces...") y no usa  
+    demostrativos ni pronombres que remitan a turnos anteriores ("eso", "explícamelo").  
+    Ante la duda devuelve False y la pregunta se reformula con el LLM.  
+    """  
+    words = tokenize(question)  
+    if len(words) < MIN_STANDALONE_WORDS or words[0] in FOLLOW_UP_OPENERS:  
+        return False  
+    return not any(word in FOLLOW_UP_WORDS or word.endswith(FOLLOW_UP_SUFFIXES) for word in words)  
+
+
+# Etapa 1: reformular la pregunta con el historial de la sesión  
+async def condense_question(rag_chain, user_question: str, conversation: Conversation) -> tuple[str, int]:  
+    """  
+    Reformula la pregunta como una pregunta independiente usando el historial.  
+    Si no hay historial, o la heurística local indica que la pregunta ya es independiente,  
+    se devuelve tal cual y se evita la llamada al LLM.  
+    Al prompt solo entran el resumen de la sesión y los últimos turnos que caben en  
+    HISTORY_TOKEN_BUDGET. Devuelve la pregunta y los tokens de historial que no se enviaron.  
+    """  
+    if not conversation.turns:  
+        condense_stats["skipped_no_history"] += 1  
+        return user_question, 0  
+    if settings.condense_skip_standalone and is_standalone_question(user_question):  
+        condense_stats["skipped_standalone"] += 1  
+        return user_question, 0  
+    condense_stats["rewritten"] += 1  
+    window = select_history(conversation, rag_chain.question_generator.llm.model_name,  
+                            settings.history_max_turns, settings.history_token_budget,  
+                            keep_unsummarized=history_summarizer is not None)  
+    get_chat_history = rag_chain.get_chat_history or _get_chat_history  
+    chat_history = get_chat_history(window.turns)  
+    if window.summary:  
+        chat_history = f"Resumen de la conversación anterior: {window.summary}\n{chat_history}"  
+    inputs = {"question": user_question, "chat_history": chat_history}  
+    result = await llm_scheduler.call(  
+        lambda: rag_chain.question_generator.ainvoke(inputs),  
+        estimate_tokens(rag_chain.question_generator.prompt.format(**inputs), settings.rate_limit_completion_tokens)  
+    )  
+    return result[rag_chain.question_generator.output_key], window.tokens_saved  
+
+
+async def remember_turn(rag_chain, session_store, session_id: str, user_question: str, answer: str):  
+    """Agrega el turno al historial y, si corresponde, actualiza el resumen de la sesión en segundo plano."""  
+    await session_store.aappend_turn(session_id, user_question, answer)  
+    if history_summarizer is not None:  
+        history_summarizer.schedule(session_store, rag_chain.question_generator.llm, session_id)  
+
+
+# Etapa 2: recuperar los documentos relevantes  
+async def retrieve_documents(rag_chain, standalone_question: str) -> list[Document]:  
+    """Recupera los documentos relevantes para la pregunta independiente."""  
+    return await rag_chain.retriever.ainvoke(standalone_question)  
+
+
+# Etapa 2b: deduplicar, reordenar y recortar los documentos al presupuesto de tokens  
+def pack_context(rag_chain, standalone_question: str, documents: list[Document]) -> list[Document]:  
+    """Deja solo los documentos que caben en el presupuesto de contexto del prompt."""  
+    if context_packer is None:  
+        return documents  
+    model_name = rag_chain.combine_docs_chain.llm_chain.llm.model_name  
+    packed = context_packer.pack(standalone_question, documents, model_name)  
+    if settings.log_level == "DEBUG":  
+        print(f"📦 Contexto: {len(packed.kept)} de {len(documents)} documentos, {packed.context_tokens} tokens.")  
+        for entry in packed.kept:  
+            print(f"   ✔ {entry['id']} (posición {entry['rank']}, puntaje {entry['score']}, {entry['tokens']} tokens)")  
+        for entry in packed.dropped:  
+            print(f"   ✘ {entry['id']} (posición {entry['rank']}): {entry['reason']}")  
+    return packed.documents  
+
+
+# Etapa 3: construir el prompt de respuesta con los documentos recuperados  
+def build_answer_prompt(rag_chain, documents: list[Document], standalone_question: str) -> PromptValue:  
+    """Formatea el prompt del asistente con el contexto y la pregunta."""  
+    combine_docs_chain = rag_chain.combine_docs_chain  
+    context = combine_docs_chain.document_separator.join(  
+        format_document(doc, combine_docs_chain.document_prompt) for doc in documents  
+    )  
+    return combine_docs_chain.llm_chain.prompt.format_prompt(context=context, question=standalone_question)  
+
+
+def summarize_documents(documents: list[Document]) -> list[dict]:  
+    """Resume los metadatos de recuperación que se envían al cliente."""  
+    return [  
+        {  
+            "id": doc.metadata.get("id"),  
+            "score": doc.metadata.get("@search.score"),  
+            "source": doc.metadata.get("source") or doc.metadata.get("metadata"),  
+        }  
+        for doc in documents  
+    ]  
+
+
+def build_logs(session_id: str, user_question: str, llm_answer: str, prompt_tokens: int,  
+               completion_tokens: int, total_cost_usd: float, cache_hit: bool = False,  
+               saved_cost_usd: float = 0.0, stage_timings_ms: Optional[dict] = None,  
+               coalesced: bool = False, history_tokens_saved: int = 0) -> dict:  
+    """Construye el diccionario de logs de una interacción."""  
+    return {  
+        "session_id": session_id,  
+        "total_tokens": prompt_tokens + completion_tokens,  
+        "prompt_tokens": prompt_tokens,  
+        "completion_tokens": completion_tokens,  
+        "total_cost_usd": total_cost_usd,  
+        "user_question": user_question,  
+        "llm_answer": llm_answer,  
+        "date_processed": datetime.now(timezone.utc).isoformat(),  
+        "cache_hit": cache_hit,  
+        "saved_cost_usd": saved_cost_usd,  
+        "deployment": settings.azure_openai_deployment_name,  
+        "stage_timings_ms": stage_timings_ms or {},  
+        "coalesced": coalesced,  
+        "history_tokens_saved": history_tokens_saved  
+    }  
+
+
+async def lookup_cached_answer(answer_cache: Optional[SemanticAnswerCache], standalone_question: str) -> Optional[CacheLookup]:  
+    """Busca la pregunta independiente en la caché de respuestas (si está habilitada)."""  
+    if answer_cache is None:  
+        return None  
+    return await answer_cache.lookup(standalone_question)  
+
 
-# Función para generar la respuesta del modelo  
-def generate_response(rag_chain, user_question: str, session_id: str) -> str:  
+def build_cached_logs(session_id: str, user_question: str, lookup: CacheLookup, cb, timings: dict,  
+                      history_tokens_saved: int = 0) -> dict:  
     """  
-    Genera la respuesta del modelo basada en la pregunta del usuario.  
+    Logs de una respuesta servida desde la caché: solo se registran los tokens realmente  
+    consumidos (la reformulación, si hubo historial) y el costo ahorrado.  
     """  
+    return build_logs(session_id, user_question, lookup.entry.answer, cb.prompt_tokens,  
+                      cb.completion_tokens, cb.total_cost, cache_hit=True,  
+                      saved_cost_usd=lookup.entry.total_cost_usd, stage_timings_ms=timings,  
+                      history_tokens_saved=history_tokens_saved)  
+
+
+# Etapa 3b: generación compartida entre solicitudes idénticas en curso  
+async def _isolated_stream(llm, prompt_value: PromptValue) -> AsyncIterator:  
+    """  
+    Stream del LLM de una generación compartida. Corre en la tarea de la generación, por lo que  
+    se quita el callback de costos de la solicitud que la inició: el uso se atribuye al liquidarla.  
+    Espera su turno en la cuota del deployment y se reintenta si falla antes del primer fragmento.  
+    """  
+    openai_callback_var.set(None)  
+    tokens = estimate_tokens(prompt_value.to_string(), settings.rate_limit_completion_tokens)  
+    async with aclosing(llm_scheduler.stream(lambda: llm.astream(prompt_value), tokens)) as stream:  
+        async for chunk in stream:  
+            yield chunk  
+
+
+def start_generation(rag_chain, standalone_question: str, documents: list[Document],  
+                     prompt_value: PromptValue) -> tuple[GenerationFlight, bool]:  
+    """  
+    Se suma a una generación en curso con la misma pregunta normalizada y los mismos documentos,  
+    o inicia una. Devuelve la generación y si la inició esta solicitud.  
+    """  
+    llm = rag_chain.combine_docs_chain.llm_chain.llm  
+    produce = lambda: _isolated_stream(llm, prompt_value)  
+    if coalescer is None:  
+        flight = GenerationFlight(produce)  
+        flight.join()  
+        return flight, True  
+    return coalescer.join(RequestCoalescer.key(standalone_question, documents), produce)  
+
+
+def settle_generation(flight: GenerationFlight, llm, prompt_text: str, started: bool) -> dict:  
+    """  
+    Retira la solicitud de la generación y devuelve el uso que se le atribuye. Paga el primer  
+    participante en liquidarla (o el último en irse si se canceló); los demás registran como  
+    ahorro el costo de la respuesta que recibieron. Si se canceló o falló antes del primer  
+    fragmento no hubo generación que cobrar y todos registran uso cero.  
+    """  
+    owes_partial = flight.leave()  
+    if flight.usage is None and (flight.done or owes_partial):  
+        flight.usage = (_streamed_usage(llm, flight.final_chunk, prompt_text, flight.answer) if flight.generated  
+                        else (0, 0, 0.0))  
+    if (owes_partial or flight.claim_usage()) and flight.generated:  
+        prompt_tokens, completion_tokens, cost = flight.usage  
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cost": cost,  
+                "saved_cost_usd": 0.0, "paid": True, "coalesced": not started}  
+    saved_cost = flight.usage[2] if flight.completed else 0.0  
+    return {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0,  
+            "saved_cost_usd": saved_cost, "paid": False, "coalesced": not started}  
+
+
+async def generate_shared(rag_chain, standalone_question: str, documents: list[Document]) -> tuple[str, dict]:  
+    """Genera la respuesta completa a través de una generación compartida; devuelve (respuesta, uso)."""  
+    prompt_value = build_answer_prompt(rag_chain, documents, standalone_question)  
+    flight, started = start_generation(rag_chain, standalone_question, documents, prompt_value)  
     try:  
-        # Ejecutar la cadena conversacional para obtener la respuesta  
-        response = rag_chain.run(question=user_question)  
-        return response
-    except Exception as e:  
-        raise Exception(f"Error al generar la respuesta: {str(e)}")  
+        parts = [text async for text in flight.subscribe()]  
+    finally:  
+        usage = settle_generation(flight, rag_chain.combine_docs_chain.llm_chain.llm,  
+                                  prompt_value.to_string(), started)  
+    return "".join(parts), usage  
 
 
-# Función para generar los logs  
-def generate_logs(rag_chain, user_question: str, session_id: str) -> dict:  
+# Función para generar la respuesta del modelo junto con sus logs  
+async def generate_response_with_logs(rag_chain, session_store,  
+                                      answer_cache: Optional[SemanticAnswerCache],  
+                                      user_question: str, session_id: str) -> tuple[str, dict]:  
     """  
-    Genera los logs relacionados con la interacción.  
+    Ejecuta la cadena conversacional una sola vez y devuelve la respuesta del modelo  
+    junto con los logs de tokens y costos de esa misma ejecución.  
+    El historial de chat se lee y se actualiza solo para la sesión indicada.  
+    Si la pregunta reformulada ya tiene respuesta en caché, se omiten la recuperación y la generación.  
     """  
     try:  
-        # Ejecutar la cadena conversacional con registro de costos  
+        conversation = await session_store.aget_conversation(session_id)
+        timings: dict = {}  
+
+        # Ejecutar las etapas de la cadena conversacional con registro de costos y tiempos  
         with get_openai_callback() as cb:  
-            response = rag_chain.run(question=user_question)  
-  
-            # Diccionario de logs  
-            logs = {  
-                "session_id": session_id,  
-                "total_tokens": cb.total_tokens,  
-                "prompt_tokens": cb.prompt_tokens,  
-                "completion_tokens": cb.completion_tokens,  
-                "total_cost_usd": cb.total_cost,  
-                "user_question": user_question,  
-                "llm_answer": response,  
-                "date_processed": datetime.now(timezone.utc).isoformat()  
-            }  
-        return logs  
+            with stage_timer("condense", timings):  
+                standalone_question, history_tokens_saved = await condense_question(rag_chain, user_question, conversation)  
+            with stage_timer("cache_lookup", timings):  
+                lookup = await lookup_cached_answer(answer_cache, standalone_question)  
+
+            if lookup is not None and lookup.entry is not None:  
+                response = lookup.entry.answer  
+                logs = build_cached_logs(session_id, user_question, lookup, cb, timings, history_tokens_saved)  
+            else:  
+                condense_cost = (cb.prompt_tokens, cb.completion_tokens, cb.total_cost)  
+                with stage_timer("retrieve", timings):  
+                    documents = await retrieve_documents(rag_chain, standalone_question)  
+                with stage_timer("pack", timings):  
+                    documents = pack_context(rag_chain, standalone_question, documents)  
+                if coalescer is None:  
+                    prompt_text = build_answer_prompt(rag_chain, documents, standalone_question).to_string()  
+                    with stage_timer("generate", timings):  
+                        result = await llm_scheduler.call(  
+                            lambda: rag_chain.combine_docs_chain.ainvoke({  
+                                "input_documents": documents,  
+                                "question": standalone_question  
+                            }),  
+                            estimate_tokens(prompt_text, settings.rate_limit_completion_tokens)  
+                        )  
+                    response = result[rag_chain.combine_docs_chain.output_key]  
+                    usage = {"prompt_tokens": cb.prompt_tokens - condense_cost[0],  
+                             "completion_tokens": cb.completion_tokens - condense_cost[1],  
+                             "cost": cb.total_cost - condense_cost[2], "saved_cost_usd": 0.0, "paid": True,  
+                             "coalesced": False}  
+                    prompt_tokens, completion_tokens, total_cost = cb.prompt_tokens, cb.completion_tokens, cb.total_cost  
+                else:  
+                    # La generación compartida corre fuera del callback: su uso se suma aparte  
+                    with stage_timer("generate", timings):  
+                        response, usage = await generate_shared(rag_chain, standalone_question, documents)  
+                    prompt_tokens = cb.prompt_tokens + usage["prompt_tokens"]  
+                    completion_tokens = cb.completion_tokens + usage["completion_tokens"]  
+                    total_cost = cb.total_cost + usage["cost"]  
+                logs = build_logs(session_id, user_question, response, prompt_tokens, completion_tokens,  
+                                  total_cost, saved_cost_usd=usage["saved_cost_usd"], stage_timings_ms=timings,  
+                                  coalesced=usage["coalesced"], history_tokens_saved=history_tokens_saved)  
+
+                # Solo guarda en caché quien pagó la generación (una vez por generación compartida)  
+                if lookup is not None and usage["paid"]:  
+                    answer_cache.store(standalone_question, lookup.embedding, response, summarize_documents(documents),  
+                                       usage["prompt_tokens"], usage["completion_tokens"], usage["cost"],
+                                       generation=lookup.generation)  
+
+        await remember_turn(rag_chain, session_store, session_id, user_question, response)
+        return response, logs  
+    except RateLimitExceeded:  
+        raise  
     except Exception as e:  
-        raise Exception(f"Error al generar los logs: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error al generar la respuesta: {str(e)}")
+
+
+def _streamed_usage(llm, final_chunk, prompt_text: str, answer: str) -> tuple[int, int, float]:  
+    """  
+    Obtiene los tokens y el costo de una generación en streaming.  
+    Usa `usage_metadata` si el proveedor lo envía; si no, estima con tiktoken.  
+    """  
+    model_name = llm.model_name  
+    if final_chunk is not None:  
+        model_name = final_chunk.response_metadata.get("model_name") or model_name  
+    usage = getattr(final_chunk, "usage_metadata", None)  
+    if usage:  
+        prompt_tokens, completion_tokens = usage["input_tokens"], usage["output_tokens"]  
+    else:  
+        prompt_tokens = count_tokens(prompt_text, model_name)  
+        completion_tokens = count_tokens(answer, model_name)  
+    try:  
+        cost = (get_openai_token_cost_for_model(model_name, prompt_tokens)  
+                + get_openai_token_cost_for_model(model_name, completion_tokens, is_completion=True))  
+    except ValueError:  
+        cost = 0.0  # Modelo sin tarifa conocida  
+    return prompt_tokens, completion_tokens, cost  
+
+
+def _usage_event(logs: dict) -> dict:  
+    """Evento final del stream con el uso de tokens de la interacción."""  
+    return {"event": "done", "data": {  
+        "total_tokens": logs["total_tokens"],  
+        "prompt_tokens": logs["prompt_tokens"],  
+        "completion_tokens": logs["completion_tokens"],  
+        "total_cost_usd": logs["total_cost_usd"],  
+        "cache_hit": logs["cache_hit"],  
+        "coalesced": logs["coalesced"]  
+    }}  
+
+
+# Función para generar la respuesta del modelo en streaming  
+async def stream_response_with_logs(rag_chain, session_store,  
+                                    answer_cache: Optional[SemanticAnswerCache], user_question: str,  
+                                    session_id: str, on_logs: Callable[[dict], None]) -> AsyncIterator[dict]:  
+    """  
+    Genera la respuesta del modelo token a token.  
+
+    Emite primero un evento `metadata` con la pregunta reformulada y los documentos  
+    recuperados, luego un evento `token` por fragmento y, al terminar, un evento `done`  
+    con el uso de tokens. `on_logs` recibe los logs al finalizar, también si el cliente  
+    se desconecta a mitad de la respuesta (con la respuesta parcial).  
+    Las respuestas en caché se envían completas en un único evento `token`.  
+    """  
+    conversation = await session_store.aget_conversation(session_id)
+    llm = rag_chain.combine_docs_chain.llm_chain.llm  
+    answer_parts: list[str] = []  
+    flight: Optional[GenerationFlight] = None  
+    started = True  
+    prompt_text = ""  
+    completed = False  
+    timings: dict = {}  
+
+    with get_openai_callback() as cb:  
+        with stage_timer("condense", timings):  
+            standalone_question, history_tokens_saved = await condense_question(rag_chain, user_question, conversation)  
+        with stage_timer("cache_lookup", timings):  
+            lookup = await lookup_cached_answer(answer_cache, standalone_question)  
+        if lookup is None or lookup.entry is None:  
+            with stage_timer("retrieve", timings):  
+                documents = await retrieve_documents(rag_chain, standalone_question)  
+            with stage_timer("pack", timings):  
+                documents = pack_context(rag_chain, standalone_question, documents)  
+
+    if lookup is not None and lookup.entry is not None:  
+        logs = build_cached_logs(session_id, user_question, lookup, cb, timings, history_tokens_saved)  
+        await remember_turn(rag_chain, session_store, session_id, user_question, lookup.entry.answer)
+        on_logs(logs)  
+        yield {"event": "metadata", "data": {  
+            "standalone_question": standalone_question,  
+            "documents": lookup.entry.documents,  
+            "cache_hit": True  
+        }}  
+        yield {"event": "token", "data": {"text": lookup.entry.answer}}  
+        yield _usage_event(logs)  
+        return  
+
+    try:  
+        yield {"event": "metadata", "data": {  
+            "standalone_question": standalone_question,  
+            "documents": summarize_documents(documents),  
+            "cache_hit": False  
+        }}  
+
+        prompt_value = build_answer_prompt(rag_chain, documents, standalone_question)  
+        prompt_text = prompt_value.to_string()  
+
+        # La generación corre en su propia tarea (compartida si otra solicitud idéntica está en curso);  
+        # si el cliente se desconecta, la solicitud se retira y la generación se cancela al quedar sin participantes  
+        generate_started = time.perf_counter()  
+        flight, started = start_generation(rag_chain, standalone_question, documents, prompt_value)  
+        with stage_timer("generate", timings):  
+            async with aclosing(flight.subscribe()) as parts:  
+                async for text in parts:  
+                    if not answer_parts:  
+                        timings["first_token"] = round((time.perf_counter() - generate_started) * 1000, 2)  
+                    answer_parts.append(text)  
+                    yield {"event": "token", "data": {"text": text}}  
+        completed = True  
+    finally:  
+        answer = "".join(answer_parts)  
+        if flight is not None:  
+            usage = settle_generation(flight, llm, prompt_text, started)  
+        else:  
+            usage = {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "saved_cost_usd": 0.0,  
+                     "paid": False, "coalesced": False}  
+        logs = build_logs(session_id, user_question, answer,  
+                          cb.prompt_tokens + usage["prompt_tokens"],  
+                          cb.completion_tokens + usage["completion_tokens"],  
+                          cb.total_cost + usage["cost"], saved_cost_usd=usage["saved_cost_usd"],  
+                          stage_timings_ms=timings, coalesced=usage["coalesced"],  
+                          history_tokens_saved=history_tokens_saved)  
+        if completed:  
+            await remember_turn(rag_chain, session_store, session_id, user_question, answer)
+            if lookup is not None and usage["paid"]:  
+                answer_cache.store(standalone_question, lookup.embedding, answer, summarize_documents(documents),  
+                                   usage["prompt_tokens"], usage["completion_tokens"], usage["cost"],
+                                   generation=lookup.generation)  
+        on_logs(logs)  
+
+    yield _usage_event(logs)
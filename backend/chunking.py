@@ -0,0 +1,221 @@
+"""Chunking por tokens que respeta la estructura del documento y descarte de chunks casi duplicados (MinHash/LSH)"""
+
+import base64
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from settings import get_settings
+from context_packing import count_tokens, tokenize, shingles
+
+
+# Cortes preferidos, de mayor a menor: párrafos, líneas, oraciones, cláusulas y palabras
+STRUCTURE_SEPARATORS: list = ["\n\n", "\n", ". ", "? ", "! ", "; ", ": ", ", ", " ", ""]
+
+
+def build_text_splitter(model_name: str, chunk_tokens: int, overlap_tokens: int) -> RecursiveCharacterTextSplitter:
+    """
+    Splitter que mide los chunks en tokens del modelo de embeddings (no en caracteres) y corta
+    primero entre párrafos, luego entre líneas y oraciones. El separador queda al final del
+    chunk, de modo que cada oración conserva su puntuación.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=overlap_tokens,
+        length_function=lambda text: count_tokens(text, model_name),
+        separators=STRUCTURE_SEPARATORS,
+        keep_separator="end",
+    )
+
+
+# Primo de Mersenne 2^61 - 1 para las permutaciones universales de MinHash
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class MinHasher:
+    """
+    Firma MinHash de `num_perm` valores de 32 bits sobre los shingles de 5 palabras de un texto.
+    Las semillas son fijas, por lo que las firmas se pueden guardar y comparar entre ejecuciones.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Firma del texto, o None si no tiene palabras."""
+        text_shingles = shingles(tokenize(text), self.shingle_size)
+        if not text_shingles:
+            return None
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(" ".join(shingle).encode("utf-8"), digest_size=4).digest(), "little")
+             for shingle in text_shingles),
+            dtype=np.uint64, count=len(text_shingles)
+        )
+        # El producto puede desbordar 64 bits: igual que en datasketch, se acepta el módulo 2^64
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+def encode_signatures(signatures: list[np.ndarray]) -> str:
+    """Serializa las firmas de los chunks de un blob (en el orden de sus IDs) para el manifiesto."""
+    if not signatures:
+        return ""
+    return base64.b64encode(np.concatenate(signatures).astype(np.uint32).tobytes()).decode("ascii")
+
+
+def decode_signatures(encoded: str, count: int, num_perm: int) -> list[np.ndarray]:
+    """Recupera las firmas del manifiesto; vacío si no existen o se calcularon con otro `num_perm`."""
+    if not encoded:
+        return []
+    values = np.frombuffer(base64.b64decode(encoded), dtype=np.uint32)
+    if len(values) != count * num_perm:
+        return []
+    return list(values.reshape(count, num_perm))
+
+
+class NearDuplicateIndex:
+    """
+    Índice LSH de firmas MinHash: la firma se divide en `bands` bandas y dos chunks son
+    candidatos si coinciden en alguna banda completa. Solo los candidatos se comparan, y se
+    consideran duplicados si su similitud de Jaccard estimada es >= `threshold`.
+    """
+
+    def __init__(self, num_perm: int, bands: int, threshold: float):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) debe ser múltiplo de bands ({bands})")
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._buckets: list[dict] = [{} for _ in range(bands)]
+        self._signatures: dict[str, np.ndarray] = {}
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(len(self._buckets))]
+
+    def add(self, key: str, signature: np.ndarray):
+        self._signatures[key] = signature
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, []).append(key)
+
+    def query(self, signature: np.ndarray) -> Optional[str]:
+        """Clave del chunk indexado más parecido, si supera el umbral."""
+        candidates = {key for buckets, band_key in zip(self._buckets, self._band_keys(signature))
+                      for key in buckets.get(band_key, ())}
+        best_key, best_similarity = None, self.threshold
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+        return best_key
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._signatures
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+
+@dataclass
+class FilteredChunks:
+    """Chunks de un blob que se indexan, sus firmas y a qué chunk indexado reemplaza cada descartado."""
+    chunks: list = field(default_factory=list)
+    ids: list = field(default_factory=list)
+    signatures: str = ""
+    tokens: int = 0
+    duplicate_of: list = field(default_factory=list)
+
+
+class ChunkDeduplicator:
+    """
+    Descarta, antes de embeberlos, los chunks casi idénticos a otro chunk vigente del índice
+    (encabezados, pies de página, avisos legales o documentos repetidos entre archivos).
+
+    El índice LSH se arma en cada sincronización solo con chunks vigentes: los de los blobs sin
+    cambios (a partir de las firmas guardadas en el manifiesto) y los que el pipeline va
+    conservando, por lo que un chunk nunca se descarta en favor de un blob eliminado. El primer
+    chunk visto se conserva y los siguientes se descartan.
+    """
+
+    def __init__(self, model_name: str, threshold: float = 0.85, num_perm: int = 64, bands: int = 16):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher(num_perm)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Vacía el índice y los contadores al comenzar una sincronización."""
+        with self._lock:
+            self._index = NearDuplicateIndex(self.hasher.num_perm, self.bands, self.threshold)
+            self._counters = {"chunks_seen": 0, "duplicates_dropped": 0, "tokens_kept": 0, "embedding_tokens_saved": 0}
+
+    def register(self, chunk_ids: list[str], encoded_signatures: str):
+        """Agrega al índice los chunks ya indexados de un blob sin cambios."""
+        signatures = decode_signatures(encoded_signatures, len(chunk_ids), self.hasher.num_perm)
+        with self._lock:
+            for chunk_id, signature in zip(chunk_ids, signatures):
+                self._index.add(chunk_id, signature)
+
+    def filter(self, chunk_ids: list[str], chunks: list[Document], known_ids: set) -> FilteredChunks:
+        """
+        Separa los chunks de un blob entre los que se indexan y los casi duplicados. Los chunks
+        en `known_ids` ya están embebidos, así que descartarlos no ahorra tokens de embeddings.
+        """
+        result = FilteredChunks()
+        signatures = []
+        with self._lock:
+            for chunk_id, chunk in zip(chunk_ids, chunks):
+                self._counters["chunks_seen"] += 1
+                tokens = count_tokens(chunk.page_content, self.model_name)
+                signature = self.hasher.signature(chunk.page_content)
+                if signature is not None:
+                    original_id = self._index.query(signature)
+                    if original_id is not None and original_id != chunk_id:
+                        result.duplicate_of.append(original_id)
+                        self._counters["duplicates_dropped"] += 1
+                        if chunk_id not in known_ids:
+                            self._counters["embedding_tokens_saved"] += tokens
+                        continue
+                    self._index.add(chunk_id, signature)
+                else:
+                    signature = np.full(self.hasher.num_perm, _MAX_HASH, dtype=np.uint32)
+                result.chunks.append(chunk)
+                result.ids.append(chunk_id)
+                result.tokens += tokens
+                signatures.append(signature)
+            self._counters["tokens_kept"] += result.tokens
+        result.signatures = encode_signatures(signatures)
+        return result
+
+    def stats(self) -> dict:
+        """Contadores de la última sincronización y tamaño del índice LSH."""
+        with self._lock:
+            return {**self._counters, "lsh_entries": len(self._index)}
+
+
+# Instancia global del deduplicador
+_chunk_deduplicator = None
+
+def get_chunk_deduplicator(model_name: str) -> Optional[ChunkDeduplicator]:
+    """Obtiene el deduplicador de chunks de la ingesta (singleton), o None si está deshabilitado."""
+    global _chunk_deduplicator
+    settings = get_settings()
+    if not settings.chunk_dedup_enabled:
+        return None
+    if _chunk_deduplicator is None:
+        _chunk_deduplicator = ChunkDeduplicator(
+            model_name=model_name,
+            threshold=settings.chunk_dedup_threshold,
+            num_perm=settings.chunk_minhash_permutations,
+            bands=settings.chunk_lsh_bands,
+        )
+    return _chunk_deduplicator
@@ -0,0 +1,151 @@
+"""Coalescencia de generaciones idénticas en curso (single-flight)"""
+
+import asyncio
+import hashlib
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Optional
+from langchain_core.documents import Document
+from answer_cache import normalize_question
+
+
+class GenerationFlight:
+    """
+    Una generación del LLM que pueden compartir varias solicitudes.
+
+    Corre en su propia tarea, independiente del cliente que la inició: publica cada fragmento
+    a todos los participantes (que lo leen con `subscribe`) y solo se cancela cuando se retira
+    el último. El costo se atribuye a un único participante: el primero que la liquida con
+    `claim_usage` o el último en retirarse de una generación cancelada, si llegó a responder.
+    """
+
+    def __init__(self, produce: Callable[[], AsyncIterator], on_finish: Optional[Callable] = None):
+        self.parts: list[str] = []
+        self.final_chunk = None
+        self.completed = False
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.usage: Optional[tuple] = None  # (prompt_tokens, completion_tokens, costo), calculado al liquidarla
+        self.participants = 0
+        self._usage_claimed = False
+        self._on_finish = on_finish
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(produce))
+
+    @property
+    def answer(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def generated(self) -> bool:
+        """True si el LLM llegó a enviar algún fragmento (solo entonces hay uso que cobrar)."""
+        return self.final_chunk is not None
+
+    async def _run(self, produce: Callable[[], AsyncIterator]):
+        try:
+            async with aclosing(produce()) as stream:
+                async for chunk in stream:
+                    self.final_chunk = chunk if self.final_chunk is None else self.final_chunk + chunk
+                    if chunk.content:
+                        self.parts.append(chunk.content)
+                        self._notify()
+            self.completed = True
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            if self._on_finish is not None:
+                self._on_finish(self)
+            self._notify()
+
+    def _notify(self):
+        # Despierta a todos los suscriptores y deja un evento nuevo para el siguiente fragmento
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """Entrega todos los fragmentos desde el inicio, incluidos los ya generados."""
+        index = 0
+        while True:
+            if index < len(self.parts):
+                index += 1
+                yield self.parts[index - 1]
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+    def join(self):
+        self.participants += 1
+
+    def leave(self) -> bool:
+        """
+        Retira a un participante. Si era el último y la generación sigue en curso, la cancela
+        y devuelve True: a ese participante se le atribuye el uso parcial.
+        """
+        self.participants -= 1
+        if self.participants == 0 and not self.done:
+            self._task.cancel()
+            self._usage_claimed = True
+            return True
+        return False
+
+    def claim_usage(self) -> bool:
+        """True solo para el primer participante que la reclama una vez terminada la generación."""
+        if not self.done or self._usage_claimed:
+            return False
+        self._usage_claimed = True
+        return True
+
+
+class RequestCoalescer:
+    """
+    Agrupa las solicitudes concurrentes con la misma pregunta normalizada y el mismo contexto
+    recuperado en una sola generación del LLM. La generación deja de aceptar participantes
+    al terminar: las preguntas posteriores se responden desde la caché de respuestas.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, GenerationFlight] = {}
+        self._counters = {"generations": 0, "coalesced": 0}
+
+    @staticmethod
+    def key(standalone_question: str, documents: list[Document]) -> str:
+        """Clave de la generación: pregunta normalizada más el contenido de los documentos del prompt."""
+        digest = hashlib.sha256(normalize_question(standalone_question).encode("utf-8"))
+        for doc in documents:
+            digest.update(b"\x00" + doc.page_content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def join(self, key: str, produce: Callable[[], AsyncIterator]) -> tuple[GenerationFlight, bool]:
+        """Se suma a la generación en curso con esa clave o inicia una. Devuelve (generación, si es nueva)."""
+        flight = self._flights.get(key)
+        started = flight is None
+        if started:
+            flight = GenerationFlight(produce, on_finish=lambda finished: self._forget(key, finished))
+            self._flights[key] = flight
+            self._counters["generations"] += 1
+        else:
+            self._counters["coalesced"] += 1
+        flight.join()
+        return flight, started
+
+    def _forget(self, key: str, flight: GenerationFlight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        """Devuelve los contadores del agrupador y las generaciones en curso."""
+        return {**self._counters, "in_flight": len(self._flights)}
+
+
+# Instancia global del agrupador
+_request_coalescer = None
+
+def get_request_coalescer() -> RequestCoalescer:
+    """Obtiene el agrupador de generaciones idénticas (singleton)."""
+    global _request_coalescer
+    if _request_coalescer is None:
+        _request_coalescer = RequestCoalescer()
+    return _request_coalescer
@@ -0,0 +1,81 @@
+"""Control de concurrencia para las llamadas al LLM"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from settings import get_settings
+
+
+class QueueTimeoutError(Exception):
+    """La solicitud esperó demasiado tiempo por un cupo libre."""
+
+    def __init__(self, timeout: float):
+        super().__init__(f"No hubo capacidad disponible en {timeout:.0f} segundos.")
+        self.timeout = timeout
+
+
+class ConcurrencyLimiter:
+    """
+    Limita el número de ejecuciones simultáneas de la cadena RAG.
+
+    Las solicitudes que superan el límite esperan en cola (FIFO) hasta `queue_timeout`
+    segundos; si no obtienen un cupo se lanza `QueueTimeoutError`.
+    """
+
+    def __init__(self, max_concurrency: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+        self._counters = {"completed": 0, "timeouts": 0}
+
+    async def acquire(self):
+        """Espera un cupo libre; lanza `QueueTimeoutError` si se agota el tiempo de cola."""
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._counters["timeouts"] += 1
+            raise QueueTimeoutError(self.queue_timeout)
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+
+    def release(self):
+        """Libera un cupo obtenido con `acquire`."""
+        self._in_flight -= 1
+        self._counters["completed"] += 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Reserva un cupo durante la ejecución del bloque."""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        """Devuelve el estado actual del limitador."""
+        return {
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            **self._counters,
+        }
+
+
+# Instancia global del limitador
+_llm_limiter = None
+
+def get_llm_limiter() -> ConcurrencyLimiter:
+    """Obtiene el limitador de llamadas al LLM (singleton)."""
+    global _llm_limiter
+    if _llm_limiter is None:
+        settings = get_settings()
+        _llm_limiter = ConcurrencyLimiter(
+            max_concurrency=settings.llm_max_concurrency,
+            queue_timeout=settings.llm_queue_timeout_seconds,
+        )
+    return _llm_limiter
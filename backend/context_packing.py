@@ -0,0 +1,198 @@
+"""Post-procesamiento de la recuperación: deduplicación, reranking y empaquetado del contexto"""
+
+import re
+import math
+import unicodedata
+from dataclasses import dataclass, field
+from functools import lru_cache
+import tiktoken
+from langchain_core.documents import Document
+from settings import get_settings
+
+
+# Caracteres por token al estimar sin tokenizador (aproximación habitual para texto en español)
+CHARS_PER_TOKEN: int = 4
+
+
+@lru_cache(maxsize=8)
+def _encoding(model_name: str):
+    """
+    Tokenizador del modelo (o cl100k_base), cargado una vez por modelo. tiktoken descarga sus
+    archivos BPE la primera vez (se pueden incluir con TIKTOKEN_CACHE_DIR); si no los consigue,
+    devuelve None y los conteos pasan a ser aproximados en lugar de fallar la solicitud.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"⚠️ No se pudo cargar el tokenizador de {model_name} ({str(e)}); los tokens se estimarán.")
+        return None
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    """Cuenta los tokens de un texto con el tokenizador del modelo, o los estima si no está disponible."""
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return max(len(text.split()), math.ceil(len(text) / CHARS_PER_TOKEN))
+    return len(encoding.encode(text))
+
+
+def tokenize(text: str) -> list[str]:
+    """Palabras en minúsculas y sin tildes, para comparar textos en español."""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(char for char in normalized if not unicodedata.combining(char))
+    return re.findall(r"\w+", normalized)
+
+
+def shingles(words: list[str], size: int = 5) -> set:
+    """Secuencias de `size` palabras consecutivas de un texto tokenizado."""
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _overlap_length(previous: str, text: str, min_overlap: int, max_overlap: int) -> int:
+    """Longitud del sufijo de `previous` con el que empieza `text` (0 si es menor que `min_overlap`)."""
+    for length in range(min(max_overlap, len(previous), len(text)), min_overlap - 1, -1):
+        if previous.endswith(text[:length]):
+            return length
+    return 0
+
+
+def _source(doc: Document):
+    """Documento de origen de un chunk (ruta del blob en la ingesta o metadatos de Azure AI Search)."""
+    return doc.metadata.get("source") or doc.metadata.get("metadata")
+
+
+def bm25_scores(query: str, texts: list[str], k1: float = 1.5, b: float = 0.75) -> list[float]:
+    """Puntaje BM25 de cada texto para la consulta, usando los propios textos como corpus."""
+    documents = [tokenize(text) for text in texts]
+    query_terms = set(tokenize(query))
+    if not documents or not query_terms:
+        return [0.0] * len(texts)
+    average_length = sum(len(words) for words in documents) / len(documents) or 1.0
+    document_frequency = {term: sum(1 for words in documents if term in words) for term in query_terms}
+    scores = []
+    for words in documents:
+        frequencies: dict = {}
+        for word in words:
+            if word in query_terms:
+                frequencies[word] = frequencies.get(word, 0) + 1
+        score = 0.0
+        for term, frequency in frequencies.items():
+            idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(words) / average_length))
+        scores.append(score)
+    return scores
+
+
+@dataclass
+class PackedContext:
+    """Documentos seleccionados para el prompt y detalle de lo conservado y descartado."""
+    documents: list[Document]
+    kept: list[dict] = field(default_factory=list)
+    dropped: list[dict] = field(default_factory=list)
+    context_tokens: int = 0
+
+
+class ContextPacker:
+    """
+    Selecciona los documentos recuperados que entran al prompt.
+
+    1. Deduplicación: descarta chunks casi idénticos a uno mejor posicionado (contención de
+       shingles de 5 palabras >= `dedup_threshold`) y recorta el texto que un chunk comparte
+       con el chunk contiguo del mismo documento (el splitter usa `chunk_overlap`).
+    2. Reranking local: combina BM25 sobre la pregunta con la posición que dio el buscador
+       (`bm25_weight` controla la mezcla).
+    3. Empaquetado: agrega los mejores chunks mientras quepan en `token_budget` tokens,
+       con un máximo de `max_documents`.
+    """
+
+    def __init__(self, token_budget: int, max_documents: int, dedup_threshold: float = 0.8,
+                 bm25_weight: float = 0.5, min_overlap_chars: int = 30, max_overlap_chars: int = 200):
+        self.token_budget = token_budget
+        self.max_documents = max_documents
+        self.dedup_threshold = dedup_threshold
+        self.bm25_weight = bm25_weight
+        self.min_overlap_chars = min_overlap_chars
+        self.max_overlap_chars = max_overlap_chars
+
+    def pack(self, query: str, documents: list[Document], model_name: str) -> PackedContext:
+        """Deduplica, reordena y recorta los documentos al presupuesto de tokens."""
+        result = PackedContext(documents=[])
+        candidates = self._deduplicate(documents, result)
+        if not candidates:
+            return result
+
+        bm25 = bm25_scores(query, [doc.page_content for _, doc in candidates])
+        best_bm25 = max(bm25) or 1.0
+        ranked = sorted(
+            (
+                (self.bm25_weight * score / best_bm25 + (1 - self.bm25_weight) * (1 - position / len(documents)),
+                 position, doc)
+                for (position, doc), score in zip(candidates, bm25)
+            ),
+            key=lambda item: item[0],
+            reverse=True,
+        )
+
+        for score, position, doc in ranked:
+            tokens = count_tokens(doc.page_content, model_name)
+            entry = {"id": doc.metadata.get("id"), "rank": position, "score": round(score, 4), "tokens": tokens}
+            if len(result.documents) >= self.max_documents:
+                result.dropped.append({**entry, "reason": "max_documents"})
+            elif result.context_tokens + tokens > self.token_budget:
+                result.dropped.append({**entry, "reason": "token_budget"})
+            else:
+                result.documents.append(doc)
+                result.kept.append(entry)
+                result.context_tokens += tokens
+        return result
+
+    def _deduplicate(self, documents: list[Document], result: PackedContext) -> list[tuple[int, Document]]:
+        """Devuelve (posición original, documento) sin duplicados y sin solapamientos."""
+        candidates: list[tuple[int, Document]] = []
+        kept_shingles: list[set] = []
+        for position, doc in enumerate(documents):
+            doc_shingles = shingles(tokenize(doc.page_content))
+            duplicate = any(
+                doc_shingles and len(doc_shingles & previous) / min(len(doc_shingles), len(previous)) >= self.dedup_threshold
+                for previous in kept_shingles if previous
+            )
+            if duplicate or not doc.page_content.strip():
+                result.dropped.append({"id": doc.metadata.get("id"), "rank": position, "reason": "duplicate"})
+                continue
+
+            text = doc.page_content
+            source = _source(doc)
+            for _, previous in candidates:
+                # Solo se recorta el texto compartido con el chunk anterior o siguiente del mismo
+                # documento: entre documentos distintos, un texto repetido no es solapamiento
+                if source is None or _source(previous) != source:
+                    continue
+                start = _overlap_length(previous.page_content, text, self.min_overlap_chars, self.max_overlap_chars)
+                end = _overlap_length(text, previous.page_content, self.min_overlap_chars, self.max_overlap_chars)
+                text = text[start:len(text) - end] if start + end < len(text) else text
+            if text != doc.page_content:
+                doc = Document(page_content=text.strip(), metadata=doc.metadata)
+            candidates.append((position, doc))
+            kept_shingles.append(doc_shingles)
+        return candidates
+
+
+# Instancia global del empaquetador
+_context_packer = None
+
+def get_context_packer() -> ContextPacker:
+    """Obtiene el empaquetador de contexto (singleton)."""
+    global _context_packer
+    if _context_packer is None:
+        settings = get_settings()
+        _context_packer = ContextPacker(
+            token_budget=settings.context_token_budget,
+            max_documents=settings.context_max_documents,
+            dedup_threshold=settings.context_dedup_threshold,
+        )
+    return _context_packer
@@ -0,0 +1,155 @@
+"""Historial acotado por tokens: últimos turnos textuales más un resumen incremental de los anteriores"""
+
+import asyncio
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from langchain.callbacks import get_openai_callback
+from settings import get_settings
+from memory_store import Conversation
+from context_packing import count_tokens
+from rate_limits import estimate_tokens, get_llm_scheduler
+import metrics
+
+
+@dataclass
+class HistoryWindow:
+    """Historial que se envía al prompt de reformulación y lo que habría costado enviarlo completo."""
+    summary: str
+    turns: list
+    tokens: int
+    full_tokens: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.full_tokens - self.tokens, 0)
+
+
+@lru_cache(maxsize=20000)
+def _turn_tokens(question: str, answer: str, model_name: str) -> int:
+    # Los turnos no cambian: cada uno se tokeniza una sola vez por proceso
+    return count_tokens(f"Human: {question}\nAssistant: {answer}", model_name)
+
+
+def select_history(conversation: Conversation, model_name: str, max_turns: int, token_budget: int,
+                   keep_unsummarized: bool = False) -> HistoryWindow:
+    """
+    Elige los turnos más recientes aún no resumidos que caben en `token_budget` (contando el
+    resumen), hasta `max_turns`. Con `keep_unsummarized` se conservan también los turnos que el
+    resumen todavía no alcanzó, siempre dentro del presupuesto. La última pregunta y respuesta
+    se incluye aunque por sí sola supere el presupuesto.
+    """
+    full_tokens = sum(_turn_tokens(question, answer, model_name) for question, answer in conversation.turns)
+    pending = conversation.turns[conversation.summarized_turns:]
+    summary_tokens = count_tokens(conversation.summary, model_name) if conversation.summary else 0
+    limit = len(pending) if keep_unsummarized else max_turns
+
+    tokens = summary_tokens
+    selected: list = []
+    for question, answer in reversed(pending[-limit:] if limit else []):
+        turn_tokens = _turn_tokens(question, answer, model_name)
+        if selected and tokens + turn_tokens > token_budget:
+            break
+        selected.append((question, answer))
+        tokens += turn_tokens
+    selected.reverse()
+    return HistoryWindow(conversation.summary, selected, tokens, full_tokens)
+
+
+# Prompt del resumen incremental: el resumen anterior más los turnos que salen de la ventana
+SUMMARY_PROMPT: str = '''
+Resume la conversación entre un estudiante y el asistente "Ingenierin" para poder continuarla.
+Conserva los temas consultados, los datos concretos (cifras, productos, nombres) y las decisiones
+o dudas pendientes del estudiante. Escribe en español, en prosa breve y sin repetir saludos.
+
+Resumen anterior:
+{summary}
+
+Turnos nuevos:
+{turns}
+
+Resumen actualizado:
+'''
+
+
+class HistorySummarizer:
+    """
+    Mantiene el resumen de cada sesión fuera del camino crítico de la respuesta.
+
+    Tras cada turno se revisa la sesión en una tarea de fondo (a lo más una por sesión): si hay
+    al menos `batch_turns` turnos fuera de los `max_turns` más recientes, se agregan al resumen
+    guardado con una sola llamada al LLM, en lugar de regenerarlo en cada turno.
+    """
+
+    def __init__(self, max_turns: int, batch_turns: int, max_tokens: int):
+        self.max_turns = max_turns
+        self.batch_turns = batch_turns
+        self.max_tokens = max_tokens
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._counters = {
+            "summaries": 0,
+            "turns_folded": 0,
+            "failed": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost_usd": 0.0,
+        }
+
+    def schedule(self, session_store, llm, session_id: str) -> Optional[asyncio.Task]:
+        """Revisa la sesión en segundo plano; si ya hay una revisión en curso no se agenda otra."""
+        if session_id in self._tasks:
+            return None
+        task = asyncio.create_task(self._summarize(session_store, llm, session_id))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+        return task
+
+    async def _summarize(self, session_store, llm, session_id: str):
+        try:
+            conversation = await session_store.aget_conversation(session_id)
+            start = conversation.summarized_turns
+            fold = len(conversation.turns) - start - self.max_turns
+            if fold < self.batch_turns:
+                return
+            turns = conversation.turns[start:start + fold]
+            prompt = SUMMARY_PROMPT.format(
+                summary=conversation.summary or "(sin resumen)",
+                turns="\n".join(f"Estudiante: {question}\nIngenierin: {answer}" for question, answer in turns)
+            )
+            with get_openai_callback() as cb:
+                message = await get_llm_scheduler().call(lambda: llm.ainvoke(prompt, max_tokens=self.max_tokens),
+                                                         estimate_tokens(prompt, self.max_tokens))
+            await session_store.aset_summary(session_id, message.content.strip(),
+                                             conversation.turn_ids[start + fold - 1])
+        except Exception as e:
+            self._counters["failed"] += 1
+            print(f"⚠️ No se pudo resumir el historial de la sesión {session_id}: {e}")
+            return
+
+        self._counters["summaries"] += 1
+        self._counters["turns_folded"] += fold
+        self._counters["prompt_tokens"] += cb.prompt_tokens
+        self._counters["completion_tokens"] += cb.completion_tokens
+        self._counters["cost_usd"] += cb.total_cost
+        metrics.TOKENS.labels(kind="summary").inc(cb.total_tokens)
+        metrics.COST.inc(cb.total_cost)
+
+    def stats(self) -> dict:
+        """Devuelve los contadores de los resúmenes generados y las revisiones en curso."""
+        return {**self._counters, "cost_usd": round(self._counters["cost_usd"], 6), "in_flight": len(self._tasks)}
+
+
+# Instancia global del resumidor
+_history_summarizer = None
+
+def get_history_summarizer() -> HistorySummarizer:
+    """Obtiene el resumidor incremental del historial (singleton)."""
+    global _history_summarizer
+    if _history_summarizer is None:
+        settings = get_settings()
+        _history_summarizer = HistorySummarizer(
+            max_turns=settings.history_max_turns,
+            batch_turns=settings.history_summary_batch_turns,
+            max_tokens=settings.history_summary_max_tokens,
+        )
+    return _history_summarizer
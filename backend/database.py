@@ -1,6 +1,14 @@
+import json
+import time
+import base64
 import uuid
+import threading
 import libsql
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Optional
 from settings import get_settings
+from metrics import stage_timer
 
 
 settings = get_settings()
@@ -8,40 +16,501 @@ settings = get_settings()
 TURSO_API_TOKEN: str = settings.turso_api_token
 TURSO_DATABASE_URL: str = settings.database_url
 
-# Verificar que las credenciales estén configuradas
-if not TURSO_DATABASE_URL or not TURSO_API_TOKEN:
-    raise Exception("TURSO_DATABASE_URL o TURSO_API_TOKEN no estan configurados.")
 
-
-def get_db_connection():  
-    """Obtiene la conexión a la base de datos Turso."""
+def _open_connection():
+    """Abre una conexión nueva a la base de datos Turso."""
+    # Verificar que las credenciales estén configuradas (al conectar, no al importar el módulo)
+    if not TURSO_DATABASE_URL or not TURSO_API_TOKEN:
+        raise Exception("TURSO_DATABASE_URL o TURSO_API_TOKEN no estan configurados.")
     return libsql.connect(database=TURSO_DATABASE_URL, auth_token=TURSO_API_TOKEN)
 
 
-# Crear la tabla en Turso si no existe
+def _close_quietly(conn):
+    """Cierra una conexión ignorando errores (puede estar ya rota)."""
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones reutilizables a Turso/libsql.
+
+    Las conexiones se crean bajo demanda hasta `size`. Las que llevan más de
+    `health_check_seconds` inactivas se verifican con `SELECT 1` antes de prestarse, y
+    una conexión que falla durante su uso se descarta y se reemplaza por una nueva.
+    """
+
+    def __init__(self, connect: Callable, size: int, acquire_timeout: float, health_check_seconds: float):
+        self._connect = connect
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_seconds = health_check_seconds
+        # Conexiones inactivas como (conexión, inactiva desde); se presta la última devuelta
+        self._idle: list = []
+        self._created = 0
+        self._closed = False
+        # Protege `_idle`, `_created` y los contadores. Liberar o descartar una conexión despierta
+        # a quien espera, que toma la inactiva o abre una de reemplazo si quedó capacidad libre
+        self._available = threading.Condition()
+        self._counters = {
+            "acquired": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "reconnects": 0,
+            "timeouts": 0,
+        }
+
+    @contextmanager
+    def connection(self):
+        """Presta una conexión del pool durante el bloque y la devuelve al terminar."""
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception:
+            # Deshacer la transacción abierta: si no, conserva el bloqueo de escritura y el
+            # siguiente que reciba la conexión confirmaría las escrituras a medias
+            if not self._rollback(conn) or not self._is_healthy(conn):
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._release(conn)
+
+    def close(self):
+        """Cierra todas las conexiones inactivas; las prestadas se cierran al devolverse."""
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        """Devuelve el estado del pool y sus métricas de espera."""
+        with self._available:
+            return {
+                "size": self.size,
+                "open": self._created,
+                "idle": len(self._idle),
+                "in_use": self._created - len(self._idle),
+                **self._counters,
+            }
+
+    def _acquire(self):
+        started = time.perf_counter()
+        waited = False
+        while True:
+            with self._available:
+                while not self._idle and self._created >= self.size:
+                    remaining = self.acquire_timeout - (time.perf_counter() - started)
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise TimeoutError(f"No hubo conexiones libres en {self.acquire_timeout:.0f} segundos.")
+                    waited = True
+                    self._available.wait(remaining)
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    conn = None
+                    self._created += 1
+
+            if conn is None:
+                conn = self._create()
+                break
+            if time.monotonic() - idle_since > self.health_check_seconds and not self._is_healthy(conn):
+                self._discard(conn)
+                with self._available:
+                    self._counters["reconnects"] += 1
+                continue
+            break
+
+        wait_seconds = time.perf_counter() - started
+        with self._available:
+            self._counters["acquired"] += 1
+            if waited:
+                self._counters["waits"] += 1
+            self._counters["wait_seconds_total"] += wait_seconds
+            self._counters["wait_seconds_max"] = max(self._counters["wait_seconds_max"], wait_seconds)
+        return conn
+
+    def _create(self):
+        """Abre una conexión en el lugar ya reservado en `_created`; si falla, libera el lugar."""
+        try:
+            return self._connect()
+        except Exception:
+            with self._available:
+                self._created -= 1
+                self._available.notify()
+            raise
+
+    def _release(self, conn):
+        with self._available:
+            if not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._available.notify()
+                return
+        self._discard(conn)
+
+    def _discard(self, conn):
+        _close_quietly(conn)
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    @staticmethod
+    def _rollback(conn) -> bool:
+        try:
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        try:
+            conn.execute("SELECT 1;").fetchone()
+            return True
+        except Exception:
+            return False
+
+
+# Pool global de conexiones (se crea en el lifespan de FastAPI)
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def init_db_pool() -> ConnectionPool:
+    """Crea el pool de conexiones global si no existe."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                connect=_open_connection,
+                size=settings.db_pool_size,
+                acquire_timeout=settings.db_pool_timeout_seconds,
+                health_check_seconds=settings.db_pool_health_check_seconds
+            )
+        return _pool
+
+
+def close_db_pool():
+    """Cierra el pool de conexiones global."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def get_db_pool() -> ConnectionPool:
+    """Obtiene el pool global; fuera de la API (scripts de ingesta) se crea al primer uso."""
+    return _pool or init_db_pool()
+
+
+@contextmanager
+def get_db_connection():
+    """Presta una conexión del pool a la base de datos Turso durante el bloque `with`."""
+    with get_db_pool().connection() as conn:
+        yield conn
+
+
+# Migraciones del esquema
+
+def _migration_create_logs(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS logs (
+            ID TEXT PRIMARY KEY,
+            session_id TEXT,
+            total_tokens INTEGER,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            total_cost_usd REAL,
+            user_question TEXT,
+            llm_answer TEXT,
+            date_processed TEXT
+        );
+    """)
+
+
+def _add_columns_if_missing(conn, table: str, columns: dict):
+    """Agrega columnas a una tabla solo si aún no existen (bases creadas antes de las migraciones)."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table});").fetchall()}
+    for column, definition in columns.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
+
+
+def _migration_cache_columns(conn):
+    _add_columns_if_missing(conn, "logs", {
+        "cache_hit": "INTEGER DEFAULT 0",
+        "saved_cost_usd": "REAL DEFAULT 0",
+    })
+
+
+def _migration_create_kb_manifest(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS kb_manifest (
+            blob_name TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            chunk_ids TEXT,
+            synced_at TEXT
+        );
+    """)
+
+
+def _migration_logs_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_session_date ON logs (session_id, date_processed, ID);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_date ON logs (date_processed);")
+
+
+def _migration_create_job_leases(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL
+        );
+    """)
+
+
+def _migration_usage_rollups(conn):
+    _add_columns_if_missing(conn, "logs", {"deployment": "TEXT DEFAULT ''"})
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usage_rollups (
+            granularity TEXT,
+            bucket TEXT,
+            deployment TEXT,
+            requests INTEGER DEFAULT 0,
+            sessions INTEGER DEFAULT 0,
+            prompt_tokens INTEGER DEFAULT 0,
+            completion_tokens INTEGER DEFAULT 0,
+            total_tokens INTEGER DEFAULT 0,
+            total_cost_usd REAL DEFAULT 0,
+            cache_hits INTEGER DEFAULT 0,
+            saved_cost_usd REAL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket, deployment)
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usage_rollup_sessions (
+            granularity TEXT,
+            bucket TEXT,
+            deployment TEXT,
+            session_id TEXT,
+            PRIMARY KEY (granularity, bucket, deployment, session_id)
+        );
+    """)
+    # Calcular los agregados de los logs existentes
+    if conn.execute("SELECT COUNT(*) FROM usage_rollups;").fetchone()[0] == 0:
+        for granularity, length, suffix in (("hour", 13, ":00"), ("day", 10, "")):
+            bucket_expr = f"substr(date_processed, 1, {length}) || '{suffix}'"
+            conn.execute(f"""
+                INSERT OR IGNORE INTO usage_rollup_sessions (granularity, bucket, deployment, session_id)
+                SELECT DISTINCT '{granularity}', {bucket_expr}, COALESCE(deployment, ''), session_id FROM logs;
+            """)
+            conn.execute(f"""
+                INSERT INTO usage_rollups (granularity, bucket, deployment, requests, sessions, prompt_tokens,
+                                           completion_tokens, total_tokens, total_cost_usd, cache_hits, saved_cost_usd)
+                SELECT '{granularity}', {bucket_expr}, COALESCE(deployment, ''), COUNT(*), COUNT(DISTINCT session_id),
+                       SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens), SUM(total_cost_usd),
+                       SUM(COALESCE(cache_hit, 0)), SUM(COALESCE(saved_cost_usd, 0))
+                FROM logs GROUP BY {bucket_expr}, COALESCE(deployment, '');
+            """)
+
+
+def _migration_stage_timings(conn):
+    _add_columns_if_missing(conn, "logs", {"stage_timings_ms": "TEXT"})
+
+
+def _migration_coalesced_column(conn):
+    _add_columns_if_missing(conn, "logs", {"coalesced": "INTEGER DEFAULT 0"})
+
+
+# Historial de sesiones compartido entre workers: un turno por fila, solo se agregan filas.
+# El id autoincremental nunca se reutiliza y sirve como versión del historial de cada sesión.
+SESSION_TURNS_SCHEMA: tuple = (
+    """
+    CREATE TABLE IF NOT EXISTS session_turns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL,
+        turn TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_session_turns_session ON session_turns (session_id, id);",
+    "CREATE INDEX IF NOT EXISTS idx_session_turns_created ON session_turns (created_at);",
+)
+
+
+# Logs que corresponden a un turno de conversación: los lotes de `/chat/batch` usan sesiones
+# `batch-…` que no tienen historial
+_CONVERSATION_LOGS_FILTER: str = "session_id NOT LIKE 'batch-%' AND COALESCE(llm_answer, '') <> ''"
+
+
+def _migration_session_turns(conn):
+    for statement in SESSION_TURNS_SCHEMA:
+        conn.execute(statement)
+    # Reconstruir las conversaciones existentes a partir de los logs, sin los lotes de
+    # evaluación ni las respuestas vacías (streams que fallaron antes del primer token)
+    conn.execute(f"""
+        INSERT INTO session_turns (session_id, turn, created_at)
+        SELECT session_id, json_array(user_question, llm_answer), date_processed
+        FROM logs
+        WHERE NOT EXISTS (SELECT 1 FROM session_turns) AND {_CONVERSATION_LOGS_FILTER}
+        ORDER BY date_processed, ID;
+    """)
+
+
+# Resumen acumulado de cada sesión: cubre los turnos con id hasta `summarized_through_id`
+SESSION_SUMMARIES_SCHEMA: tuple = (
+    """
+    CREATE TABLE IF NOT EXISTS session_summaries (
+        session_id TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        summarized_through_id INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_session_summaries_updated ON session_summaries (updated_at);",
+)
+
+
+def _migration_session_summaries(conn):
+    for statement in SESSION_SUMMARIES_SCHEMA:
+        conn.execute(statement)
+    _add_columns_if_missing(conn, "logs", {"history_tokens_saved": "INTEGER DEFAULT 0"})
+
+
+def _migration_manifest_dedup_columns(conn):
+    # Firmas MinHash de los chunks indexados (base64, en el orden de chunk_ids), chunks
+    # indexados de otros blobs que reemplazan a los descartados y tokens de los chunks del blob
+    _add_columns_if_missing(conn, "kb_manifest", {
+        "chunk_signatures": "TEXT",
+        "duplicate_of": "TEXT",
+        "chunk_tokens": "INTEGER DEFAULT 0",
+    })
+
+
+def _migration_prune_backfilled_turns(conn):
+    # Bases que ya reconstruyeron el historial sin filtrar: quitar los turnos de los lotes de
+    # evaluación y las respuestas vacías, y los resúmenes armados a partir de ellos
+    conn.execute("DELETE FROM session_turns WHERE session_id LIKE 'batch-%' OR COALESCE(json_extract(turn, '$[1]'), '') = '';")
+    conn.execute("DELETE FROM session_summaries WHERE session_id LIKE 'batch-%';")
+
+
+def _migration_create_kb_generation(conn):
+    # Generación de la base de conocimientos: cada sincronización con cambios la incrementa y
+    # cada worker vacía su caché de respuestas al ver un valor distinto
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS kb_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL,
+            updated_at TEXT
+        );
+    """)
+
+
+# Lista ordenada de migraciones: (versión, descripción, función). Nunca modificar una
+# migración ya publicada; los cambios de esquema se agregan como una versión nueva.
+MIGRATIONS: list = [
+    (1, "crear tabla logs", _migration_create_logs),
+    (2, "columnas de caché de respuestas en logs", _migration_cache_columns),
+    (3, "crear tabla kb_manifest", _migration_create_kb_manifest),
+    (4, "índices de logs por sesión y por fecha", _migration_logs_indexes),
+    (5, "crear tabla job_leases", _migration_create_job_leases),
+    (6, "agregados de uso por hora y por día", _migration_usage_rollups),
+    (7, "tiempos por etapa en logs", _migration_stage_timings),
+    (8, "marca de respuesta compartida en logs", _migration_coalesced_column),
+    (9, "historial de sesiones compartido", _migration_session_turns),
+    (10, "resúmenes de sesiones y tokens de historial ahorrados", _migration_session_summaries),
+    (11, "firmas y duplicados de chunks en kb_manifest", _migration_manifest_dedup_columns),
+    (12, "quitar del historial los turnos de lotes y respuestas vacías", _migration_prune_backfilled_turns),
+    (13, "crear tabla kb_generation", _migration_create_kb_generation),
+]
+
+
+def run_migrations(conn, verbose: bool = False) -> list:
+    """
+    Aplica en orden las migraciones pendientes y registra cada una en `schema_migrations`.
+    Las migraciones son idempotentes, por lo que varios workers pueden ejecutarlas a la vez.
+
+    Returns:
+        list: Versiones aplicadas en esta ejecución.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        );
+    """)
+    conn.commit()
+    applied = {row[0] for row in conn.execute("SELECT version FROM schema_migrations;").fetchall()}
+    newly_applied = []
+    for version, description, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        migration(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?);",
+            (version, description, datetime.now(timezone.utc).isoformat())
+        )
+        conn.commit()
+        newly_applied.append(version)
+        if verbose:
+            print(f"✅ Migración {version} aplicada: {description}.")
+    return newly_applied
+
+
+# Crear o actualizar el esquema en Turso
 def init_db(verbose: bool = False):
-    """Inicializa la base de datos Turso y crea la tabla de logs si no existe."""
+    """Inicializa la base de datos Turso aplicando las migraciones pendientes del esquema."""
     try:
-        conn = get_db_connection()
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS logs (
-                ID TEXT PRIMARY KEY,
-                session_id TEXT,
-                total_tokens INTEGER,
-                prompt_tokens INTEGER,
-                completion_tokens INTEGER,
-                total_cost_usd REAL,
-                user_question TEXT,
-                llm_answer TEXT,
-                date_processed TEXT
-            );
-        """)
+        with get_db_connection() as conn:
+            run_migrations(conn, verbose=verbose)
         if verbose:
           print("✅ Base de datos existe o fue creada con exito.")
     except Exception as e:
         raise Exception(f"Error al inicializar la base de datos: {str(e)}")
 
 
+# Columnas que se insertan por cada registro de log
+LOG_INSERT_COLUMNS: tuple = (
+    "ID", "session_id", "total_tokens", "prompt_tokens", "completion_tokens", "total_cost_usd",
+    "user_question", "llm_answer", "date_processed", "cache_hit", "saved_cost_usd", "deployment",
+    "stage_timings_ms", "coalesced", "history_tokens_saved"
+)
+
+# Filas por sentencia INSERT (SQLite admite como máximo 999 parámetros en versiones antiguas)
+LOGS_PER_INSERT: int = 999 // len(LOG_INSERT_COLUMNS)
+
+
+def _log_row(costs_logs: dict) -> tuple:
+    """Convierte un diccionario de logs en la fila a insertar."""
+    return (
+        str(uuid.uuid4()),  # Identificador único
+        costs_logs["session_id"],
+        costs_logs["total_tokens"],
+        costs_logs["prompt_tokens"],
+        costs_logs["completion_tokens"],
+        costs_logs["total_cost_usd"],
+        costs_logs["user_question"],
+        costs_logs["llm_answer"],
+        costs_logs["date_processed"],
+        int(costs_logs.get("cache_hit", False)),
+        costs_logs.get("saved_cost_usd", 0.0),
+        costs_logs.get("deployment", ""),
+        json.dumps(costs_logs.get("stage_timings_ms") or {}),
+        int(costs_logs.get("coalesced", False)),
+        costs_logs.get("history_tokens_saved", 0)
+    )
+
+
 def store_logs(costs_logs: dict, verbose: bool = False):
     """  
     Almacena los logs en la base de datos Turso.  
@@ -49,25 +518,377 @@ def store_logs(costs_logs: dict, verbose: bool = False):
     Args:  
         costs_logs (dict): Diccionario con los datos de los logs.
     """  
-    try:  
-        conn = get_db_connection()  
-        unique_id = str(uuid.uuid4())  # Generar un identificador único para el registro  
-        conn.execute("""  
-            INSERT INTO logs (ID, session_id, total_tokens, prompt_tokens, completion_tokens, total_cost_usd, user_question, llm_answer, date_processed)  
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);  
-        """, (  
-            unique_id,  # Identificador único  
-            costs_logs["session_id"],  
-            costs_logs["total_tokens"],  
-            costs_logs["prompt_tokens"],  
-            costs_logs["completion_tokens"],  
-            costs_logs["total_cost_usd"],  
-            costs_logs["user_question"],  
-            costs_logs["llm_answer"],  
-            costs_logs["date_processed"]  
-        ))
-        conn.commit()
+    store_logs_batch([costs_logs], verbose=verbose)
+
+
+def store_logs_batch(logs_batch: list, verbose: bool = False):
+    """
+    Almacena varios logs con inserts de varias filas y un único commit.
+
+    Args:
+        logs_batch (list): Lista de diccionarios con los datos de los logs.
+    """
+    try:
+        placeholders = "(" + ", ".join("?" * len(LOG_INSERT_COLUMNS)) + ")"
+        with stage_timer("db_write"), get_db_connection() as conn:
+            for start in range(0, len(logs_batch), LOGS_PER_INSERT):
+                rows = [_log_row(costs_logs) for costs_logs in logs_batch[start:start + LOGS_PER_INSERT]]
+                conn.execute(
+                    f"INSERT INTO logs ({', '.join(LOG_INSERT_COLUMNS)}) VALUES {', '.join([placeholders] * len(rows))};",
+                    tuple(value for row in rows for value in row)
+                )
+            _update_usage_rollups(conn, logs_batch)
+            conn.commit()
         if verbose:
-          print("✅ Logs almacenados con éxito.")
-    except Exception as e:  
-        raise Exception(f"Error al almacenar los logs: {str(e)}")
\ No newline at end of file
+          print(f"✅ {len(logs_batch)} logs almacenados con éxito.")
+    except Exception as e:
+        raise Exception(f"Error al almacenar los logs: {str(e)}")
+
+
+# Granularidades de los agregados de uso: longitud del prefijo ISO 8601 y sufijo del bucket
+ROLLUP_GRANULARITIES: dict = {"hour": (13, ":00"), "day": (10, "")}
+
+# Columnas numéricas de los agregados de uso
+ROLLUP_METRICS: tuple = (
+    "requests", "sessions", "prompt_tokens", "completion_tokens", "total_tokens",
+    "total_cost_usd", "cache_hits", "saved_cost_usd"
+)
+
+
+def usage_bucket(timestamp: str, granularity: str) -> str:
+    """Bucket (UTC) al que pertenece una fecha ISO 8601, p. ej. '2024-05-01T13:00' o '2024-05-01'."""
+    length, suffix = ROLLUP_GRANULARITIES[granularity]
+    return timestamp[:length] + suffix
+
+
+def _update_usage_rollups(conn, logs_batch: list):
+    """
+    Suma un lote de logs a los agregados por hora y por día de cada deployment.
+    Se ejecuta en la misma transacción que el insert de los logs.
+    """
+    totals: dict = {}
+    sessions: set = set()
+    for costs_logs in logs_batch:
+        deployment = costs_logs.get("deployment", "")
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (granularity, usage_bucket(costs_logs["date_processed"], granularity), deployment)
+            row = totals.setdefault(key, dict.fromkeys(ROLLUP_METRICS, 0))
+            row["requests"] += 1
+            row["prompt_tokens"] += costs_logs["prompt_tokens"]
+            row["completion_tokens"] += costs_logs["completion_tokens"]
+            row["total_tokens"] += costs_logs["total_tokens"]
+            row["total_cost_usd"] += costs_logs["total_cost_usd"]
+            row["cache_hits"] += int(costs_logs.get("cache_hit", False))
+            row["saved_cost_usd"] += costs_logs.get("saved_cost_usd", 0.0)
+            sessions.add(key + (costs_logs["session_id"],))
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO usage_rollup_sessions (granularity, bucket, deployment, session_id) VALUES (?, ?, ?, ?);",
+        list(sessions)
+    )
+    conn.executemany(
+        """
+        INSERT INTO usage_rollups (granularity, bucket, deployment, requests, prompt_tokens, completion_tokens,
+                                   total_tokens, total_cost_usd, cache_hits, saved_cost_usd, sessions)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                (SELECT COUNT(*) FROM usage_rollup_sessions s
+                 WHERE s.granularity = ? AND s.bucket = ? AND s.deployment = ?))
+        ON CONFLICT(granularity, bucket, deployment) DO UPDATE SET
+            requests = requests + excluded.requests,
+            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+            completion_tokens = completion_tokens + excluded.completion_tokens,
+            total_tokens = total_tokens + excluded.total_tokens,
+            total_cost_usd = total_cost_usd + excluded.total_cost_usd,
+            cache_hits = cache_hits + excluded.cache_hits,
+            saved_cost_usd = saved_cost_usd + excluded.saved_cost_usd,
+            sessions = MAX(sessions, excluded.sessions);
+        """,
+        [
+            key + (row["requests"], row["prompt_tokens"], row["completion_tokens"], row["total_tokens"],
+                   row["total_cost_usd"], row["cache_hits"], row["saved_cost_usd"]) + key
+            for key, row in totals.items()
+        ]
+    )
+
+
+def fetch_usage_rollups(granularity: str = "hour", start: Optional[str] = None, end: Optional[str] = None,
+                        deployment: Optional[str] = None) -> list:
+    """
+    Lee los agregados de uso sin recorrer la tabla de logs.
+
+    Args:
+        granularity (str): "hour" o "day".
+        start (str): Fecha ISO 8601 (UTC) desde la que se incluyen buckets.
+        end (str): Fecha ISO 8601 (UTC) hasta la que se incluyen buckets.
+        deployment (str): Filtrar por deployment del modelo.
+
+    Returns:
+        list: Un diccionario por bucket y deployment, en orden cronológico.
+    """
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(f"Granularidad no válida: {granularity}. Usa 'hour' o 'day'.")
+    query = f"SELECT bucket, deployment, {', '.join(ROLLUP_METRICS)} FROM usage_rollups WHERE granularity = ?"
+    params: list = [granularity]
+    if start:
+        query += " AND bucket >= ?"
+        params.append(usage_bucket(start, granularity))
+    if end:
+        query += " AND bucket <= ?"
+        params.append(usage_bucket(end, granularity))
+    if deployment is not None:
+        query += " AND deployment = ?"
+        params.append(deployment)
+    query += " ORDER BY bucket, deployment;"
+    with get_db_connection() as conn:
+        rows = conn.execute(query, tuple(params)).fetchall()
+    columns = ("bucket", "deployment") + ROLLUP_METRICS
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def delete_rollup_sessions_older_than_batch(cutoff_time: str, batch_size: int) -> int:
+    """
+    Elimina sesiones registradas en buckets anteriores a la fecha indicada. Solo se usan para
+    contar sesiones distintas de buckets abiertos; los conteos ya agregados no cambian.
+    """
+    with get_db_connection() as conn:
+        result = conn.execute(
+            "DELETE FROM usage_rollup_sessions WHERE rowid IN ("
+            "SELECT rowid FROM usage_rollup_sessions WHERE bucket < ? LIMIT ?);",
+            (usage_bucket(cutoff_time, "day"), batch_size)
+        )
+        conn.commit()
+        return result.rowcount
+
+
+# Columnas que se pueden solicitar en el historial de una sesión
+LOG_COLUMNS: tuple = LOG_INSERT_COLUMNS
+
+
+def encode_history_cursor(date_processed: str, log_id: str) -> str:
+    """Codifica la posición (fecha, ID) del último registro devuelto."""
+    return base64.urlsafe_b64encode(json.dumps([date_processed, log_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_history_cursor(cursor: str) -> tuple[str, str]:
+    """Decodifica un cursor de historial; lanza ValueError si no es válido."""
+    try:
+        date_processed, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(date_processed), str(log_id)
+    except Exception:
+        raise ValueError("Cursor de historial inválido.")
+
+
+def fetch_session_logs(session_id: str, limit: int = 50, cursor: Optional[str] = None,
+                       fields: Optional[list] = None) -> tuple[list, Optional[str]]:
+    """
+    Recupera una página del historial de una sesión en orden cronológico.
+
+    Usa paginación por keyset sobre (date_processed, ID), que aprovecha el índice
+    `idx_logs_session_date` sin importar qué tan avanzada esté la página.
+
+    Args:
+        session_id (str): Sesión a consultar.
+        limit (int): Máximo de registros por página.
+        cursor (str): Cursor devuelto por la página anterior.
+        fields (list): Columnas a devolver (por defecto, todas).
+
+    Returns:
+        tuple: Registros de la página (como diccionarios) y el cursor de la siguiente, o None.
+    """
+    fields = list(fields) if fields else list(LOG_COLUMNS)
+    invalid = [field for field in fields if field not in LOG_COLUMNS]
+    if invalid:
+        raise ValueError(f"Columnas no válidas: {', '.join(invalid)}.")
+
+    # Siempre se leen la fecha y el ID para poder construir el cursor
+    select_columns = list(dict.fromkeys(["date_processed", "ID"] + fields))
+    query = f"SELECT {', '.join(select_columns)} FROM logs WHERE session_id = ?"
+    params: list = [session_id]
+    if cursor:
+        date_processed, log_id = decode_history_cursor(cursor)
+        query += " AND (date_processed > ? OR (date_processed = ? AND ID > ?))"
+        params += [date_processed, date_processed, log_id]
+    query += " ORDER BY date_processed, ID LIMIT ?;"
+    params.append(limit + 1)
+
+    with stage_timer("db_read"), get_db_connection() as conn:
+        rows = conn.execute(query, tuple(params)).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1][0], rows[-1][1])
+    logs = [{column: row[select_columns.index(column)] for column in fields} for row in rows]
+    return logs, next_cursor
+
+
+def delete_session_logs(session_id: str) -> int:
+    """Elimina los logs de una sesión y devuelve el número de filas eliminadas."""
+    with get_db_connection() as conn:
+        result = conn.execute("DELETE FROM logs WHERE session_id = ?;", (session_id,))
+        conn.commit()
+        return result.rowcount
+
+
+def count_active_sessions(since: str) -> int:
+    """Cuenta las sesiones distintas con actividad desde la fecha indicada (ISO 8601, UTC)."""
+    with get_db_connection() as conn:
+        result = conn.execute(
+            "SELECT COUNT(DISTINCT session_id) FROM usage_rollup_sessions WHERE granularity = 'hour' AND bucket >= ?;",
+            (usage_bucket(since, "hour"),)
+        )
+        return result.fetchone()[0]
+
+
+def delete_logs_older_than(cutoff_time: str) -> int:
+    """Elimina los logs anteriores a la fecha indicada (ISO 8601)."""
+    with get_db_connection() as conn:
+        result = conn.execute("DELETE FROM logs WHERE date_processed < ?;", (cutoff_time,))
+        conn.commit()
+        return result.rowcount
+
+
+def delete_logs_older_than_batch(cutoff_time: str, batch_size: int) -> int:
+    """
+    Elimina como máximo `batch_size` logs anteriores a la fecha indicada, en su propia
+    transacción, para no bloquear las escrituras durante mucho tiempo.
+
+    Returns:
+        int: Filas eliminadas (0 cuando ya no quedan logs antiguos).
+    """
+    with get_db_connection() as conn:
+        result = conn.execute(
+            "DELETE FROM logs WHERE ID IN ("
+            "SELECT ID FROM logs WHERE date_processed < ? ORDER BY date_processed LIMIT ?);",
+            (cutoff_time, batch_size)
+        )
+        conn.commit()
+        return result.rowcount
+
+
+def delete_session_turns_older_than_batch(cutoff_time: str, batch_size: int) -> int:
+    """Elimina como máximo `batch_size` turnos del historial compartido anteriores a la fecha indicada."""
+    with get_db_connection() as conn:
+        result = conn.execute(
+            "DELETE FROM session_turns WHERE id IN ("
+            "SELECT id FROM session_turns WHERE created_at < ? ORDER BY created_at LIMIT ?);",
+            (cutoff_time, batch_size)
+        )
+        conn.commit()
+        return result.rowcount
+
+
+def delete_session_summaries_older_than_batch(cutoff_time: str, batch_size: int) -> int:
+    """Elimina como máximo `batch_size` resúmenes de sesiones sin actualizar desde la fecha indicada."""
+    with get_db_connection() as conn:
+        result = conn.execute(
+            "DELETE FROM session_summaries WHERE session_id IN ("
+            "SELECT session_id FROM session_summaries WHERE updated_at < ? ORDER BY updated_at LIMIT ?);",
+            (cutoff_time, batch_size)
+        )
+        conn.commit()
+        return result.rowcount
+
+
+def acquire_job_lease(name: str, owner: str, ttl_seconds: float) -> bool:
+    """
+    Intenta tomar (o renovar) el lease de un trabajo periódico.
+    Solo lo obtiene si está libre, vencido o ya pertenece a `owner`.
+
+    Returns:
+        bool: True si `owner` tiene el lease hasta dentro de `ttl_seconds` segundos.
+    """
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO job_leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE job_leases.expires_at < ? OR job_leases.owner = excluded.owner;",
+            (name, owner, now + ttl_seconds, now)
+        )
+        conn.commit()
+        row = conn.execute("SELECT owner FROM job_leases WHERE name = ?;", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+
+def release_job_lease(name: str, owner: str):
+    """Libera el lease de un trabajo si pertenece a `owner`."""
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM job_leases WHERE name = ? AND owner = ?;", (name, owner))
+        conn.commit()
+
+
+def fetch_kb_generation() -> int:
+    """Devuelve la generación actual de la base de conocimientos (0 si nunca se sincronizó con cambios)."""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT generation FROM kb_generation WHERE id = 1;").fetchone()
+        return row[0] if row else 0
+
+
+def bump_kb_generation() -> int:
+    """Incrementa la generación de la base de conocimientos y devuelve el nuevo valor."""
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO kb_generation (id, generation, updated_at) VALUES (1, 1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET generation = kb_generation.generation + 1, updated_at = excluded.updated_at;",
+            (datetime.now(timezone.utc).isoformat(),)
+        )
+        conn.commit()
+        return conn.execute("SELECT generation FROM kb_generation WHERE id = 1;").fetchone()[0]
+
+
+def load_kb_manifest() -> dict:
+    """Carga el manifiesto de la base de conocimientos: blob -> etag, hash y chunks indexados."""
+    with get_db_connection() as conn:
+        rows = conn.execute("""
+            SELECT blob_name, etag, last_modified, content_hash, chunk_ids,
+                   chunk_signatures, duplicate_of, chunk_tokens
+            FROM kb_manifest;
+        """).fetchall()
+        return {
+            row[0]: {
+                "etag": row[1],
+                "last_modified": row[2],
+                "content_hash": row[3],
+                "chunk_ids": json.loads(row[4] or "[]"),
+                "chunk_signatures": row[5] or "",
+                "duplicate_of": json.loads(row[6] or "[]"),
+                "chunk_tokens": row[7] or 0,
+            }
+            for row in rows
+        }
+
+
+def upsert_kb_manifest_entry(blob_name: str, etag: str, last_modified: str, content_hash: str,
+                             chunk_ids: list, synced_at: str, chunk_signatures: str = "",
+                             duplicate_of: Optional[list] = None, chunk_tokens: int = 0):
+    """Guarda (o reemplaza) la entrada del manifiesto de un blob."""
+    with get_db_connection() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO kb_manifest (blob_name, etag, last_modified, content_hash, chunk_ids, synced_at,
+                                                chunk_signatures, duplicate_of, chunk_tokens)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """, (blob_name, etag, last_modified, content_hash, json.dumps(chunk_ids), synced_at,
+              chunk_signatures, json.dumps(duplicate_of or []), chunk_tokens))
+        conn.commit()
+
+
+def invalidate_kb_manifest_entries(blob_names: list):
+    """
+    Borra el ETag y el hash de contenido de los blobs indicados para que la próxima
+    sincronización los vuelva a procesar; sus chunks indexados se conservan.
+    """
+    if not blob_names:
+        return
+    placeholders = ",".join("?" * len(blob_names))
+    with get_db_connection() as conn:
+        conn.execute(f"UPDATE kb_manifest SET etag = '', content_hash = '' WHERE blob_name IN ({placeholders});",
+                     list(blob_names))
+        conn.commit()
+
+
+def delete_kb_manifest_entry(blob_name: str):
+    """Elimina la entrada del manifiesto de un blob."""
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM kb_manifest WHERE blob_name = ?;", (blob_name,))
+        conn.commit()
@@ -0,0 +1,105 @@
+"""Caché persistente de embeddings direccionada por contenido"""
+
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    Guarda vectores en un archivo SQLite local como blobs float32.
+
+    La clave de cada vector es el nombre del modelo más el hash SHA-256 del texto, de modo
+    que un chunk idéntico nunca se vuelve a embeber con el mismo modelo.
+    """
+
+    # SQLite admite hasta 999 parámetros por consulta en versiones antiguas
+    _LOOKUP_BATCH_SIZE = 900
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL
+            );
+        """)
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """Clave del vector de un texto para un modelo."""
+        return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """Busca varios vectores a la vez; devuelve solo los encontrados."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), self._LOOKUP_BATCH_SIZE):
+                batch = unique_keys[start:start + self._LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders});", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: dict[str, list[float]]):
+        """Guarda varios vectores en una sola transacción."""
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?);", rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envuelve un modelo de embeddings y consulta primero la caché persistente.
+
+    `embed_documents` resuelve todo el lote con una sola búsqueda en la caché y embebe
+    los textos faltantes (sin duplicados) en una sola llamada al modelo.
+    Las consultas (`embed_query`) se delegan directamente al modelo.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [EmbeddingCache.make_key(self.model, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), new_vectors))
+            self.cache.put_many(computed)
+            vectors.update(computed)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+    def stats(self) -> dict:
+        """Aciertos y fallos de la caché desde que se creó la instancia."""
+        return {"hits": self.hits, "misses": self.misses}
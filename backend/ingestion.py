@@ -0,0 +1,428 @@
+"""Pipeline de ingesta en streaming: blobs -> parser -> splitter -> embeddings -> Azure AI Search"""
+
+import queue
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Optional
+from langchain_core.documents import Document
+from retries import call_with_retries
+from database import (load_kb_manifest, upsert_kb_manifest_entry, delete_kb_manifest_entry,
+                      invalidate_kb_manifest_entries)
+
+
+# Marca de fin de la cola de una etapa
+_DONE = object()
+
+
+def chunk_ids(blob_name: str, chunks: list[Document]) -> list[str]:
+    """
+    Genera IDs deterministas por contenido para los chunks de un blob.
+    Un chunk que no cambió conserva su ID, por lo que no se vuelve a embeber.
+    """
+    ids, seen = [], {}
+    for chunk in chunks:
+        digest = hashlib.sha1(f"{blob_name}\0{chunk.page_content}".encode("utf-8")).hexdigest()
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        ids.append(digest if occurrence == 0 else f"{digest}-{occurrence}")
+    return ids
+
+
+@dataclass
+class IngestionConfig:
+    """Paralelismo, tamaños de lote y reintentos del pipeline."""
+    parse_workers: int = 4
+    split_workers: int = 1
+    embed_workers: int = 2
+    upload_workers: int = 2
+    embed_batch_size: int = 64
+    upload_batch_size: int = 100
+    queue_size: int = 32
+    max_retries: int = 5
+    flush_interval_seconds: float = 0.5
+
+
+@dataclass
+class _BlobTask:
+    """Estado de un blob mientras atraviesa el pipeline."""
+    name: str
+    etag: str
+    last_modified: Optional[str]
+    entry: Optional[dict]
+    documents: list = field(default_factory=list)
+    content_hash: str = ""
+    chunk_ids: list = field(default_factory=list)
+    chunk_signatures: str = ""
+    chunk_tokens: int = 0
+    duplicate_of: list = field(default_factory=list)
+    new_chunks: int = 0
+    pending: int = 0
+    failed: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class _StageStats:
+    """Contadores de throughput de una etapa."""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.retries = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    def count_retry(self, exc: Exception, delay: float):
+        with self._lock:
+            self.retries += 1
+        print(f"⚠️ [{self.name}] error transitorio ({exc}); reintentando en {delay:.1f} s.")
+
+    def count_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def as_dict(self, wall_seconds: float) -> dict:
+        return {
+            "unit": self.unit,
+            "items": self.items,
+            f"{self.unit}_per_second": round(self.items / wall_seconds, 2) if wall_seconds else 0.0,
+            "busy_seconds": round(self.busy_seconds, 2),
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
+
+class _Stage:
+    """
+    Etapa del pipeline: una cola acotada y un grupo de hilos que la consumen.
+
+    Con `batch_size` el handler recibe listas: los hilos agrupan elementos hasta completar el
+    lote (que puede ser de uno) o hasta que pasen `flush_interval` segundos; sin él recibe
+    cada elemento por separado. Cuando el último hilo termina, cierra la etapa siguiente.
+    Si el handler lanza una excepción, `on_error` recibe los elementos del lote y el hilo sigue.
+    """
+
+    def __init__(self, name: str, unit: str, handler: Callable, workers: int, queue_size: int,
+                 on_error: Callable[[list, Exception], None], batch_size: Optional[int] = None,
+                 flush_interval: float = 0.5):
+        self.name = name
+        self.handler = handler
+        self.on_error = on_error
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stats = _StageStats(name, unit)
+        self.next: Optional["_Stage"] = None
+        self._active = workers
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        self.queue.put(item)  # Bloquea si la cola está llena (contrapresión)
+
+    def finish(self):
+        for _ in range(self.workers):
+            self.queue.put(_DONE)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _next_batch(self) -> tuple[list, bool]:
+        item = self.queue.get()
+        if item is _DONE:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < (self.batch_size or 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _worker(self):
+        done = False
+        try:
+            while not done:
+                batch, done = self._next_batch()
+                if batch:
+                    started = time.perf_counter()
+                    try:
+                        items = self.handler(batch if self.batch_size else batch[0])
+                    except Exception as e:
+                        items = 0
+                        self.on_error(batch, e)
+                    self.stats.record(items or 0, time.perf_counter() - started)
+        finally:
+            # Aunque el hilo muera, la etapa siguiente se cierra y run() no queda esperando
+            with self._lock:
+                self._active -= 1
+                last = self._active == 0
+            if last and self.next is not None:
+                self.next.finish()
+
+
+class IngestionPipeline:
+    """
+    Sincroniza el contenedor de blobs con el vector store procesando los documentos en streaming.
+
+    Cada etapa tiene su propia cola acotada y su propio paralelismo, por lo que la memoria
+    no crece con el tamaño del corpus. Los embeddings y las subidas se hacen por lotes con
+    reintentos ante 429: los de embeddings los hace el planificador de cuota del deployment
+    (`RateLimitedEmbeddings`), que respeta Retry-After, y el pipeline no los repite.
+    El manifiesto de cada blob se guarda apenas todos sus chunks están indexados, lo que
+    funciona como checkpoint: una ejecución interrumpida retoma donde quedó.
+    Con un `deduplicator` (ver `chunking.py`) los chunks casi duplicados se descartan antes
+    de embeberlos.
+    """
+
+    def __init__(self, vector_store, container_client, embeddings, load_blob: Callable,
+                 text_splitter, config: IngestionConfig, deduplicator=None):
+        self.vector_store = vector_store
+        self.container_client = container_client
+        self.embeddings = embeddings
+        self.load_blob = load_blob
+        self.text_splitter = text_splitter
+        self.config = config
+        self.deduplicator = deduplicator
+        self._summary_lock = threading.Lock()
+        self.force_update = False
+        self.summary: dict = {}
+
+    def run(self, force_update: bool = False) -> dict:
+        """Ejecuta la sincronización completa y devuelve su resumen."""
+        config = self.config
+        self.force_update = force_update
+        self.summary = {"added": [], "updated": [], "unchanged": [], "removed": [], "failed": [],
+                        "chunks_upserted": 0, "chunks_deleted": 0}
+        started = time.perf_counter()
+        if self.deduplicator is not None:
+            self.deduplicator.reset()
+
+        parse = _Stage("parse", "docs", self._parse, config.parse_workers, config.queue_size,
+                       lambda tasks, e: self._fail_tasks("parse", tasks, e))
+        split = _Stage("split", "chunks", self._split, config.split_workers, config.queue_size,
+                       lambda tasks, e: self._fail_tasks("split", tasks, e))
+        embed = _Stage("embed", "vectors", self._embed, config.embed_workers,
+                       config.queue_size * config.embed_batch_size,
+                       lambda items, e: self._fail_chunks("embed", items, e),
+                       config.embed_batch_size, config.flush_interval_seconds)
+        upload = _Stage("upload", "vectors", self._upload, config.upload_workers,
+                        config.queue_size * config.upload_batch_size,
+                        lambda items, e: self._fail_chunks("upload", items, e),
+                        config.upload_batch_size, config.flush_interval_seconds)
+        parse.next, split.next, embed.next = split, embed, upload
+        self._stages = {"parse": parse, "split": split, "embed": embed, "upload": upload}
+        for stage in self._stages.values():
+            stage.start()
+
+        # Productor: recorre los blobs sin materializar el listado completo
+        manifest = load_kb_manifest()
+        seen_blobs = set()
+        for blob in self.container_client.list_blobs():
+            seen_blobs.add(blob.name)
+            entry = manifest.get(blob.name)
+            if entry and entry["etag"] == blob.etag and not force_update:
+                self._register_unchanged(entry)
+                self._add_to_summary("unchanged", blob.name)
+                continue
+            last_modified = blob.last_modified.isoformat() if blob.last_modified else None
+            parse.put(_BlobTask(name=blob.name, etag=blob.etag, last_modified=last_modified, entry=entry))
+        parse.finish()
+        for stage in self._stages.values():
+            stage.join()
+
+        # Eliminar del índice los chunks de los blobs que ya no existen
+        for blob_name in set(manifest) - seen_blobs:
+            stale_ids = manifest[blob_name]["chunk_ids"]
+            if stale_ids:
+                self._with_retries(self._stages["upload"], self.vector_store.delete, ids=stale_ids)
+            delete_kb_manifest_entry(blob_name)
+            self._add_to_summary("removed", blob_name, chunks_deleted=len(stale_ids))
+
+        # Los blobs con chunks descartados en favor de un chunk que ya no está indexado (su blob
+        # se eliminó, cambió o falló) se vuelven a procesar en la próxima sincronización
+        manifest = load_kb_manifest()
+        indexed_ids = {chunk_id for entry in manifest.values() for chunk_id in entry["chunk_ids"]}
+        requeued = sorted(name for name, entry in manifest.items()
+                          if any(chunk_id not in indexed_ids for chunk_id in entry["duplicate_of"]))
+        invalidate_kb_manifest_entries(requeued)
+        self.summary["requeued"] = requeued
+        self.summary["index"] = {
+            "blobs": len(manifest),
+            "chunks": len(indexed_ids),
+            "tokens": sum(entry["chunk_tokens"] for entry in manifest.values()),
+        }
+        if self.deduplicator is not None:
+            self.summary["dedup"] = self.deduplicator.stats()
+
+        wall_seconds = time.perf_counter() - started
+        self.summary["duration_seconds"] = round(wall_seconds, 2)
+        self.summary["stages"] = {name: stage.stats.as_dict(wall_seconds) for name, stage in self._stages.items()}
+        return self.summary
+
+    # Etapas
+
+    def _parse(self, task: _BlobTask) -> int:
+        stage = self._stages["parse"]
+        try:
+            documents, content_hash = self._with_retries(stage, self.load_blob, task.name)
+        except Exception as e:
+            self._fail(stage, task, e)
+            return 0
+
+        # El ETag cambia también con operaciones que no modifican el contenido
+        if task.entry and task.entry["content_hash"] == content_hash and not self.force_update:
+            upsert_kb_manifest_entry(task.name, task.etag, task.last_modified, content_hash,
+                                     task.entry["chunk_ids"], datetime.now(timezone.utc).isoformat(),
+                                     task.entry["chunk_signatures"], task.entry["duplicate_of"],
+                                     task.entry["chunk_tokens"])
+            self._register_unchanged(task.entry)
+            self._add_to_summary("unchanged", task.name)
+            return len(documents)
+
+        task.documents, task.content_hash = documents, content_hash
+        self._stages["split"].put(task)
+        return len(documents)
+
+    def _split(self, task: _BlobTask) -> int:
+        chunks = self.text_splitter.split_documents(documents=task.documents)
+        task.documents = []  # Liberar el texto completo; solo se necesitan los chunks
+        task.chunk_ids = chunk_ids(task.name, chunks)
+
+        # Embeber solo los chunks que no están indexados (o todos si se fuerza)
+        known_ids = set() if self.force_update or task.entry is None else set(task.entry["chunk_ids"])
+        if self.deduplicator is not None:
+            filtered = self.deduplicator.filter(task.chunk_ids, chunks, known_ids)
+            chunks, task.chunk_ids = filtered.chunks, filtered.ids
+            task.chunk_signatures, task.chunk_tokens = filtered.signatures, filtered.tokens
+            task.duplicate_of = filtered.duplicate_of
+        new_chunks = [(chunk_id, chunk) for chunk_id, chunk in zip(task.chunk_ids, chunks) if chunk_id not in known_ids]
+        task.new_chunks = task.pending = len(new_chunks)
+        if not new_chunks:
+            self._finalize(task)
+        for chunk_id, chunk in new_chunks:
+            self._stages["embed"].put((task, chunk_id, chunk))
+        return len(chunks)
+
+    def _embed(self, batch: list) -> int:
+        stage = self._stages["embed"]
+        try:
+            vectors = self.embeddings.embed_documents([chunk.page_content for _, _, chunk in batch])
+        except Exception as e:
+            for task, _, _ in batch:
+                self._fail(stage, task, e, pending=1)
+            return 0
+        for (task, chunk_id, chunk), vector in zip(batch, vectors):
+            self._stages["upload"].put((task, chunk_id, chunk, vector))
+        return len(batch)
+
+    def _upload(self, batch: list) -> int:
+        stage = self._stages["upload"]
+        try:
+            self._with_retries(
+                stage,
+                self.vector_store.add_embeddings,
+                text_embeddings=[(chunk.page_content, vector) for _, _, chunk, vector in batch],
+                metadatas=[chunk.metadata for _, _, chunk, _ in batch],
+                keys=[chunk_id for _, chunk_id, _, _ in batch]
+            )
+        except Exception as e:
+            for task, _, _, _ in batch:
+                self._fail(stage, task, e, pending=1)
+            return 0
+        for task, _, _, _ in batch:
+            self._chunk_done(task)
+        return len(batch)
+
+    # Checkpoint por blob
+
+    def _chunk_done(self, task: _BlobTask):
+        with task.lock:
+            task.pending -= 1
+            finished = task.pending == 0
+        if finished:
+            self._finalize(task)
+
+    def _finalize(self, task: _BlobTask):
+        """Borra los chunks obsoletos del blob y guarda su entrada en el manifiesto."""
+        if task.failed:
+            self._add_to_summary("failed", task.name)
+            return
+        previous_ids = task.entry["chunk_ids"] if task.entry else []
+        stale_ids = sorted(set(previous_ids) - set(task.chunk_ids))
+        try:
+            if stale_ids:
+                self._with_retries(self._stages["upload"], self.vector_store.delete, ids=stale_ids)
+            upsert_kb_manifest_entry(task.name, task.etag, task.last_modified, task.content_hash,
+                                     task.chunk_ids, datetime.now(timezone.utc).isoformat(),
+                                     task.chunk_signatures, task.duplicate_of, task.chunk_tokens)
+        except Exception as e:
+            print(f"❌ No se pudo finalizar el blob {task.name}: {str(e)}")
+            self._add_to_summary("failed", task.name)
+            return
+        self._add_to_summary("updated" if task.entry else "added", task.name,
+                             chunks_upserted=task.new_chunks, chunks_deleted=len(stale_ids))
+
+    # Utilidades
+
+    def _register_unchanged(self, entry: dict):
+        """Los chunks de un blob sin cambios siguen indexados: sirven de referencia para descartar duplicados."""
+        if self.deduplicator is not None:
+            self.deduplicator.register(entry["chunk_ids"], entry["chunk_signatures"])
+
+    def _fail(self, stage: _Stage, task: _BlobTask, exc: Exception, pending: int = 0):
+        """Marca el blob como fallido; no se guarda en el manifiesto y se reintentará en la próxima ejecución."""
+        stage.stats.count_error()
+        with task.lock:
+            first_failure = not task.failed
+            task.failed = True
+        if first_failure:
+            print(f"❌ [{stage.name}] error procesando {task.name}: {str(exc)}")
+        if pending:
+            self._chunk_done(task)
+        else:
+            self._add_to_summary("failed", task.name)
+
+    def _fail_tasks(self, stage_name: str, tasks: list, exc: Exception):
+        """Error inesperado en una etapa que recibe blobs completos (parse, split)."""
+        for task in tasks:
+            self._fail(self._stages[stage_name], task, exc)
+
+    def _fail_chunks(self, stage_name: str, items: list, exc: Exception):
+        """Error inesperado en una etapa que recibe chunks: cada uno descuenta su pendiente."""
+        for item in items:
+            self._fail(self._stages[stage_name], item[0], exc, pending=1)
+
+    def _with_retries(self, stage: _Stage, fn: Callable, *args, **kwargs):
+        return call_with_retries(fn, *args, max_retries=self.config.max_retries,
+                                 on_retry=stage.stats.count_retry, **kwargs)
+
+    def _add_to_summary(self, key: str, blob_name: str, chunks_upserted: int = 0, chunks_deleted: int = 0):
+        with self._summary_lock:
+            self.summary[key].append(blob_name)
+            self.summary["chunks_upserted"] += chunks_upserted
+            self.summary["chunks_deleted"] += chunks_deleted
@@ -0,0 +1,229 @@
+"""Escritor de logs en segundo plano con commits agrupados"""
+
+import os
+import json
+import time
+import queue
+import threading
+from collections import deque
+from typing import Callable, Optional
+from settings import get_settings
+from database import store_logs_batch
+
+
+class LogWriter:
+    """
+    Acumula los logs de interacción en una cola acotada y los escribe en lote.
+
+    Un hilo en segundo plano vacía la cola con inserts de varias filas cada `batch_size`
+    registros o cada `flush_interval_ms` milisegundos, lo que ocurra primero. Al detenerse
+    escribe todo lo pendiente.
+
+    Política de desborde: si la cola está llena, `submit` nunca bloquea la solicitud.
+    Con `overflow_policy="spill"` (por defecto) el registro pasa a una lista en memoria que
+    el hilo de escritura agrega al archivo local `spill_path` (sin E/S en el event loop);
+    con `"drop"` se descarta. En ambos casos se contabiliza en `stats()`.
+    Si Turso no responde, el lote fallido también se guarda en `spill_path`, y el archivo
+    se reinserta en la base de datos después de la siguiente escritura exitosa. Un registro
+    que la base de datos rechaza `MAX_REPLAY_ATTEMPTS` veces se aparta a `<spill_path>.quarantine`.
+    """
+
+    # Reinserciones fallidas tras las cuales un registro se aparta del archivo local
+    MAX_REPLAY_ATTEMPTS = 5
+
+    def __init__(self, write_batch: Callable[[list], None], max_queue: int, batch_size: int,
+                 flush_interval_ms: int, spill_path: str, overflow_policy: str = "spill"):
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.spill_path = spill_path
+        self.overflow_policy = overflow_policy
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._overflow: deque = deque()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {
+            "submitted": 0,
+            "written": 0,
+            "batches": 0,
+            "overflowed": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "write_errors": 0,
+            "quarantined": 0,
+        }
+
+    def start(self):
+        """Inicia el hilo de escritura."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Detiene el hilo después de escribir todos los registros pendientes."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, record: dict) -> bool:
+        """Encola un registro sin bloquear. Devuelve False si se aplicó la política de desborde."""
+        self._count("submitted")
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self._count("overflowed")
+            if self.overflow_policy == "spill":
+                self._overflow.append(record)
+            else:
+                self._count("dropped")
+            return False
+
+    def stats(self) -> dict:
+        """Devuelve los contadores del escritor y el tamaño actual de la cola."""
+        with self._stats_lock:
+            return {"queued": self._queue.qsize(), "overflow_pending": len(self._overflow), **self._counters}
+
+    def _run(self):
+        self._replay_spill()
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            self._spill_overflow()
+            if batch:
+                self._flush(batch)
+        self._spill_overflow()
+
+    def _spill_overflow(self):
+        """Pasa al archivo local los registros que no cupieron en la cola."""
+        records = []
+        while self._overflow:
+            records.append(self._overflow.popleft())
+        if records:
+            self._spill(records)
+
+    def _next_batch(self) -> list:
+        """Reúne hasta `batch_size` registros, esperando como máximo `flush_interval` segundos."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: list):
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            self._count("write_errors")
+            print(f"⚠️ No se pudieron escribir {len(batch)} logs ({str(e)}); se guardan en {self.spill_path}.")
+            self._spill(batch)
+            return
+        self._count("written", len(batch))
+        self._count("batches")
+        self._replay_spill()
+
+    def _spill(self, records: list):
+        """Agrega registros al archivo local (JSON Lines)."""
+        try:
+            with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as spill_file:
+                for record in records:
+                    spill_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._count("spilled", len(records))
+        except OSError as e:
+            self._count("dropped", len(records))
+            print(f"❌ Se descartaron {len(records)} logs: no se pudo escribir {self.spill_path} ({str(e)}).")
+
+    def _replay_spill(self):
+        """
+        Reinserta en la base de datos los registros guardados localmente. El archivo se lee y se
+        elimina con el lock tomado, pero las escrituras se hacen sin él. Si un lote falla, sus
+        registros se escriben de a uno para aislar los que la base de datos rechaza; si ninguno
+        entra, se asume que Turso sigue sin responder y el resto queda para el próximo intento.
+        """
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            with open(self.spill_path, encoding="utf-8") as spill_file:
+                records = [json.loads(line) for line in spill_file if line.strip()]
+            os.remove(self.spill_path)
+
+        replayed, failed, pending = 0, [], []
+        unavailable = False
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            if unavailable:
+                pending.extend(batch)
+                continue
+            try:
+                self._write_batch([self._without_attempts(record) for record in batch])
+                replayed += len(batch)
+                continue
+            except Exception:
+                pass
+            batch_failed = []
+            for record in batch:
+                try:
+                    self._write_batch([self._without_attempts(record)])
+                    replayed += 1
+                except Exception:
+                    record["_replay_attempts"] = record.get("_replay_attempts", 0) + 1
+                    batch_failed.append(record)
+            failed.extend(batch_failed)
+            unavailable = len(batch_failed) == len(batch)
+
+        quarantined = [record for record in failed if record["_replay_attempts"] >= self.MAX_REPLAY_ATTEMPTS]
+        retry = [record for record in failed if record["_replay_attempts"] < self.MAX_REPLAY_ATTEMPTS] + pending
+        if quarantined:
+            self._append(f"{self.spill_path}.quarantine", quarantined)
+            self._count("quarantined", len(quarantined))
+            print(f"❌ {len(quarantined)} logs rechazados {self.MAX_REPLAY_ATTEMPTS} veces; "
+                  f"se apartan en {self.spill_path}.quarantine.")
+        if retry:
+            self._append(self.spill_path, retry)
+        self._count("replayed", replayed)
+
+    def _append(self, path: str, records: list):
+        try:
+            with self._spill_lock, open(path, "a", encoding="utf-8") as spill_file:
+                for record in records:
+                    spill_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            self._count("dropped", len(records))
+            print(f"❌ Se descartaron {len(records)} logs: no se pudo escribir {path} ({str(e)}).")
+
+    @staticmethod
+    def _without_attempts(record: dict) -> dict:
+        return {key: value for key, value in record.items() if key != "_replay_attempts"}
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._stats_lock:
+            self._counters[counter] += amount
+
+
+# Instancia global del escritor
+_log_writer = None
+
+def get_log_writer() -> LogWriter:
+    """Obtiene el escritor de logs (singleton)."""
+    global _log_writer
+    if _log_writer is None:
+        settings = get_settings()
+        _log_writer = LogWriter(
+            write_batch=store_logs_batch,
+            max_queue=settings.log_writer_max_queue,
+            batch_size=settings.log_writer_batch_size,
+            flush_interval_ms=settings.log_writer_flush_interval_ms,
+            spill_path=settings.log_writer_spill_path,
+            overflow_policy=settings.log_writer_overflow_policy,
+        )
+    return _log_writer
@@ -3,15 +3,22 @@ FastAPI main application file for AI Chatbot
 Configures the FastAPI app, middleware, and routes
 """
 
+import time
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
 from datetime import datetime
 from azure.core.exceptions import AzureError
+from fastapi.concurrency import run_in_threadpool
 from chatbot_api import router
+from database import close_db_pool
+from log_writer import get_log_writer
+from retention import get_retention_scheduler
+from registry import get_component_registry
 from settings import get_settings, validate_azure_settings
+import metrics
 
 
 # Obtener configuraciones globales
@@ -28,10 +35,25 @@ async def lifespan(app: FastAPI):
     if not validate_azure_settings():
         raise RuntimeError("Faltan variables de entorno requeridas para Azure. Verifica la configuracion.")
 
+    # Crear en paralelo el pool de Turso (con sus migraciones), los clientes de Azure y la cadena RAG
+    await get_component_registry().initialize()
+
+    # Iniciar el escritor de logs en segundo plano
+    log_writer = get_log_writer()
+    log_writer.start()
+
+    # Programar la retención periódica de logs antiguos
+    retention_scheduler = get_retention_scheduler()
+    if settings.retention_enabled:
+        retention_scheduler.start()
+
     yield  # Aquí se ejecuta la aplicación
 
     # Shutdown
     print("🛑 Shutting down AI Chatbot Backend...")
+    await retention_scheduler.stop()
+    await run_in_threadpool(log_writer.stop)  # Escribe los logs pendientes antes de cerrar el pool
+    close_db_pool()
 
 # Crear la aplicación FastAPI
 app = FastAPI(
@@ -52,6 +74,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Medir la duración y el resultado de cada solicitud
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Registra latencia, código de estado y solicitudes en curso por endpoint."""
+    started = time.perf_counter()
+    metrics.IN_FLIGHT.labels(method=request.method).inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Usar la ruta declarada (p. ej. /api/chat/history/{session_id}) para acotar las etiquetas
+        route = request.scope.get("route")
+        endpoint_label = getattr(route, "path", None) or "unmatched"
+        metrics.IN_FLIGHT.labels(method=request.method).dec()
+        metrics.REQUEST_DURATION.labels(method=request.method, endpoint=endpoint_label).observe(time.perf_counter() - started)
+        metrics.REQUESTS.labels(method=request.method, endpoint=endpoint_label, status=str(status)).inc()
+
 # Incluir el router de chatbot_api
 app.include_router(router, prefix="/api", tags=["chatbot"])
 
@@ -69,6 +110,18 @@ async def root():
         "docs": "/docs"
     }
 
+# Endpoint de métricas de Prometheus
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Prometheus metrics endpoint
+    Exposes stage latencies, tokens, cost, errors, retries and in-flight gauges
+    """
+    if not metrics.PROMETHEUS_AVAILABLE:
+        raise HTTPException(status_code=503, detail="prometheus_client no está instalado.")
+    body, content_type = metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
+
 # Endpoint de verificación de salud
 @app.get("/api/health")
 async def health_check():
@@ -0,0 +1,202 @@
+"""Almacén de memoria conversacional por sesión con desalojo LRU/TTL"""
+
+import time
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from settings import get_settings
+
+
+@dataclass
+class Conversation:
+    """
+    Historial de una sesión: los turnos (pregunta, respuesta) con sus ids crecientes y el
+    resumen acumulado de los turnos con id hasta `summarized_through_id`.
+    """
+    turns: list = field(default_factory=list)
+    turn_ids: list = field(default_factory=list)
+    summary: str = ""
+    summarized_through_id: int = 0
+
+    @property
+    def summarized_turns(self) -> int:
+        """Cantidad de turnos (los más antiguos) ya incluidos en el resumen."""
+        return bisect_right(self.turn_ids, self.summarized_through_id)
+
+
+@dataclass
+class _SessionEntry:
+    """Historial de una sesión y su tamaño aproximado en bytes."""
+    turns: list = field(default_factory=list)
+    turn_ids: list = field(default_factory=list)
+    last_turn_id: int = 0
+    summary: str = ""
+    summarized_through_id: int = 0
+    size_bytes: int = 0
+    last_access: float = 0.0
+
+
+def _turn_size(question: str, answer: str) -> int:
+    """Tamaño aproximado de un turno (pregunta + respuesta) en bytes UTF-8."""
+    return len(question.encode("utf-8")) + len(answer.encode("utf-8"))
+
+
+class SessionMemoryStore:
+    """
+    Guarda el historial de chat de cada sesión en memoria.
+
+    El almacén está acotado por número de sesiones y por bytes totales. Las sesiones
+    inactivas más de `ttl_seconds` expiran y, si se supera algún límite, se desalojan
+    las sesiones menos usadas recientemente (LRU).
+    """
+
+    def __init__(self, max_sessions: int, max_bytes: int, ttl_seconds: float):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "ttl_evictions": 0,
+            "lru_evictions": 0,
+            "trimmed_turns": 0,
+        }
+
+    def get_history(self, session_id: str) -> list[tuple[str, str]]:
+        """Devuelve una copia del historial (pregunta, respuesta) de la sesión."""
+        return self.get_conversation(session_id).turns
+
+    def get_conversation(self, session_id: str) -> Conversation:
+        """Devuelve una copia del historial de la sesión junto con su resumen."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self._counters["misses"] += 1
+                return Conversation()
+            self._counters["hits"] += 1
+            entry.last_access = now
+            self._sessions.move_to_end(session_id)
+            return Conversation(list(entry.turns), list(entry.turn_ids), entry.summary, entry.summarized_through_id)
+
+    def append_turn(self, session_id: str, question: str, answer: str):
+        """Agrega un turno al historial de la sesión y aplica los límites del almacén."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = _SessionEntry()
+                self._sessions[session_id] = entry
+            size = _turn_size(question, answer)
+            entry.last_turn_id += 1
+            entry.turns.append((question, answer))
+            entry.turn_ids.append(entry.last_turn_id)
+            entry.size_bytes += size
+            entry.last_access = now
+            self._total_bytes += size
+            self._sessions.move_to_end(session_id)
+            self._enforce_limits(session_id)
+
+    def set_summary(self, session_id: str, summary: str, summarized_through_id: int):
+        """Guarda el resumen de la sesión si cubre más turnos que el actual y aplica los límites del almacén."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None or summarized_through_id <= entry.summarized_through_id:
+                return
+            size = len(summary.encode("utf-8")) - len(entry.summary.encode("utf-8"))
+            entry.summary = summary
+            entry.summarized_through_id = summarized_through_id
+            entry.size_bytes += size
+            entry.last_access = now
+            self._total_bytes += size
+            self._sessions.move_to_end(session_id)
+            self._enforce_limits(session_id)
+
+    # Interfaz asíncrona común con SQLSessionStore (en memoria no hace falta un hilo)
+    async def aget_history(self, session_id: str) -> list[tuple[str, str]]:
+        return self.get_history(session_id)
+
+    async def aget_conversation(self, session_id: str) -> Conversation:
+        return self.get_conversation(session_id)
+
+    async def aset_summary(self, session_id: str, summary: str, summarized_through_id: int):
+        self.set_summary(session_id, summary, summarized_through_id)
+
+    async def aappend_turn(self, session_id: str, question: str, answer: str):
+        self.append_turn(session_id, question, answer)
+
+    async def aclear(self, session_id: str) -> bool:
+        return self.clear(session_id)
+
+    def clear(self, session_id: str) -> bool:
+        """Elimina el historial de una sesión. Devuelve True si existía."""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                return False
+            self._total_bytes -= entry.size_bytes
+            return True
+
+    def stats(self) -> dict:
+        """Devuelve el estado y los contadores del almacén."""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                **self._counters,
+            }
+
+    def _expire(self, now: float):
+        """Desaloja las sesiones inactivas; el orden LRU coincide con el de último acceso."""
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if now - entry.last_access < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._total_bytes -= entry.size_bytes
+            self._counters["ttl_evictions"] += 1
+
+    def _enforce_limits(self, current_session_id: str):
+        """Desaloja sesiones LRU y, como último recurso, recorta la sesión actual."""
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes
+        ):
+            session_id, entry = self._sessions.popitem(last=False)
+            self._total_bytes -= entry.size_bytes
+            self._counters["lru_evictions"] += 1
+
+        # Si la sesión actual por sí sola supera el límite, descartar sus turnos más antiguos
+        entry = self._sessions[current_session_id]
+        while self._total_bytes > self.max_bytes and len(entry.turns) > 1:
+            question, answer = entry.turns.pop(0)
+            entry.turn_ids.pop(0)
+            size = _turn_size(question, answer)
+            entry.size_bytes -= size
+            self._total_bytes -= size
+            self._counters["trimmed_turns"] += 1
+
+
+# Instancia global del almacén
+_memory_store = None
+
+def get_memory_store() -> SessionMemoryStore:
+    """Obtiene el almacén de memoria conversacional (singleton)."""
+    global _memory_store
+    if _memory_store is None:
+        settings = get_settings()
+        _memory_store = SessionMemoryStore(
+            max_sessions=settings.session_memory_max_sessions,
+            max_bytes=settings.session_memory_max_bytes,
+            ttl_seconds=settings.session_memory_ttl_seconds,
+        )
+    return _memory_store
@@ -0,0 +1,108 @@
+"""Métricas de Prometheus del servicio de chat"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# prometheus_client es opcional: sin él las métricas no hacen nada y /metrics responde 503
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _NoopMetric:
+    """Sustituto de una métrica cuando prometheus_client no está instalado."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def _metric(kind: str, name: str, documentation: str, labels: tuple = (), **kwargs):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    metric_class = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}[kind]
+    if kind == "gauge" and os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        kwargs.setdefault("multiprocess_mode", "livesum")
+    return metric_class(name, documentation, labels, **kwargs)
+
+
+# Buckets de latencia: desde consultas locales (ms) hasta generaciones largas del LLM
+LATENCY_BUCKETS: tuple = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+STAGE_DURATION = _metric(
+    "histogram", "chatbot_stage_duration_seconds",
+    "Duración de cada etapa del pipeline (condense, retrieve, generate, db_write, ...)",
+    ("stage",), buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = _metric("counter", "chatbot_stage_errors_total", "Errores por etapa del pipeline", ("stage",))
+REQUEST_DURATION = _metric(
+    "histogram", "chatbot_request_duration_seconds",
+    "Duración de las solicitudes HTTP (hasta el inicio de la respuesta en streaming)",
+    ("method", "endpoint"), buckets=LATENCY_BUCKETS
+)
+REQUESTS = _metric("counter", "chatbot_requests_total", "Solicitudes HTTP por código de estado",
+                   ("method", "endpoint", "status"))
+IN_FLIGHT = _metric("gauge", "chatbot_requests_in_flight", "Solicitudes HTTP en curso", ("method",))
+TOKENS = _metric("counter", "chatbot_tokens_total", "Tokens consumidos", ("kind",))
+COST = _metric("counter", "chatbot_cost_usd_total", "Costo acumulado en USD")
+SAVED_COST = _metric("counter", "chatbot_saved_cost_usd_total", "Costo ahorrado por la caché de respuestas en USD")
+HISTORY_TOKENS_SAVED = _metric("counter", "chatbot_history_tokens_saved_total", "Tokens de historial que no se enviaron al LLM")
+INTERACTIONS = _metric("counter", "chatbot_interactions_total", "Interacciones registradas", ("cache_hit",))
+RATE_LIMITED = _metric("counter", "chatbot_rate_limited_total", "Solicitudes rechazadas con 429 por cuota", ("reason",))
+RETRIES = _metric("counter", "chatbot_retries_total", "Reintentos ante errores transitorios", ("operation",))
+LLM_IN_FLIGHT = _metric("gauge", "chatbot_llm_in_flight", "Ejecuciones de la cadena RAG en curso")
+LLM_WAITING = _metric("gauge", "chatbot_llm_waiting", "Solicitudes esperando un cupo del LLM")
+LOG_QUEUE = _metric("gauge", "chatbot_log_writer_queue", "Logs pendientes de escribir en la base de datos")
+DB_POOL_IN_USE = _metric("gauge", "chatbot_db_pool_in_use", "Conexiones del pool en uso")
+
+
+@contextmanager
+def stage_timer(stage: str, timings: Optional[dict] = None):
+    """
+    Mide la duración de una etapa: la registra en el histograma y, si se indica,
+    la guarda en milisegundos en `timings[stage]`. Los errores se cuentan por etapa
+    (las cancelaciones, como la desconexión de un cliente, no se cuentan como errores).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage=stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.labels(stage=stage).observe(elapsed)
+        if timings is not None:
+            timings[stage] = round(elapsed * 1000, 2)
+
+
+def observe_interaction(logs: dict):
+    """Suma los tokens y el costo de una interacción registrada."""
+    TOKENS.labels(kind="prompt").inc(logs["prompt_tokens"])
+    TOKENS.labels(kind="completion").inc(logs["completion_tokens"])
+    COST.inc(logs["total_cost_usd"])
+    SAVED_COST.inc(logs.get("saved_cost_usd", 0.0))
+    HISTORY_TOKENS_SAVED.inc(logs.get("history_tokens_saved", 0))
+    INTERACTIONS.labels(cache_hit=str(bool(logs.get("cache_hit"))).lower()).inc()
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Exposición de las métricas en formato de texto de Prometheus."""
+    if not PROMETHEUS_AVAILABLE:
+        raise RuntimeError("prometheus_client no está instalado.")
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Con varios workers de uvicorn se agregan las métricas de todos los procesos
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic import BaseModel
 
 
@@ -8,4 +9,14 @@ class ChatRequest(BaseModel):
 
 # Pydantic modelo validacion para las respuestas de chat
 class ChatResponse(BaseModel):
-    llm_answer: str
\ No newline at end of file
+    llm_answer: str
+
+# Pydantic modelo validacion para cada pregunta de un lote (sin historial)
+class BatchQuestion(BaseModel):
+    id: Optional[str] = None
+    user_question: str
+
+# Pydantic modelo validacion para las solicitudes de respuestas en lote
+class BatchRequest(BaseModel):
+    questions: list[BatchQuestion]
+    max_concurrency: Optional[int] = None
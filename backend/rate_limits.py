@@ -0,0 +1,353 @@
+"""Cuotas de Azure OpenAI (RPM/TPM) del lado del cliente: admisión de solicitudes, turnos y reintentos"""
+
+import math
+import time
+import random
+import asyncio
+import threading
+from contextlib import aclosing, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Optional
+from langchain_core.embeddings import Embeddings
+from settings import get_settings
+from retries import (
+    _status_code, is_retryable, retry_after_seconds, backoff_delay, call_with_retries, acall_with_retries
+)
+import metrics
+
+
+# Azure estima el costo de una llamada antes de ejecutarla con ~4 caracteres por token
+CHARS_PER_TOKEN: int = 4
+
+
+def estimate_tokens(text: str, completion_tokens: int = 0) -> int:
+    """Tokens que se descuentan de la cuota antes de la llamada: prompt estimado más la respuesta esperada."""
+    return len(text) // CHARS_PER_TOKEN + 1 + completion_tokens
+
+
+class RateLimitExceeded(Exception):
+    """No hay cuota disponible a tiempo; `retry_after` es la espera sugerida en segundos."""
+
+    status_code = 429  # Transitorio para `retries.is_retryable`
+
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(f"Se alcanzó el límite de {reason}; reintenta en {math.ceil(retry_after)} segundos.")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Cubeta que se recarga a `per_minute` unidades por minuto y acumula a lo más `burst_seconds`
+    de cuota. El saldo puede quedar negativo: cada reserva se descuenta al hacerla y el
+    déficit indica cuánto deben esperar las siguientes. `per_minute` 0 = sin límite.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60
+        self.capacity = self.rate * burst_seconds
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        """Segundos hasta que la cubeta cubra `amount`, contando las reservas anteriores."""
+        if self.unlimited or amount <= 0:
+            return 0.0
+        self._refill(now)
+        return max(0.0, amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.level -= amount
+
+    def give_back(self, amount: float):
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass
+class Admission:
+    """Reserva de cuota de una solicitud de chat, de la que descuentan sus llamadas al modelo."""
+    session_id: str
+    tokens: int
+    ready_at: float
+    tokens_left: int = 0
+    requests_left: int = 1
+    used_tokens: int = 0
+    closed: bool = False
+
+
+class QuotaScheduler:
+    """
+    Reparte la cuota de un deployment de Azure OpenAI (solicitudes y tokens por minuto) entre
+    todas las llamadas del proceso, para trabajar en el techo de la cuota en vez de acumular 429.
+
+    - Admisión: cada solicitud de chat reserva al llegar los tokens estimados para ella (promedio
+      móvil de las anteriores). Si el trabajo ya reservado no alcanza a despacharse en
+      `max_wait_seconds`, o la sesión ya tiene `session_max_pending` solicitudes en curso, se
+      rechaza de inmediato con `RateLimitExceeded` y la espera sugerida. Las reservas se
+      atienden en orden de llegada, y el tope por sesión impide que una sola sesión acapare la cola.
+    - Llamadas: cada llamada estima su costo antes de ejecutarse, lo descuenta de la reserva de
+      su solicitud (o de la cuota, si no tiene) y espera su turno.
+    - Reintentos: un 429 de Azure pausa a todas las llamadas durante `Retry-After`; los demás
+      errores transitorios se reintentan con backoff exponencial con jitter.
+    """
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int, max_wait_seconds: float,
+                 max_retries: int, session_max_pending: int, request_tokens: int, burst_seconds: float = 10.0):
+        self.name = name
+        self.max_wait_seconds = max_wait_seconds
+        self.max_retries = max_retries
+        self.session_max_pending = session_max_pending
+        self.request_tokens = float(request_tokens)
+        self._requests = TokenBucket(requests_per_minute, burst_seconds)
+        self._tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self._blocked_until = 0.0
+        self._pending: dict[str, int] = {}
+        self._admission: ContextVar = ContextVar(f"{name}_admission", default=None)
+        self._lock = threading.Lock()
+        self._counters = {
+            "admitted": 0,
+            "rejected_quota": 0,
+            "rejected_session": 0,
+            "calls": 0,
+            "throttled": 0,
+            "retries": 0,
+            "waited_seconds": 0.0,
+        }
+
+    def _wait(self, requests: int, tokens: int, now: float) -> float:
+        return max(self._blocked_until - now, self._requests.wait_for(requests, now),
+                   self._tokens.wait_for(tokens, now), 0.0)
+
+    def admit(self, session_id: str) -> Admission:
+        """Reserva cuota para una solicitud de la sesión o lanza `RateLimitExceeded` sin esperar."""
+        with self._lock:
+            now = time.monotonic()
+            if self._pending.get(session_id, 0) >= self.session_max_pending:
+                self._counters["rejected_session"] += 1
+                metrics.RATE_LIMITED.labels(reason="session").inc()
+                raise RateLimitExceeded(1.0, "solicitudes simultáneas por sesión")
+            tokens = round(self.request_tokens)
+            wait = self._wait(1, tokens, now)
+            if wait > self.max_wait_seconds:
+                self._counters["rejected_quota"] += 1
+                metrics.RATE_LIMITED.labels(reason="quota").inc()
+                raise RateLimitExceeded(wait, f"la cuota de Azure OpenAI ({self.name})")
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+            self._counters["admitted"] += 1
+            return Admission(session_id, tokens, now + wait, tokens_left=tokens)
+
+    def release(self, admission: Admission):
+        """Devuelve a la cuota lo que la solicitud no usó y actualiza la estimación por solicitud."""
+        with self._lock:
+            if admission.closed:
+                return
+            admission.closed = True
+            self._tokens.give_back(admission.tokens_left)
+            self._requests.give_back(admission.requests_left)
+            self.request_tokens = 0.9 * self.request_tokens + 0.1 * admission.used_tokens
+            pending = self._pending.get(admission.session_id, 1) - 1
+            if pending > 0:
+                self._pending[admission.session_id] = pending
+            else:
+                self._pending.pop(admission.session_id, None)
+
+    @contextmanager
+    def bind(self, admission: Admission):
+        """Las llamadas del bloque descuentan de `admission`, que se libera al salir."""
+        token = self._admission.set(admission)
+        try:
+            yield admission
+        finally:
+            self._admission.reset(token)
+            self.release(admission)
+
+    @contextmanager
+    def admission(self, session_id: str):
+        """Admite la solicitud de la sesión durante el bloque (ver `admit`)."""
+        with self.bind(self.admit(session_id)) as admission:
+            yield admission
+
+    def _reserve(self, tokens: int) -> float:
+        """Descuenta el costo estimado de una llamada y devuelve los segundos que debe esperar."""
+        admission: Optional[Admission] = self._admission.get()
+        with self._lock:
+            now = time.monotonic()
+            self._counters["calls"] += 1
+            if admission is not None and not admission.closed:
+                from_reservation = min(tokens, admission.tokens_left)
+                extra_tokens, extra_requests = tokens - from_reservation, 1 - admission.requests_left
+                admission.tokens_left -= from_reservation
+                admission.requests_left = 0
+                admission.used_tokens += tokens
+                wait = max(admission.ready_at - now, self._wait(extra_requests, extra_tokens, now))
+            else:
+                extra_tokens, extra_requests = tokens, 1
+                wait = self._wait(extra_requests, extra_tokens, now)
+            self._requests.take(extra_requests)
+            self._tokens.take(extra_tokens)
+            if self._blocked_until > now:
+                # Jitter: las llamadas pausadas por un 429 no se reanudan todas a la vez
+                wait += random.uniform(0, 0.1 * (self._blocked_until - now))
+            self._counters["waited_seconds"] += wait
+            return wait
+
+    async def acquire(self, tokens: int):
+        """Espera el turno de una llamada con el costo estimado indicado."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self, tokens: int):
+        """Versión bloqueante de `acquire` para los hilos de la ingesta."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _on_retry(self, exc: Exception, delay: float):
+        with self._lock:
+            self._counters["retries"] += 1
+            if _status_code(exc) == 429:
+                self._counters["throttled"] += 1
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+    def _rate_limit_error(self, exc: Exception) -> Optional[RateLimitExceeded]:
+        """Convierte el 429 que agotó los reintentos en `RateLimitExceeded` (con la espera sugerida)."""
+        if isinstance(exc, RateLimitExceeded) or _status_code(exc) != 429:
+            return None
+        return RateLimitExceeded(retry_after_seconds(exc) or self.max_wait_seconds, f"la cuota de Azure OpenAI ({self.name})")
+
+    async def call(self, fn: Callable[[], Any], tokens: int) -> Any:
+        """Ejecuta la corrutina que devuelve `fn` en su turno, con reintentos ante errores transitorios."""
+        async def attempt():
+            await self.acquire(tokens)
+            return await fn()
+        attempt.__name__ = self.name
+        try:
+            return await acall_with_retries(attempt, max_retries=self.max_retries, on_retry=self._on_retry)
+        except Exception as e:
+            error = self._rate_limit_error(e)
+            if error is not None:
+                raise error from e
+            raise
+
+    def call_blocking(self, fn: Callable[[], Any], tokens: int) -> Any:
+        """Versión bloqueante de `call`."""
+        def attempt():
+            self.acquire_blocking(tokens)
+            return fn()
+        attempt.__name__ = self.name
+        try:
+            return call_with_retries(attempt, max_retries=self.max_retries, on_retry=self._on_retry)
+        except Exception as e:
+            error = self._rate_limit_error(e)
+            if error is not None:
+                raise error from e
+            raise
+
+    async def stream(self, produce: Callable[[], AsyncIterator], tokens: int) -> AsyncIterator:
+        """
+        Stream en su turno. Solo se reintenta si el error llega antes del primer fragmento:
+        después, el cliente ya recibió parte de la respuesta.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(tokens)
+            streamed = False
+            try:
+                async with aclosing(produce()) as chunks:
+                    async for chunk in chunks:
+                        streamed = True
+                        yield chunk
+                return
+            except Exception as e:
+                if streamed or attempt >= self.max_retries or not is_retryable(e):
+                    error = self._rate_limit_error(e)
+                    if error is not None:
+                        raise error from e
+                    raise
+                delay = retry_after_seconds(e) or backoff_delay(attempt, 1.0, 60.0)
+                metrics.RETRIES.labels(operation=self.name).inc()
+                self._on_retry(e, delay)
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        """Devuelve los contadores, la estimación por solicitud y el saldo de la cuota."""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                **self._counters,
+                "waited_seconds": round(self._counters["waited_seconds"], 3),
+                "pending_sessions": len(self._pending),
+                "estimated_request_tokens": round(self.request_tokens),
+                "requests_per_minute": self._requests.per_minute,
+                "tokens_per_minute": self._tokens.per_minute,
+                "queued_seconds": round(self._wait(1, 1, now), 3),
+            }
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings cuyas llamadas pasan por el planificador de cuota del deployment de embeddings."""
+
+    def __init__(self, embeddings: Embeddings, scheduler: QuotaScheduler):
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return self.scheduler.call_blocking(lambda: self.embeddings.embed_documents(texts), tokens)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.scheduler.call_blocking(lambda: self.embeddings.embed_query(text), estimate_tokens(text))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.scheduler.call(lambda: self.embeddings.aembed_query(text), estimate_tokens(text))
+
+
+# Instancias globales de los planificadores (una por deployment)
+_llm_scheduler = None
+_embeddings_scheduler = None
+
+def get_llm_scheduler() -> QuotaScheduler:
+    """Obtiene el planificador de cuota del deployment de chat (singleton)."""
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        settings = get_settings()
+        _llm_scheduler = QuotaScheduler(
+            name="llm",
+            requests_per_minute=settings.azure_openai_rpm,
+            tokens_per_minute=settings.azure_openai_tpm,
+            max_wait_seconds=settings.rate_limit_max_wait_seconds,
+            max_retries=settings.rate_limit_max_retries,
+            session_max_pending=settings.rate_limit_session_max_pending,
+            request_tokens=settings.rate_limit_request_tokens,
+        )
+    return _llm_scheduler
+
+def get_embeddings_scheduler() -> QuotaScheduler:
+    """Obtiene el planificador de cuota del deployment de embeddings (singleton)."""
+    global _embeddings_scheduler
+    if _embeddings_scheduler is None:
+        settings = get_settings()
+        _embeddings_scheduler = QuotaScheduler(
+            name="embeddings",
+            requests_per_minute=settings.azure_embeddings_rpm,
+            tokens_per_minute=settings.azure_embeddings_tpm,
+            max_wait_seconds=settings.rate_limit_max_wait_seconds,
+            max_retries=settings.rate_limit_max_retries,
+            session_max_pending=settings.rate_limit_session_max_pending,
+            request_tokens=0,
+        )
+    return _embeddings_scheduler
@@ -0,0 +1,193 @@
+"""Registro de componentes del servicio: se crean al primer uso o en paralelo al iniciar la API"""
+
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+from settings import get_settings
+
+
+@dataclass
+class _Component:
+    factory: Callable[[], Any]
+    required: bool
+    lock: threading.Lock
+    instance: Any = None
+    ready: bool = False
+    init_ms: Optional[float] = None
+    error: Optional[str] = None
+
+
+class ComponentRegistry:
+    """
+    Crea cada componente (clientes, cadena RAG, base de datos) una sola vez y recién cuando
+    se necesita, de modo que importar los módulos no abre conexiones ni falla por credenciales.
+    Una fábrica puede pedir otros componentes con `get`; el lock por componente evita
+    construirlos dos veces cuando se inicializan en paralelo.
+    """
+
+    def __init__(self):
+        self._components: dict[str, _Component] = {}
+
+    def register(self, name: str, factory: Callable[[], Any], required: bool = False):
+        """Registra la fábrica de un componente. Si es `required`, su fallo detiene el inicio."""
+        self._components[name] = _Component(factory=factory, required=required, lock=threading.Lock())
+
+    def get(self, name: str) -> Any:
+        """Obtiene el componente, creándolo en el primer uso (si falló, se reintenta)."""
+        component = self._components[name]
+        if component.ready:
+            return component.instance
+        with component.lock:
+            if not component.ready:
+                started = time.perf_counter()
+                try:
+                    component.instance = component.factory()
+                except Exception as e:
+                    component.error = str(e)
+                    raise
+                finally:
+                    component.init_ms = round((time.perf_counter() - started) * 1000, 2)
+                component.error = None
+                component.ready = True
+        return component.instance
+
+    async def aget(self, name: str) -> Any:
+        """Versión asíncrona de `get`: si el componente aún no existe, lo crea en un hilo."""
+        component = self._components[name]
+        if component.ready:
+            return component.instance
+        return await asyncio.to_thread(self.get, name)
+
+    def override(self, name: str, instance: Any):
+        """Reemplaza un componente por una instancia ya creada (benchmark y pruebas)."""
+        component = self._components[name]
+        with component.lock:
+            component.instance = instance
+            component.ready = True
+            component.error = None
+
+    async def initialize(self, names: Optional[list] = None) -> dict:
+        """
+        Crea los componentes en paralelo (en hilos) e informa el tiempo de cada uno.
+        Los fallos de componentes opcionales se registran y se reintentan al primer uso;
+        si falla uno obligatorio se lanza RuntimeError.
+        """
+        names = list(names or self._components)
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self.get, name) for name in names), return_exceptions=True
+        )
+        total_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        failed_required = []
+        for name, result in zip(names, results):
+            component = self._components[name]
+            if isinstance(result, BaseException):
+                print(f"⚠️ {name}: no se pudo inicializar ({component.init_ms} ms): {result}")
+                if component.required:
+                    failed_required.append(name)
+            elif component.init_ms is None:
+                print(f"✅ {name}: instancia provista")
+            else:
+                print(f"✅ {name}: inicializado en {component.init_ms} ms")
+        print(f"⏱️ Componentes inicializados en {total_ms} ms")
+
+        if failed_required:
+            raise RuntimeError(f"No se pudieron inicializar los componentes obligatorios: {', '.join(failed_required)}")
+        return self.stats()
+
+    def stats(self) -> dict:
+        """Estado y tiempo de inicialización de cada componente."""
+        return {
+            name: {
+                "status": "ready" if component.ready else ("failed" if component.error else "pending"),
+                "init_ms": component.init_ms,
+                "error": component.error,
+            }
+            for name, component in self._components.items()
+        }
+
+
+# Fábricas de los componentes del servicio (importaciones diferidas: importar este módulo es barato)
+
+def _build_database():
+    from database import init_db_pool, init_db
+    pool = init_db_pool()
+    init_db()
+    return pool
+
+
+def _build_session_store():
+    if get_settings().session_store_backend == "database":
+        get_component("database")
+    from session_store import get_session_store
+    return get_session_store()
+
+
+def _build_embeddings():
+    from azure_ai_search import get_embeddings
+    return get_embeddings()
+
+
+def _build_vector_index():
+    from vector_index import get_local_vector_index
+    return get_local_vector_index()
+
+
+def _build_answer_cache():
+    if not get_settings().answer_cache_enabled:
+        return None
+    get_component("embeddings")
+    from answer_cache import get_answer_cache
+    return get_answer_cache()
+
+
+def _build_rag_chain():
+    if get_settings().retriever_backend == "local":
+        get_component("embeddings")
+        get_component("vector_index")
+    from chatbot_app import initialize_rag_chat_chain
+    return initialize_rag_chat_chain()
+
+
+def _build_tokenizer():
+    # El tokenizador de tiktoken se descarga y compila la primera vez que se usa
+    from context_packing import count_tokens
+    model_name = get_component("rag_chain").combine_docs_chain.llm_chain.llm.model_name
+    count_tokens("", model_name)
+    return model_name
+
+
+def _build_warmup():
+    # Solicitud de calentamiento: abre las conexiones a búsqueda, embeddings y LLM
+    from chatbot_app import warm_up_rag_chain
+    embeddings = get_component("embeddings") if get_settings().answer_cache_enabled else None
+    return warm_up_rag_chain(get_component("rag_chain"), embeddings)
+
+
+# Instancia global del registro
+_component_registry = None
+
+def get_component_registry() -> ComponentRegistry:
+    """Obtiene el registro de componentes con las fábricas del servicio (singleton)."""
+    global _component_registry
+    if _component_registry is None:
+        registry = ComponentRegistry()
+        registry.register("database", _build_database, required=True)
+        registry.register("session_store", _build_session_store, required=True)
+        registry.register("embeddings", _build_embeddings)
+        if get_settings().retriever_backend == "local":
+            registry.register("vector_index", _build_vector_index)
+        registry.register("answer_cache", _build_answer_cache)
+        registry.register("rag_chain", _build_rag_chain, required=True)
+        registry.register("tokenizer", _build_tokenizer)
+        if get_settings().startup_warmup:
+            registry.register("warmup", _build_warmup)
+        _component_registry = registry
+    return _component_registry
+
+def get_component(name: str) -> Any:
+    """Atajo para obtener un componente del registro global."""
+    return get_component_registry().get(name)
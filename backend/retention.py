@@ -0,0 +1,162 @@
+"""Trabajo periódico de retención de logs"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+from settings import get_settings
+from database import (
+    delete_logs_older_than_batch, delete_rollup_sessions_older_than_batch,
+    delete_session_turns_older_than_batch, delete_session_summaries_older_than_batch, acquire_job_lease, release_job_lease
+)
+
+
+class RetentionScheduler:
+    """
+    Elimina periódicamente los logs más antiguos que `max_age_hours`.
+
+    Solo hay una ejecución activa a la vez: dentro del proceso la protege un `asyncio.Lock`
+    y entre workers un lease en la tabla `job_leases`. El worker que obtiene el lease lo
+    conserva durante `lease_seconds` (por defecto, un intervalo), así que los demás omiten
+    su turno mientras el dueño siga vivo. Los logs se borran en lotes de `batch_size`
+    filas, cada uno en su propia transacción, con una pausa corta entre lotes. Con el mismo
+    corte se depuran las sesiones de los agregados de uso (los totales se conservan) y los
+    turnos y resúmenes del historial compartido de sesiones.
+    """
+
+    LEASE_NAME = "logs_retention"
+
+    def __init__(self, interval_seconds: float, max_age_hours: float, batch_size: int,
+                 lease_seconds: float, pause_seconds: float = 0.05):
+        self.interval_seconds = interval_seconds
+        self.max_age_hours = max_age_hours
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.pause_seconds = pause_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_run: Optional[dict] = None
+        self._counters = {"runs": 0, "skipped": 0, "failed": 0, "rows_deleted": 0}
+
+    def start(self):
+        """Inicia el ciclo periódico en el event loop actual."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(), name="logs-retention")
+
+    async def stop(self):
+        """Cancela el ciclo periódico y libera el lease si lo tiene."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.to_thread(release_job_lease, self.LEASE_NAME, self.owner)
+        except Exception as e:
+            print(f"⚠️ No se pudo liberar el lease de retención: {str(e)}")
+
+    async def run_once(self, max_age_hours: Optional[float] = None) -> dict:
+        """
+        Ejecuta una pasada de retención si no hay otra en curso.
+
+        Returns:
+            dict: Resultado de la pasada (`status`, filas eliminadas, lotes y duración).
+        """
+        if self._lock.locked():
+            self._counters["skipped"] += 1
+            return {"status": "skipped", "reason": "ya hay una ejecución en curso en este proceso"}
+
+        async with self._lock:
+            age_hours = self.max_age_hours if max_age_hours is None else max_age_hours
+            cutoff_time = (datetime.utcnow() - timedelta(hours=age_hours)).isoformat()
+            started = time.perf_counter()
+            rows_deleted, batches = 0, 0
+            try:
+                acquired = await asyncio.to_thread(
+                    acquire_job_lease, self.LEASE_NAME, self.owner, self.lease_seconds
+                )
+                if not acquired:
+                    self._counters["skipped"] += 1
+                    return {"status": "skipped", "reason": "otro worker tiene el lease"}
+
+                for delete_batch in (delete_logs_older_than_batch, delete_rollup_sessions_older_than_batch,
+                                     delete_session_turns_older_than_batch,
+                                     delete_session_summaries_older_than_batch):
+                    while True:
+                        deleted = await asyncio.to_thread(delete_batch, cutoff_time, self.batch_size)
+                        rows_deleted += deleted
+                        batches += 1
+                        if deleted < self.batch_size:
+                            break
+                        # Renovar el lease y ceder la base de datos a las inserciones
+                        await asyncio.to_thread(acquire_job_lease, self.LEASE_NAME, self.owner, self.lease_seconds)
+                        await asyncio.sleep(self.pause_seconds)
+            except Exception as e:
+                self._counters["failed"] += 1
+                self._counters["rows_deleted"] += rows_deleted
+                self._last_run = {
+                    "status": "failed",
+                    "error": str(e),
+                    "rows_deleted": rows_deleted,
+                    "batches": batches,
+                    "duration_seconds": round(time.perf_counter() - started, 3),
+                    "finished_at": datetime.utcnow().isoformat(),
+                }
+                print(f"❌ Error en la retención de logs: {str(e)}")
+                return self._last_run
+
+            self._counters["runs"] += 1
+            self._counters["rows_deleted"] += rows_deleted
+            self._last_run = {
+                "status": "completed",
+                "cutoff_time": cutoff_time,
+                "rows_deleted": rows_deleted,
+                "batches": batches,
+                "duration_seconds": round(time.perf_counter() - started, 3),
+                "finished_at": datetime.utcnow().isoformat(),
+            }
+            print(f"🧹 Retención de logs: {rows_deleted} registros eliminados en "
+                  f"{self._last_run['duration_seconds']} s ({batches} lotes).")
+            return self._last_run
+
+    def stats(self) -> dict:
+        """Contadores acumulados y resultado de la última ejecución."""
+        return {
+            "interval_seconds": self.interval_seconds,
+            "max_age_hours": self.max_age_hours,
+            "running": self._lock.locked(),
+            **self._counters,
+            "last_run": self._last_run,
+        }
+
+    async def _loop(self):
+        while True:
+            # Un error transitorio no debe detener la retención: se reintenta en el próximo intervalo
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"❌ Error inesperado en la retención de logs: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+
+# Instancia global del programador
+_retention_scheduler = None
+
+def get_retention_scheduler() -> RetentionScheduler:
+    """Obtiene el programador de retención de logs (singleton)."""
+    global _retention_scheduler
+    if _retention_scheduler is None:
+        settings = get_settings()
+        _retention_scheduler = RetentionScheduler(
+            interval_seconds=settings.retention_interval_seconds,
+            max_age_hours=settings.retention_max_age_hours,
+            batch_size=settings.retention_batch_size,
+            lease_seconds=settings.retention_lease_seconds or settings.retention_interval_seconds,
+        )
+    return _retention_scheduler
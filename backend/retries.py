@@ -0,0 +1,86 @@
+"""Reintentos con backoff exponencial para llamadas a servicios de Azure"""
+
+import time
+import asyncio
+import random
+from typing import Callable, Optional
+from metrics import RETRIES
+
+
+# Códigos HTTP que indican un error transitorio
+RETRYABLE_STATUS_CODES: set = {408, 429, 500, 502, 503, 504}
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    """Obtiene el código HTTP de una excepción de openai o de azure-core, si lo tiene."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Indica si vale la pena reintentar la operación que lanzó la excepción."""
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    return _status_code(exc) in RETRYABLE_STATUS_CODES
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Lee la cabecera Retry-After (en segundos) de la respuesta asociada a la excepción."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    for header in ("retry-after-ms", "Retry-After-Ms"):
+        if header in headers:
+            try:
+                return float(headers[header]) / 1000
+            except (TypeError, ValueError):
+                pass
+    for header in ("retry-after", "Retry-After"):
+        if header in headers:
+            try:
+                return float(headers[header])
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Espera exponencial con jitter para el intento indicado (empezando en 0)."""
+    return min(max_delay, base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+def call_with_retries(fn: Callable, *args, max_retries: int = 5, base_delay: float = 1.0,
+                      max_delay: float = 60.0, on_retry: Optional[Callable[[Exception, float], None]] = None,
+                      **kwargs):
+    """
+    Ejecuta `fn` reintentando los errores transitorios (429, 5xx, conexión).
+    Respeta Retry-After cuando el servicio lo envía; si no, usa backoff exponencial con jitter.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = retry_after_seconds(e) or backoff_delay(attempt, base_delay, max_delay)
+            RETRIES.labels(operation=getattr(fn, "__name__", "unknown")).inc()
+            if on_retry is not None:
+                on_retry(e, delay)
+            time.sleep(delay)
+
+
+async def acall_with_retries(fn: Callable, *args, max_retries: int = 5, base_delay: float = 1.0,
+                             max_delay: float = 60.0, on_retry: Optional[Callable[[Exception, float], None]] = None,
+                             **kwargs):
+    """Versión asíncrona de `call_with_retries` para corrutinas: espera sin bloquear el event loop."""
+    for attempt in range(max_retries + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = retry_after_seconds(e) or backoff_delay(attempt, base_delay, max_delay)
+            RETRIES.labels(operation=getattr(fn, "__name__", "unknown")).inc()
+            if on_retry is not None:
+                on_retry(e, delay)
+            await asyncio.sleep(delay)
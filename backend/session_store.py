@@ -0,0 +1,228 @@
+"""Historial de sesiones compartido entre workers (Turso o SQLite local) con caché de lectura"""
+
+import json
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable
+from settings import get_settings
+from memory_store import Conversation, get_memory_store
+
+
+def encode_turn(question: str, answer: str) -> str:
+    """Formato compacto de un turno: arreglo JSON [pregunta, respuesta] sin espacios."""
+    return json.dumps([question, answer], ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_turn(turn: str) -> tuple[str, str]:
+    question, answer = json.loads(turn)
+    return question, answer
+
+
+class SQLSessionStore:
+    """
+    Historial de chat por sesión en una tabla `session_turns` compartida por todos los workers,
+    de modo que cualquier réplica puede atender cualquier sesión sin enrutamiento fijo.
+
+    Cada turno se agrega como una fila nueva (nunca se actualiza). Cada worker guarda en una
+    caché LRU los turnos ya leídos; en cada lectura pide, en una sola consulta, el resumen de
+    la sesión y solo los turnos desde el último que conoce. Si ese turno ya no existe (la sesión
+    se borró o la retención lo eliminó), la caché se descarta y se relee el historial completo.
+    """
+
+    # Resumen (si existe) y turnos desde un id, en una sola ida y vuelta a la base de datos
+    _READ_QUERY = """
+        SELECT 'summary' AS kind, summarized_through_id AS id, summary AS content
+        FROM session_summaries WHERE session_id = ?
+        UNION ALL
+        SELECT 'turn', id, turn FROM session_turns WHERE session_id = ? AND id >= ?
+        ORDER BY kind, id;
+    """
+
+    def __init__(self, connect: Callable, cache_max_sessions: int, backend: str):
+        self._connect = connect
+        self.cache_max_sessions = cache_max_sessions
+        self.backend = backend
+        self._cache: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "reads": 0,
+            "misses": 0,
+            "cache_hits": 0,
+            "delta_reads": 0,
+            "full_reads": 0,
+            "appends": 0,
+        }
+
+    def get_history(self, session_id: str) -> list[tuple[str, str]]:
+        """Devuelve el historial (pregunta, respuesta) de la sesión, leyendo solo los turnos nuevos."""
+        return self.get_conversation(session_id).turns
+
+    def get_conversation(self, session_id: str) -> Conversation:
+        """Devuelve el historial de la sesión y su resumen, leyendo solo los turnos nuevos."""
+        with self._lock:
+            cached = self._cache.get(session_id)
+            self._counters["reads"] += 1
+
+        if cached is not None:
+            summary_row, turn_rows = self._read(session_id, cached.turn_ids[-1])
+            if turn_rows and turn_rows[0][0] == cached.turn_ids[-1]:
+                new_rows = turn_rows[1:]
+                conversation = Conversation(
+                    cached.turns + [decode_turn(turn) for _, turn in new_rows],
+                    cached.turn_ids + [turn_id for turn_id, _ in new_rows],
+                    *summary_row
+                )
+                self._remember(session_id, conversation, "delta_reads" if new_rows else "cache_hits")
+                return self._copy(conversation)
+
+        summary_row, turn_rows = self._read(session_id, 0)
+        if not turn_rows:
+            self._forget(session_id)
+            with self._lock:
+                self._counters["misses"] += 1
+            return Conversation()
+        conversation = Conversation(
+            [decode_turn(turn) for _, turn in turn_rows], [turn_id for turn_id, _ in turn_rows], *summary_row
+        )
+        self._remember(session_id, conversation, "full_reads")
+        return self._copy(conversation)
+
+    def set_summary(self, session_id: str, summary: str, summarized_through_id: int):
+        """Guarda el resumen de la sesión si cubre más turnos que el guardado (otro worker pudo adelantarse)."""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO session_summaries (session_id, summary, summarized_through_id, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    summarized_through_id = excluded.summarized_through_id,
+                    updated_at = excluded.updated_at
+                WHERE excluded.summarized_through_id > session_summaries.summarized_through_id;
+                """,
+                (session_id, summary, summarized_through_id, datetime.now(timezone.utc).isoformat())
+            )
+            conn.commit()
+
+    def append_turn(self, session_id: str, question: str, answer: str):
+        """
+        Agrega un turno al historial de la sesión. La caché no se modifica: la próxima
+        lectura trae este turno junto con los que otros workers hayan agregado.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO session_turns (session_id, turn, created_at) VALUES (?, ?, ?);",
+                (session_id, encode_turn(question, answer), datetime.now(timezone.utc).isoformat())
+            )
+            conn.commit()
+        with self._lock:
+            self._counters["appends"] += 1
+
+    def clear(self, session_id: str) -> bool:
+        """Elimina el historial de una sesión. Devuelve True si existía."""
+        with self._connect() as conn:
+            result = conn.execute("DELETE FROM session_turns WHERE session_id = ?;", (session_id,))
+            conn.execute("DELETE FROM session_summaries WHERE session_id = ?;", (session_id,))
+            conn.commit()
+        self._forget(session_id)
+        return result.rowcount > 0
+
+    async def aget_history(self, session_id: str) -> list[tuple[str, str]]:
+        return await asyncio.to_thread(self.get_history, session_id)
+
+    async def aget_conversation(self, session_id: str) -> Conversation:
+        return await asyncio.to_thread(self.get_conversation, session_id)
+
+    async def aset_summary(self, session_id: str, summary: str, summarized_through_id: int):
+        await asyncio.to_thread(self.set_summary, session_id, summary, summarized_through_id)
+
+    async def aappend_turn(self, session_id: str, question: str, answer: str):
+        await asyncio.to_thread(self.append_turn, session_id, question, answer)
+
+    async def aclear(self, session_id: str) -> bool:
+        return await asyncio.to_thread(self.clear, session_id)
+
+    def stats(self) -> dict:
+        """Devuelve el estado de la caché de lectura y los contadores del almacén."""
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "cached_sessions": len(self._cache),
+                "cache_max_sessions": self.cache_max_sessions,
+                **self._counters,
+            }
+
+    def _read(self, session_id: str, from_id: int) -> tuple[tuple, list]:
+        """Lee el resumen (texto, id cubierto) y los turnos (id, turno) desde `from_id`."""
+        with self._connect() as conn:
+            rows = conn.execute(self._READ_QUERY, (session_id, session_id, from_id)).fetchall()
+        summary_row = next(((content, row_id) for kind, row_id, content in rows if kind == "summary"), ("", 0))
+        return summary_row, [(row_id, content) for kind, row_id, content in rows if kind == "turn"]
+
+    @staticmethod
+    def _copy(conversation: Conversation) -> Conversation:
+        return Conversation(list(conversation.turns), list(conversation.turn_ids),
+                            conversation.summary, conversation.summarized_through_id)
+
+    def _remember(self, session_id: str, conversation: Conversation, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+            current = self._cache.get(session_id)
+            # Otro hilo pudo haber leído una versión más nueva mientras tanto
+            if current is None or current.turn_ids[-1] <= conversation.turn_ids[-1]:
+                self._cache[session_id] = conversation
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.cache_max_sessions:
+                self._cache.popitem(last=False)
+
+    def _forget(self, session_id: str):
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+
+def _sqlite_connector(path: str) -> Callable:
+    """Conexión a un archivo SQLite local (sustituto de Turso en desarrollo o con un solo servidor)."""
+    from database import SESSION_TURNS_SCHEMA, SESSION_SUMMARIES_SCHEMA
+
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    for statement in SESSION_TURNS_SCHEMA + SESSION_SUMMARIES_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    lock = threading.Lock()
+
+    @contextmanager
+    def connect():
+        with lock:
+            yield conn
+
+    return connect
+
+
+# Instancia global del almacén de historial
+_session_store = None
+
+def get_session_store():
+    """
+    Obtiene el almacén de historial configurado (singleton): `memory` (en el proceso),
+    `database` (tabla compartida en Turso) o `sqlite` (archivo SQLite local).
+    """
+    global _session_store
+    if _session_store is None:
+        settings = get_settings()
+        backend = settings.session_store_backend
+        if backend == "memory":
+            _session_store = get_memory_store()
+        elif backend == "database":
+            from database import get_db_connection
+            _session_store = SQLSessionStore(get_db_connection, settings.session_memory_max_sessions, backend)
+        elif backend == "sqlite":
+            _session_store = SQLSessionStore(_sqlite_connector(settings.session_store_sqlite_path),
+                                             settings.session_memory_max_sessions, backend)
+        else:
+            raise ValueError(f"SESSION_STORE_BACKEND desconocido: {backend}")
+    return _session_store
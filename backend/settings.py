@@ -5,14 +5,6 @@ from typing import List
 from pydantic_settings import BaseSettings
 
 
-# Intentar importar userdata para Google Colab
-try:
-    from google.colab import userdata
-    IS_COLAB = True
-except ImportError:
-    IS_COLAB = False
-
-
 class Settings(BaseSettings):
     """Application settings"""
 
@@ -29,52 +21,159 @@ class Settings(BaseSettings):
         "https://bda-chatbot-frontend-e4ddbvftcmcjbvd3.chilecentral-01.azurewebsites.net",
     ]
 
-    # Azure OpenAI Configuration
-    if IS_COLAB:
-        azure_openai_api_key: str = userdata.get('azure_api_key')
-        azure_openai_endpoint: str = userdata.get('azure_endpoint')
-        azure_openai_deployment_name: str = userdata.get('azure_llm_deployment')
-        azure_openai_api_version: str = userdata.get('azure_api_version')
-    else:
-        azure_openai_api_key: str = os.getenv("AZURE_OPENAI_API_KEY", "")
-        azure_openai_endpoint: str = os.getenv("AZURE_OPENAI_ENDPOINT", "")
-        azure_openai_deployment_name: str = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o")
-        azure_openai_api_version: str = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01")
+    # Azure OpenAI Configuration (en Google Colab se toman de userdata, ver _colab_overrides)
+    azure_openai_api_key: str = os.getenv("AZURE_OPENAI_API_KEY", "")
+    azure_openai_endpoint: str = os.getenv("AZURE_OPENAI_ENDPOINT", "")
+    azure_openai_deployment_name: str = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o")
+    azure_openai_api_version: str = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01")
 
     # Azure AI Search Configuration
-    if IS_COLAB:
-        azure_search_endpoint: str = f"https://{userdata.get('azure_cognitive_search_name')}.search.windows.net"
-        azure_search_api_key: str = userdata.get('azure_cognitive_search_api_key')
-        azure_search_index_name: str = userdata.get('azure_cognitive_search_index_name')
-        azure_search_name: str = userdata.get('azure_cognitive_search_name')
-
-    else:
-        azure_search_endpoint: str = os.getenv("AZURE_SEARCH_ENDPOINT", "")
-        azure_search_api_key: str = os.getenv("AZURE_SEARCH_API_KEY", "")
-        azure_search_index_name: str = os.getenv("AZURE_SEARCH_INDEX_NAME", "knowledge-base")
-        azure_search_name: str = os.getenv('AZURE_SEARCH_NAME')
+    azure_search_endpoint: str = os.getenv("AZURE_SEARCH_ENDPOINT", "")
+    azure_search_api_key: str = os.getenv("AZURE_SEARCH_API_KEY", "")
+    azure_search_index_name: str = os.getenv("AZURE_SEARCH_INDEX_NAME", "knowledge-base")
+    azure_search_name: str = os.getenv("AZURE_SEARCH_NAME", "")
 
     # Azure Blob Storage Configuration
-    if IS_COLAB:
-        azure_storage_connection_string: str = f"DefaultEndpointsProtocol=https;AccountName={userdata.get('azure_storage_account_name')};AccountKey={userdata.get('azure_storage_account_api_key')};EndpointSuffix={userdata.get('azure_storage_account_endpoint_suffix')}"
-        azure_storage_container_name: str = userdata.get('azure_storage_account_container_name')
-    else:
-        azure_storage_connection_string: str = os.getenv("AZURE_STORAGE_CONNECTION_STRING", "")
-        azure_storage_container_name: str = os.getenv("AZURE_STORAGE_CONTAINER_NAME", "documents")
+    azure_storage_connection_string: str = os.getenv("AZURE_STORAGE_CONNECTION_STRING", "")
+    azure_storage_container_name: str = os.getenv("AZURE_STORAGE_CONTAINER_NAME", "documents")
 
     # Database Configuration
-    if IS_COLAB:
-        database_url: str = userdata.get('turso_database_url')
-        turso_api_token: str = userdata.get('turso_auth_token')
-    else:
-        database_url: str = os.getenv("DATABASE_URL", "sqlite:///./chatbot.db")
-        turso_api_token: str = os.getenv("TURSO_API_TOKEN", "")
+    database_url: str = os.getenv("DATABASE_URL", "sqlite:///./chatbot.db")
+    turso_api_token: str = os.getenv("TURSO_API_TOKEN", "")
+
+    # Database Pool Configuration
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    db_pool_timeout_seconds: float = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+    db_pool_health_check_seconds: float = float(os.getenv("DB_POOL_HEALTH_CHECK_SECONDS", "30"))
+
+    # Log Writer Configuration
+    log_writer_max_queue: int = int(os.getenv("LOG_WRITER_MAX_QUEUE", "10000"))
+    log_writer_batch_size: int = int(os.getenv("LOG_WRITER_BATCH_SIZE", "50"))
+    log_writer_flush_interval_ms: int = int(os.getenv("LOG_WRITER_FLUSH_INTERVAL_MS", "500"))
+    log_writer_spill_path: str = os.getenv("LOG_WRITER_SPILL_PATH", "./pending_logs.jsonl")
+    log_writer_overflow_policy: str = os.getenv("LOG_WRITER_OVERFLOW_POLICY", "spill")
+
+    # Logs Retention Configuration
+    retention_enabled: bool = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+    retention_max_age_hours: float = float(os.getenv("RETENTION_MAX_AGE_HOURS", "72"))
+    retention_interval_seconds: float = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+    retention_batch_size: int = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+    retention_lease_seconds: float = float(os.getenv("RETENTION_LEASE_SECONDS", "0"))  # 0 = un intervalo
+
+    # Session Memory Configuration
+    session_memory_max_sessions: int = int(os.getenv("SESSION_MEMORY_MAX_SESSIONS", "5000"))
+    session_memory_max_bytes: int = int(os.getenv("SESSION_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+    session_memory_ttl_seconds: float = float(os.getenv("SESSION_MEMORY_TTL_SECONDS", "3600"))
+
+    # Session Store Configuration
+    session_store_backend: str = os.getenv("SESSION_STORE_BACKEND", "memory")  # "memory", "database" o "sqlite"
+    session_store_sqlite_path: str = os.getenv("SESSION_STORE_SQLITE_PATH", "./sessions.sqlite3")
+
+    # LLM Concurrency Configuration
+    llm_max_concurrency: int = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+    llm_queue_timeout_seconds: float = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+
+    # Azure OpenAI Quota Configuration (0 = sin límite)
+    azure_openai_rpm: int = int(os.getenv("AZURE_OPENAI_RPM", "0"))
+    azure_openai_tpm: int = int(os.getenv("AZURE_OPENAI_TPM", "0"))
+    azure_embeddings_rpm: int = int(os.getenv("AZURE_EMBEDDINGS_RPM", "0"))
+    azure_embeddings_tpm: int = int(os.getenv("AZURE_EMBEDDINGS_TPM", "0"))
+    rate_limit_max_wait_seconds: float = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "10"))
+    rate_limit_max_retries: int = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))
+    rate_limit_session_max_pending: int = int(os.getenv("RATE_LIMIT_SESSION_MAX_PENDING", "2"))
+    rate_limit_request_tokens: int = int(os.getenv("RATE_LIMIT_REQUEST_TOKENS", "1500"))  # estimación inicial
+    rate_limit_completion_tokens: int = int(os.getenv("RATE_LIMIT_COMPLETION_TOKENS", "400"))
+
+    # Answer Cache Configuration
+    answer_cache_enabled: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    answer_cache_max_entries: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+    answer_cache_ttl_seconds: float = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+    answer_cache_similarity_threshold: float = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+    answer_cache_generation_check_seconds: float = float(os.getenv("ANSWER_CACHE_GENERATION_CHECK_SECONDS", "5"))
+
+    # Embedding Cache Configuration
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+
+    # Ingestion Pipeline Configuration
+    ingestion_parse_workers: int = int(os.getenv("INGESTION_PARSE_WORKERS", "4"))
+    ingestion_embed_workers: int = int(os.getenv("INGESTION_EMBED_WORKERS", "2"))
+    ingestion_upload_workers: int = int(os.getenv("INGESTION_UPLOAD_WORKERS", "2"))
+    ingestion_embed_batch_size: int = int(os.getenv("INGESTION_EMBED_BATCH_SIZE", "64"))
+    ingestion_upload_batch_size: int = int(os.getenv("INGESTION_UPLOAD_BATCH_SIZE", "100"))
+    ingestion_queue_size: int = int(os.getenv("INGESTION_QUEUE_SIZE", "32"))
+    ingestion_max_retries: int = int(os.getenv("INGESTION_MAX_RETRIES", "5"))
+
+    # Chunking Configuration (tamaños en tokens del modelo de embeddings)
+    chunk_tokens: int = int(os.getenv("CHUNK_TOKENS", "200"))
+    chunk_overlap_tokens: int = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+    chunk_dedup_enabled: bool = os.getenv("CHUNK_DEDUP_ENABLED", "true").lower() == "true"
+    chunk_dedup_threshold: float = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.85"))
+    chunk_minhash_permutations: int = int(os.getenv("CHUNK_MINHASH_PERMUTATIONS", "64"))
+    chunk_lsh_bands: int = int(os.getenv("CHUNK_LSH_BANDS", "16"))
+
+    # Retriever Configuration
+    retriever_backend: str = os.getenv("RETRIEVER_BACKEND", "azure")  # "azure" o "local"
+    retriever_top_k: int = int(os.getenv("RETRIEVER_TOP_K", "10"))
+    local_index_path: str = os.getenv("LOCAL_INDEX_PATH", "./vector_index")
+    local_index_ivf_lists: int = int(os.getenv("LOCAL_INDEX_IVF_LISTS", "0"))  # 0 = búsqueda exhaustiva
+    local_index_nprobe: int = int(os.getenv("LOCAL_INDEX_NPROBE", "8"))
+
+    # Question Condensing Configuration
+    condense_skip_standalone: bool = os.getenv("CONDENSE_SKIP_STANDALONE", "true").lower() == "true"
+
+    # Conversation History Configuration
+    history_max_turns: int = int(os.getenv("HISTORY_MAX_TURNS", "4"))
+    history_token_budget: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+    history_summary_enabled: bool = os.getenv("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"
+    history_summary_batch_turns: int = int(os.getenv("HISTORY_SUMMARY_BATCH_TURNS", "2"))
+    history_summary_max_tokens: int = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "200"))
+
+    # Batch Answers Configuration (evaluaciones offline en /api/chat/batch)
+    batch_max_questions: int = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+    batch_max_concurrency: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+    batch_item_max_attempts: int = int(os.getenv("BATCH_ITEM_MAX_ATTEMPTS", "3"))
+
+    # Request Coalescing Configuration
+    coalescing_enabled: bool = os.getenv("COALESCING_ENABLED", "true").lower() == "true"
+
+    # Context Packing Configuration
+    context_packing_enabled: bool = os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+    context_token_budget: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+    context_max_documents: int = int(os.getenv("CONTEXT_MAX_DOCUMENTS", "6"))
+    context_dedup_threshold: float = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+    # Startup Configuration
+    startup_warmup: bool = os.getenv("STARTUP_WARMUP", "false").lower() == "true"
 
     class Config:
         env_file = ".env"
         case_sensitive = False
 
 
+def _colab_overrides() -> dict:
+    """Credenciales desde userdata cuando se ejecuta en Google Colab (vacío en otro caso)"""
+    try:
+        from google.colab import userdata
+    except ImportError:
+        return {}
+
+    search_name = userdata.get('azure_cognitive_search_name')
+    return {
+        "azure_openai_api_key": userdata.get('azure_api_key'),
+        "azure_openai_endpoint": userdata.get('azure_endpoint'),
+        "azure_openai_deployment_name": userdata.get('azure_llm_deployment'),
+        "azure_openai_api_version": userdata.get('azure_api_version'),
+        "azure_search_endpoint": f"https://{search_name}.search.windows.net",
+        "azure_search_api_key": userdata.get('azure_cognitive_search_api_key'),
+        "azure_search_index_name": userdata.get('azure_cognitive_search_index_name'),
+        "azure_search_name": search_name,
+        "azure_storage_connection_string": f"DefaultEndpointsProtocol=https;AccountName={userdata.get('azure_storage_account_name')};AccountKey={userdata.get('azure_storage_account_api_key')};EndpointSuffix={userdata.get('azure_storage_account_endpoint_suffix')}",
+        "azure_storage_container_name": userdata.get('azure_storage_account_container_name'),
+        "database_url": userdata.get('turso_database_url'),
+        "turso_api_token": userdata.get('turso_auth_token'),
+    }
+
+
 # Global settings instance
 _settings = None
 
@@ -82,7 +181,7 @@ def get_settings() -> Settings:
     """Get application settings singleton"""
     global _settings
     if _settings is None:
-        _settings = Settings()
+        _settings = Settings(**_colab_overrides())
     return _settings
 
 def validate_azure_settings():
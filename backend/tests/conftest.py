@@ -0,0 +1,22 @@
+import os
+import sys
+import sqlite3
+import pytest
+
+# Los módulos del backend son planos (sin paquete): se importan desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """Reemplaza el pool global de Turso por una base SQLite local con el esquema migrado."""
+    import database
+
+    path = str(tmp_path / "turso.db")
+    pool = database.ConnectionPool(connect=lambda: sqlite3.connect(path, check_same_thread=False, timeout=5),
+                                   size=4, acquire_timeout=5, health_check_seconds=30)
+    monkeypatch.setattr(database, "_pool", pool)
+    with pool.connection() as conn:
+        database.run_migrations(conn)
+    yield path
+    pool.close()
@@ -0,0 +1,113 @@
+import asyncio
+import numpy as np
+import azure_ai_search
+import database
+from answer_cache import SemanticAnswerCache, normalize_question
+from test_ingestion import FakeContainer, FakeEmbeddings, FakeVectorStore, LineSplitter
+
+
+class QueryEmbeddings:
+    """Embeddings de consulta deterministas: cada palabra conocida es un eje."""
+
+    def __init__(self, axes: dict):
+        self.axes = axes
+        self.calls = 0
+
+    async def aembed_query(self, text: str):
+        self.calls += 1
+        vector = np.zeros(len(self.axes), dtype=np.float32)
+        for word in normalize_question(text).split():
+            if word in self.axes:
+                vector[self.axes[word]] += 1.0
+        return vector.tolist()
+
+
+def make_cache(embeddings, **kwargs) -> SemanticAnswerCache:
+    return SemanticAnswerCache(embeddings, max_entries=10, ttl_seconds=60, similarity_threshold=0.9, **kwargs)
+
+
+def store(cache, question: str, lookup, answer: str):
+    cache.store(question, lookup.embedding, answer, [], 10, 5, 0.01, generation=lookup.generation)
+
+
+def test_exact_and_semantic_hits_and_ttl():
+    async def scenario():
+        embeddings = QueryEmbeddings({"horario": 0, "biblioteca": 1, "becas": 2})
+        cache = make_cache(embeddings)
+        lookup = await cache.lookup("¿Horario de la biblioteca?")
+        assert lookup.entry is None
+        store(cache, "¿Horario de la biblioteca?", lookup, "De 8 a 20")
+
+        exact = await cache.lookup("horario de la BIBLIOTECA")
+        semantic = await cache.lookup("biblioteca horario hoy")
+        unrelated = await cache.lookup("becas")
+        assert exact.entry.answer == "De 8 a 20" and exact.similarity == 1.0
+        assert semantic.entry.answer == "De 8 a 20" and semantic.similarity >= 0.9
+        assert unrelated.entry is None
+        assert embeddings.calls == 3  # la coincidencia exacta no calcula el embedding
+
+        cache.ttl_seconds = 0
+        assert (await cache.lookup("horario de la biblioteca")).entry is None
+        assert cache.stats()["exact_hits"] == 1 and cache.stats()["semantic_hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_sync_in_another_worker_invalidates_the_cache(sqlite_db, monkeypatch):
+    container = FakeContainer({"a.txt": ("1", "uno\ndos")})
+    monkeypatch.setattr(azure_ai_search, "get_vector_store", lambda: FakeVectorStore())
+    monkeypatch.setattr(azure_ai_search, "get_container_client", lambda: container)
+    monkeypatch.setattr(azure_ai_search, "_load_blob", container.load)
+    monkeypatch.setattr(azure_ai_search, "build_text_splitter", lambda *args: LineSplitter())
+    monkeypatch.setattr(azure_ai_search, "get_chunk_deduplicator", lambda model_name: None)
+    embeddings = FakeEmbeddings()
+    embeddings.stats = lambda: {}
+    monkeypatch.setattr(azure_ai_search, "get_ingestion_embeddings", lambda: embeddings)
+    # La caché de este proceso (el que sincroniza) es distinta de la del otro worker
+    syncing_worker_cache = make_cache(QueryEmbeddings({"horario": 0}), generation_source=database.fetch_kb_generation)
+    monkeypatch.setattr(azure_ai_search, "get_answer_cache", lambda: syncing_worker_cache)
+
+    async def scenario():
+        other_worker = make_cache(QueryEmbeddings({"horario": 0}), generation_source=database.fetch_kb_generation,
+                                  generation_check_seconds=0)
+        lookup = await other_worker.lookup("horario")
+        store(other_worker, "horario", lookup, "respuesta con los documentos anteriores")
+        assert (await other_worker.lookup("horario")).entry is not None
+
+        # Una respuesta que se estaba generando cuando cambió la base no se guarda
+        in_flight = await other_worker.lookup("horario biblioteca")
+        summary = await asyncio.to_thread(azure_ai_search.update_knowledge_base)
+        assert summary["chunks_upserted"] == 2
+        assert database.fetch_kb_generation() == 1
+
+        assert (await other_worker.lookup("horario")).entry is None
+        store(other_worker, "horario biblioteca", in_flight, "respuesta vieja")
+        assert other_worker.stats()["entries"] == 0 and other_worker.stats()["stale_discards"] == 1
+        assert syncing_worker_cache.stats()["kb_generation"] == 1
+
+        # Una sincronización sin cambios no vacía la caché
+        lookup = await other_worker.lookup("horario")
+        store(other_worker, "horario", lookup, "respuesta nueva")
+        await asyncio.to_thread(azure_ai_search.update_knowledge_base)
+        assert (await other_worker.lookup("horario")).entry.answer == "respuesta nueva"
+
+    asyncio.run(scenario())
+
+
+def test_generation_read_failure_keeps_the_cache():
+    async def scenario():
+        reads = []
+
+        def source():
+            reads.append(1)
+            if len(reads) > 1:
+                raise ConnectionError("Turso no responde")
+            return 3
+
+        cache = make_cache(QueryEmbeddings({"horario": 0}), generation_source=source, generation_check_seconds=0)
+        lookup = await cache.lookup("horario")
+        store(cache, "horario", lookup, "respuesta")
+        hit = await cache.lookup("horario")
+        assert hit.entry.answer == "respuesta" and hit.generation == 3
+
+    asyncio.run(scenario())
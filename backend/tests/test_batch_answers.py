@@ -0,0 +1,46 @@
+import asyncio
+from langchain_core.documents import Document
+from batch_answers import BatchRunner
+from test_chatbot_app import FakeRetriever, make_chain
+
+
+def test_batch_shares_retrievals_between_equivalent_questions():
+    chain = make_chain(["Respuesta del lote."] * 10)
+    logs = []
+    questions = [("q1", "¿Qué es el inventario de la bodega?"), ("q2", "que es el inventario de la bodega"),
+                 ("q3", "¿Cómo se registra una merma?"), ("q4", "¿Quién aprueba las compras grandes?")]
+
+    async def scenario():
+        runner = BatchRunner(chain, max_concurrency=2, max_attempts=2, on_logs=logs.append)
+        return [event async for event in runner.run("batch-prueba", questions)]
+
+    events = asyncio.run(scenario())
+    results, summary = events[:-1], events[-1]
+    assert sorted(result["id"] for result in results) == ["q1", "q2", "q3", "q4"]
+    assert all(result["type"] == "result" and result["answer"] == "Respuesta del lote." for result in results)
+    assert summary["type"] == "summary" and summary["answered"] == 4 and summary["errors"] == 0
+    assert summary["retrievals"] == 3 and summary["retrievals_shared"] == 1
+    assert len(chain.retriever.queries) == 3
+    assert len(logs) == 4 and all(log["session_id"] == "batch-prueba" for log in logs)
+
+
+def test_batch_reports_failed_questions_without_stopping_the_rest():
+    class FailingRetriever(FakeRetriever):
+        def _get_relevant_documents(self, query, *, run_manager):
+            if "falla" in query:
+                raise RuntimeError("búsqueda no disponible")
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+
+    chain = make_chain(["Respuesta del lote."] * 10)
+    chain.retriever = FailingRetriever(documents=[Document(page_content="contexto")], queries=[])
+
+    async def scenario():
+        runner = BatchRunner(chain, max_concurrency=2, max_attempts=1, on_logs=lambda logs: None)
+        return [event async for event in runner.run("batch-prueba", [
+            (None, "Esta pregunta falla en la búsqueda"), (None, "¿Cómo se registra una merma?")])]
+
+    events = asyncio.run(scenario())
+    by_index = {event["index"]: event for event in events[:-1]}
+    assert by_index[0]["type"] == "error" and "búsqueda no disponible" in by_index[0]["error"]
+    assert by_index[1]["type"] == "result"
+    assert events[-1]["answered"] == 1 and events[-1]["errors"] == 1
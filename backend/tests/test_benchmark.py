@@ -0,0 +1,44 @@
+import pytest
+from benchmark import Recorder, SimulatedQuota, ThrottledError, parse_stage_metrics
+
+
+def test_recorder_summarizes_latency_percentiles_and_errors():
+    recorder = Recorder()
+    for ms in range(1, 101):
+        recorder.record("/chat", ms / 1000, 200)
+    recorder.record("/chat", 0.5, 503)
+    recorder.record("/chat", 0.5, None)
+    recorder.record("/chat/stream", 0.2, "stream_error")
+
+    summary = recorder.summary(wall_seconds=2)
+    chat = summary["/chat"]
+    assert chat["requests"] == 102 and chat["errors"] == 2
+    assert chat["status_codes"] == {"200": 100, "503": 1, "connection_error": 1}
+    assert chat["throughput_rps"] == 51.0
+    assert 50 <= chat["latency_ms"]["p50"] <= 52 and chat["latency_ms"]["max"] == 500.0
+    assert summary["/chat/stream"]["errors"] == 1
+
+
+def test_simulated_quota_throttles_with_retry_after():
+    quota = SimulatedQuota(tokens_per_minute=600)  # 10 tokens/s, ráfaga de 100
+    quota.charge(100)
+    with pytest.raises(ThrottledError) as error:
+        quota.charge(50)
+    retry_after_ms = int(error.value.response.headers["retry-after-ms"])
+    assert 4000 <= retry_after_ms <= 5000 and quota.throttled == 1
+    SimulatedQuota(tokens_per_minute=0).charge(10 ** 9)  # Sin cuota no hay límite
+
+
+def test_stage_metrics_are_parsed_from_the_prometheus_exposition():
+    exposition = "\n".join([
+        "# HELP chatbot_stage_duration_seconds Duración de cada etapa",
+        'chatbot_stage_duration_seconds_bucket{stage="retrieve",le="0.1"} 3.0',
+        'chatbot_stage_duration_seconds_count{stage="retrieve"} 4.0',
+        'chatbot_stage_duration_seconds_sum{stage="retrieve"} 0.2',
+        'chatbot_stage_duration_seconds_count{stage="generate"} 0.0',
+        'chatbot_stage_duration_seconds_sum{stage="generate"} 0.0',
+    ])
+    assert parse_stage_metrics(exposition) == {
+        "retrieve": {"count": 4, "mean_ms": 50.0},
+        "generate": {"count": 0, "mean_ms": 0.0},
+    }
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+import chatbot_api
+from models import ChatRequest
+
+
+def _request():
+    async def is_disconnected():
+        return False
+    return SimpleNamespace(is_disconnected=is_disconnected)
+
+
+async def _components(name):
+    return object()
+
+
+async def _events(*args):
+    yield {"event": "token", "data": {"text": "hola"}}
+
+
+def test_stream_releases_its_slot_when_the_client_leaves_before_the_body(monkeypatch):
+    monkeypatch.setattr(chatbot_api.components, "aget", _components)
+    monkeypatch.setattr(chatbot_api, "stream_response_with_logs", _events)
+
+    async def scenario():
+        response = await chatbot_api.chat_stream_endpoint(ChatRequest(session_id="s1", user_question="hola"), _request())
+        in_flight = chatbot_api.llm_limiter.stats()["in_flight"]
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            raise OSError("el cliente cerró la conexión")
+
+        with pytest.raises(ClientDisconnect):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+        return in_flight
+
+    assert asyncio.run(scenario()) == 1
+    assert chatbot_api.llm_limiter.stats()["in_flight"] == 0
+    assert chatbot_api.llm_scheduler.stats()["pending_sessions"] == 0
+
+
+def test_stream_reports_component_failures_as_errors(monkeypatch):
+    async def failing(name):
+        raise RuntimeError("no se pudo crear la cadena RAG")
+
+    monkeypatch.setattr(chatbot_api.components, "aget", failing)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(chatbot_api.chat_stream_endpoint(ChatRequest(session_id="s1", user_question="hola"), _request()))
+    assert error.value.status_code == 500
+    assert chatbot_api.llm_limiter.stats()["in_flight"] == 0
+
+
+def test_stream_sends_events_and_releases_its_slot_once(monkeypatch):
+    monkeypatch.setattr(chatbot_api.components, "aget", _components)
+    monkeypatch.setattr(chatbot_api, "stream_response_with_logs", _events)
+    sent = []
+
+    async def scenario():
+        response = await chatbot_api.chat_stream_endpoint(ChatRequest(session_id="s1", user_question="hola"), _request())
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def send(message):
+            sent.append(message)
+
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+
+    asyncio.run(scenario())
+    assert b"event: token" in b"".join(message.get("body", b"") for message in sent)
+    stats = chatbot_api.llm_limiter.stats()
+    assert stats["in_flight"] == 0 and chatbot_api.llm_limiter._semaphore._value == stats["max_concurrency"]
@@ -0,0 +1,102 @@
+import asyncio
+from langchain.chains import ConversationalRetrievalChain
+from langchain.prompts import PromptTemplate
+from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.retrievers import BaseRetriever
+import chatbot_app
+from memory_store import Conversation, SessionMemoryStore
+
+
+class FakeChatModel(BaseChatModel):
+    """LLM que responde en orden con `answers` e informa el uso como lo hace Azure OpenAI."""
+    answers: list
+    prompts: list = []
+    model_name: str = "gpt-4o"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.prompts.append(messages)
+        answer = self.answers[len(self.prompts) - 1]
+        usage = {"prompt_tokens": 120, "completion_tokens": 8, "total_tokens": 128}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))],
+                          llm_output={"token_usage": usage, "model_name": self.model_name})
+
+
+class FakeRetriever(BaseRetriever):
+    documents: list
+    queries: list = []
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        self.queries.append(query)
+        return self.documents
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> list[Document]:
+        return self._get_relevant_documents(query, run_manager=run_manager)
+
+
+def make_chain(answers: list, documents: list = None) -> ConversationalRetrievalChain:
+    prompt = PromptTemplate.from_template("Contexto: {context}\nPregunta: {question}")
+    return ConversationalRetrievalChain.from_llm(
+        llm=FakeChatModel(answers=answers, prompts=[]),
+        retriever=FakeRetriever(documents=documents or [Document(page_content="El inventario se cuenta cada mes.")],
+                                queries=[]),
+        combine_docs_chain_kwargs={"prompt": prompt}
+    )
+
+
+def test_chain_runs_once_and_logs_the_usage_of_that_run(monkeypatch):
+    monkeypatch.setattr(chatbot_app, "coalescer", None)
+    monkeypatch.setattr(chatbot_app, "history_summarizer", None)
+    chain = make_chain(["Se cuenta cada mes."])
+    store = SessionMemoryStore(max_sessions=10, max_bytes=10_000, ttl_seconds=60)
+
+    answer, logs = asyncio.run(chatbot_app.generate_response_with_logs(
+        chain, store, None, "¿Cada cuánto se cuenta el inventario?", "s1"))
+
+    assert answer == "Se cuenta cada mes."
+    assert len(chain.combine_docs_chain.llm_chain.llm.prompts) == 1  # sin historial no se reformula
+    assert chain.retriever.queries == ["¿Cada cuánto se cuenta el inventario?"]
+    expected_cost = (get_openai_token_cost_for_model("gpt-4o", 120)
+                     + get_openai_token_cost_for_model("gpt-4o", 8, is_completion=True))
+    assert (logs["prompt_tokens"], logs["completion_tokens"], logs["total_tokens"]) == (120, 8, 128)
+    assert expected_cost > 0 and abs(logs["total_cost_usd"] - expected_cost) < 1e-9
+    assert logs["session_id"] == "s1" and logs["llm_answer"] == answer and not logs["cache_hit"]
+    assert store.get_history("s1") == [("¿Cada cuánto se cuenta el inventario?", "Se cuenta cada mes.")]
+
+
+def test_standalone_heuristic():
+    assert chatbot_app.is_standalone_question("¿Cuáles son los requisitos para la beca de transporte?")
+    assert not chatbot_app.is_standalone_question("¿Y para la de alimentación?")  # conector de seguimiento
+    assert not chatbot_app.is_standalone_question("¿Cuánto cuesta eso al mes?")  # demostrativo
+    assert not chatbot_app.is_standalone_question("Explícamelo con más detalle, por favor")
+    assert not chatbot_app.is_standalone_question("¿Por qué?")  # demasiado corta
+
+
+def test_condense_calls_the_llm_only_for_follow_up_questions(monkeypatch):
+    monkeypatch.setattr(chatbot_app, "history_summarizer", None)
+    monkeypatch.setattr(chatbot_app.settings, "condense_skip_standalone", True)
+    chain = make_chain(["¿Cuánto cuesta la beca de transporte al mes?"])
+    conversation = Conversation(turns=[("¿Qué becas hay?", "Hay beca de transporte.")], turn_ids=[1])
+
+    async def scenario():
+        first = await chatbot_app.condense_question(chain, "¿Qué becas hay?", Conversation())
+        second = await chatbot_app.condense_question(
+            chain, "¿Cuáles son los requisitos para la beca de transporte?", conversation)
+        third = await chatbot_app.condense_question(chain, "¿Y cuánto cuesta eso?", conversation)
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert first == ("¿Qué becas hay?", 0)
+    assert second == ("¿Cuáles son los requisitos para la beca de transporte?", 0)
+    assert third[0] == "¿Cuánto cuesta la beca de transporte al mes?"
+    prompts = chain.question_generator.llm.prompts
+    assert len(prompts) == 1 and "Hay beca de transporte." in prompts[0][0].content
@@ -0,0 +1,103 @@
+import random
+import numpy as np
+import database
+from langchain_core.documents import Document
+from chunking import (ChunkDeduplicator, MinHasher, NearDuplicateIndex, build_text_splitter,
+                      decode_signatures, encode_signatures)
+from context_packing import count_tokens, shingles, tokenize
+from test_ingestion import FakeContainer, FakeEmbeddings, FakeVectorStore, make_pipeline
+
+WORDS = [f"palabra{i}" for i in range(2000)]
+
+
+def _text(generator: random.Random, length: int = 100) -> str:
+    return " ".join(generator.choice(WORDS) for _ in range(length))
+
+
+def _near_duplicate(generator: random.Random, text: str) -> str:
+    words = text.split()
+    words[generator.randrange(len(words))] = "cambiada"
+    return " ".join(words)
+
+
+def test_minhash_estimates_jaccard_similarity():
+    generator = random.Random(7)
+    hasher = MinHasher(num_perm=128)
+    base = _text(generator)
+    for other in (_near_duplicate(generator, base), base[: len(base) // 2] + " " + _text(generator, 50)):
+        first, second = shingles(tokenize(base)), shingles(tokenize(other))
+        jaccard = len(first & second) / len(first | second)
+        estimate = float(np.mean(hasher.signature(base) == hasher.signature(other)))
+        assert abs(estimate - jaccard) < 0.12
+    assert hasher.signature("   ") is None
+
+
+def test_lsh_index_recalls_near_duplicates_and_ignores_unrelated_texts():
+    generator = random.Random(11)
+    hasher = MinHasher(num_perm=64)
+    index = NearDuplicateIndex(num_perm=64, bands=16, threshold=0.8)
+    originals = [_text(generator) for _ in range(200)]
+    for i, text in enumerate(originals):
+        index.add(f"c{i}", hasher.signature(text))
+
+    found = sum(index.query(hasher.signature(_near_duplicate(generator, text))) == f"c{i}"
+                for i, text in enumerate(originals))
+    false_matches = sum(index.query(hasher.signature(_text(generator))) is not None for _ in range(200))
+    assert found / len(originals) >= 0.95
+    assert false_matches == 0
+
+
+def test_signatures_round_trip_through_the_manifest():
+    hasher = MinHasher(num_perm=64)
+    signatures = [hasher.signature("uno dos tres cuatro cinco seis"), hasher.signature("siete ocho nueve diez once")]
+    decoded = decode_signatures(encode_signatures(signatures), 2, 64)
+    assert all(np.array_equal(a, b) for a, b in zip(signatures, decoded))
+    assert decode_signatures(encode_signatures(signatures), 2, 128) == []  # Otro num_perm: se recalculan
+
+
+def test_deduplicator_drops_copies_and_counts_saved_tokens():
+    generator = random.Random(3)
+    legal = _text(generator, 200)
+    deduplicator = ChunkDeduplicator("text-embedding-ada-002", threshold=0.8)
+    first = deduplicator.filter(["a1", "a2"], [Document(page_content=legal), Document(page_content=_text(generator))],
+                                known_ids=set())
+    second = deduplicator.filter(["b1"], [Document(page_content=_near_duplicate(generator, legal))], known_ids=set())
+
+    assert first.ids == ["a1", "a2"] and second.ids == [] and second.duplicate_of == ["a1"]
+    stats = deduplicator.stats()
+    assert stats["duplicates_dropped"] == 1 and stats["embedding_tokens_saved"] > 0
+
+    # Los chunks de blobs sin cambios se registran desde las firmas del manifiesto
+    deduplicator.reset()
+    deduplicator.register(first.ids, first.signatures)
+    assert deduplicator.filter(["c1"], [Document(page_content=legal)], known_ids=set()).duplicate_of == ["a1"]
+
+
+def test_splitter_measures_chunks_in_tokens():
+    text = "\n\n".join(_text(random.Random(i), 80) for i in range(5))
+    chunks = build_text_splitter("text-embedding-ada-002", chunk_tokens=120, overlap_tokens=10).split_text(text)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk, "text-embedding-ada-002") <= 120 for chunk in chunks)
+
+
+def test_blob_is_requeued_when_the_chunk_it_deferred_to_is_removed(sqlite_db):
+    generator = random.Random(5)
+    legal = _text(generator, 40)  # Aviso legal repetido en ambos documentos
+    container = FakeContainer({"a.txt": ("1", f"{legal}\n{_text(generator, 40)}"),
+                               "b.txt": ("1", f"{legal}\n{_text(generator, 40)}")})
+    store = FakeVectorStore()
+    deduplicator = ChunkDeduplicator("text-embedding-ada-002", threshold=0.8)
+
+    # Un solo hilo de parseo para que "a.txt" se procese primero y conserve el chunk
+    summary = make_pipeline(container, FakeEmbeddings(), store, deduplicator, parse_workers=1).run()
+    assert summary["dedup"]["duplicates_dropped"] == 1 and len(store.chunks) == 3
+
+    del container.blobs["a.txt"]
+    summary = make_pipeline(container, FakeEmbeddings(), store, deduplicator).run()
+    assert summary["requeued"] == ["b.txt"]
+    assert database.load_kb_manifest()["b.txt"]["etag"] == ""
+
+    embeddings = FakeEmbeddings()
+    summary = make_pipeline(container, embeddings, store, deduplicator).run()
+    assert summary["updated"] == ["b.txt"] and len(embeddings.texts) == 1
+    assert len(store.chunks) == 2 and summary["requeued"] == []
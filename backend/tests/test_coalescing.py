@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessageChunk
+from coalescing import RequestCoalescer
+from chatbot_app import settle_generation
+
+LLM = SimpleNamespace(model_name="gpt-4o")
+
+
+def _chunk(text: str, **usage) -> AIMessageChunk:
+    return AIMessageChunk(content=text, usage_metadata=usage or None)
+
+
+def test_identical_requests_share_one_generation_and_only_one_pays():
+    async def scenario():
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            yield _chunk("Hola")
+            yield _chunk(" mundo", input_tokens=100, output_tokens=2, total_tokens=102)
+
+        coalescer = RequestCoalescer()
+        key = RequestCoalescer.key("¿Qué es el inventario?", [Document(page_content="contexto")])
+        same_key = RequestCoalescer.key("que es el inventario", [Document(page_content="contexto")])
+        assert key == same_key
+        first, first_started = coalescer.join(key, produce)
+        second, second_started = coalescer.join(same_key, produce)
+        answers = await asyncio.gather(*[_read(flight) for flight in (first, second)])
+        usages = [settle_generation(first, LLM, "prompt", first_started),
+                  settle_generation(second, LLM, "prompt", second_started)]
+        return calls, first is second, answers, usages, coalescer.stats()
+
+    calls, shared, answers, usages, stats = asyncio.run(scenario())
+    assert calls == [1] and shared
+    assert answers == ["Hola mundo", "Hola mundo"]
+    assert [usage["paid"] for usage in usages] == [True, False]
+    assert usages[0]["prompt_tokens"] == 100 and usages[1]["prompt_tokens"] == 0
+    assert usages[1]["coalesced"] and usages[1]["saved_cost_usd"] == usages[0]["cost"]
+    assert stats == {"generations": 1, "coalesced": 1, "in_flight": 0}
+
+
+def test_generation_cancelled_before_its_first_chunk_is_not_charged():
+    async def scenario():
+        async def produce():
+            await asyncio.sleep(10)
+            yield _chunk("tarde")
+
+        flight, started = RequestCoalescer().join("clave", produce)
+        await asyncio.sleep(0)
+        return settle_generation(flight, LLM, "un prompt largo " * 100, started)
+
+    usage = asyncio.run(scenario())
+    assert (usage["prompt_tokens"], usage["completion_tokens"], usage["cost"], usage["paid"]) == (0, 0, 0.0, False)
+
+
+async def _read(flight) -> str:
+    return "".join([text async for text in flight.subscribe()])
@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+import chatbot_api
+from concurrency import ConcurrencyLimiter, QueueTimeoutError
+from models import ChatRequest
+
+
+def test_limiter_caps_concurrent_runs_and_queues_the_rest():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrency=2, queue_timeout=5)
+        running, peak = 0, 0
+
+        async def run():
+            nonlocal running, peak
+            async with limiter.slot():
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*[run() for _ in range(6)])
+        return peak, limiter.stats()
+
+    peak, stats = asyncio.run(scenario())
+    assert peak == 2
+    assert stats == {"in_flight": 0, "waiting": 0, "max_concurrency": 2, "completed": 6, "timeouts": 0}
+
+
+def test_limiter_times_out_waiting_requests():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrency=1, queue_timeout=0.05)
+        await limiter.acquire()
+        with pytest.raises(QueueTimeoutError):
+            await limiter.acquire()
+        limiter.release()
+        await limiter.acquire()  # El cupo liberado se puede volver a tomar
+        limiter.release()
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["timeouts"] == 1 and stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+def test_chat_answers_503_when_no_slot_frees_up(monkeypatch):
+    async def component(name):
+        return object()
+
+    monkeypatch.setattr(chatbot_api.components, "aget", component)
+    monkeypatch.setattr(chatbot_api, "llm_limiter", ConcurrencyLimiter(max_concurrency=1, queue_timeout=1))
+
+    async def scenario():
+        await chatbot_api.llm_limiter.acquire()
+        try:
+            await chatbot_api.chat_endpoint(ChatRequest(session_id="s1", user_question="hola"))
+        finally:
+            chatbot_api.llm_limiter.release()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(scenario())
+    assert error.value.status_code == 503 and error.value.headers == {"Retry-After": "1"}
+    assert chatbot_api.llm_scheduler.stats()["pending_sessions"] == 0
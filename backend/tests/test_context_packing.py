@@ -0,0 +1,43 @@
+from langchain_core.documents import Document
+from context_packing import ContextPacker, bm25_scores, count_tokens
+
+MODEL = "gpt-4o"
+SHARED = "el inventario se revisa cada semana en todas las sucursales de la empresa"
+
+
+def _doc(text: str, source: str, chunk_id: str) -> Document:
+    return Document(page_content=text, metadata={"source": source, "id": chunk_id})
+
+
+def test_bm25_prefers_texts_with_the_query_terms():
+    scores = bm25_scores("optimizar inventario", ["cómo optimizar el inventario", "horario de atención"])
+    assert scores[0] > scores[1] == 0.0
+
+
+def test_near_duplicates_are_dropped_and_the_budget_is_respected():
+    texts = [
+        "Para optimizar el inventario conviene revisar la rotación de cada producto con frecuencia.",
+        "Para optimizar el inventario conviene revisar la rotación de cada producto con frecuencia!",
+        "El horario de atención de las sucursales es de lunes a viernes de nueve a dieciocho.",
+        "Las devoluciones se aceptan dentro de los treinta días posteriores a la compra del producto.",
+    ]
+    documents = [_doc(text, f"doc{number}.pdf", str(number)) for number, text in enumerate(texts)]
+    budget = count_tokens(texts[0], MODEL) + count_tokens(texts[2], MODEL)
+    packed = ContextPacker(token_budget=budget, max_documents=5).pack("optimizar inventario", documents, MODEL)
+
+    assert packed.documents[0].page_content == texts[0]
+    assert packed.context_tokens <= budget
+    reasons = {entry["id"]: entry["reason"] for entry in packed.dropped}
+    assert reasons["1"] == "duplicate"
+    assert "token_budget" in reasons.values()
+
+
+def test_overlap_is_trimmed_only_between_chunks_of_the_same_document():
+    first = _doc("Primera parte del manual de compras. " + SHARED, "manual.pdf", "a")
+    next_chunk = _doc(SHARED + " Segunda parte con los pasos de la auditoría.", "manual.pdf", "b")
+    other_source = _doc(SHARED + " Política distinta de otra área.", "politicas.pdf", "c")
+    packed = ContextPacker(token_budget=10_000, max_documents=5).pack("inventario", [first, next_chunk, other_source], MODEL)
+
+    contents = {doc.metadata["id"]: doc.page_content for doc in packed.documents}
+    assert contents["b"] == "Segunda parte con los pasos de la auditoría."
+    assert contents["c"] == other_source.page_content
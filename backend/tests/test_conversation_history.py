@@ -0,0 +1,57 @@
+import asyncio
+from conversation_history import HistorySummarizer, _turn_tokens, select_history
+from memory_store import Conversation, SessionMemoryStore
+from test_chatbot_app import FakeChatModel
+
+MODEL = "gpt-4o"
+
+
+def _conversation(count: int, summary: str = "", summarized_through_id: int = 0) -> Conversation:
+    turns = [(f"pregunta número {i} sobre becas", f"respuesta número {i} " + "detalle " * 10) for i in range(count)]
+    return Conversation(turns, list(range(1, count + 1)), summary, summarized_through_id)
+
+
+def test_window_keeps_recent_turns_within_the_token_budget():
+    conversation = _conversation(6)
+    turn_tokens = _turn_tokens(*conversation.turns[-1], MODEL)
+
+    window = select_history(conversation, MODEL, max_turns=4, token_budget=turn_tokens * 2 + 1)
+    assert window.turns == conversation.turns[-2:]
+    assert window.tokens <= turn_tokens * 2 + 1 and window.tokens_saved == window.full_tokens - window.tokens
+
+    assert select_history(conversation, MODEL, max_turns=1, token_budget=10_000).turns == conversation.turns[-1:]
+    # La última pregunta y respuesta entra aunque sola supere el presupuesto
+    assert select_history(conversation, MODEL, max_turns=4, token_budget=1).turns == conversation.turns[-1:]
+
+
+def test_window_counts_the_summary_and_skips_summarized_turns():
+    conversation = _conversation(6, summary="El estudiante preguntó por becas.", summarized_through_id=4)
+    window = select_history(conversation, MODEL, max_turns=4, token_budget=10_000)
+    assert window.turns == conversation.turns[4:] and window.summary == conversation.summary
+    assert window.tokens > sum(_turn_tokens(question, answer, MODEL) for question, answer in window.turns)
+
+    # Con resumen incremental se conservan los turnos que el resumen todavía no alcanzó
+    unsummarized = select_history(_conversation(6), MODEL, max_turns=2, token_budget=10_000, keep_unsummarized=True)
+    assert len(unsummarized.turns) == 6
+
+
+def test_summarizer_folds_old_turns_in_batches():
+    store = SessionMemoryStore(max_sessions=10, max_bytes=100_000, ttl_seconds=60)
+    for question, answer in _conversation(5).turns:
+        store.append_turn("s1", question, answer)
+    llm = FakeChatModel(answers=["Resumen: becas de transporte.", "no se usa"], prompts=[])
+    summarizer = HistorySummarizer(max_turns=2, batch_turns=2, max_tokens=100)
+
+    async def scenario():
+        await summarizer.schedule(store, llm, "s1")
+        await asyncio.sleep(0)
+        await summarizer.schedule(store, llm, "s1")  # Sin turnos nuevos suficientes no se resume otra vez
+
+    asyncio.run(scenario())
+    conversation = store.get_conversation("s1")
+    assert conversation.summary == "Resumen: becas de transporte."
+    assert conversation.summarized_through_id == 3 and conversation.summarized_turns == 3
+    assert len(llm.prompts) == 1 and "pregunta número 2" in llm.prompts[0][0].content
+    stats = summarizer.stats()
+    assert stats["summaries"] == 1 and stats["turns_folded"] == 3 and stats["prompt_tokens"] == 120
+    assert stats["in_flight"] == 0
@@ -0,0 +1,203 @@
+import time
+import sqlite3
+import threading
+import pytest
+import database
+from database import ConnectionPool, MIGRATIONS, run_migrations
+
+
+def _pool(path: str) -> ConnectionPool:
+    return ConnectionPool(connect=lambda: sqlite3.connect(path, check_same_thread=False, timeout=0.2),
+                          size=1, acquire_timeout=1, health_check_seconds=30)
+
+
+def test_failed_write_is_rolled_back_before_the_connection_is_reused(tmp_path):
+    path = str(tmp_path / "pool.db")
+    pool = _pool(path)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE items (value TEXT);")
+        conn.commit()
+
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO items (value) VALUES ('a medias');")
+            raise RuntimeError("falla a mitad de la transacción")
+
+    # Otra conexión puede escribir: la transacción fallida ya no retiene el bloqueo
+    other = sqlite3.connect(path, timeout=0.2)
+    other.execute("INSERT INTO items (value) VALUES ('otra');")
+    other.commit()
+
+    # El siguiente en recibir la conexión del pool no ve ni confirma la escritura fallida
+    with pool.connection() as conn:
+        conn.commit()
+        assert conn.execute("SELECT value FROM items;").fetchall() == [("otra",)]
+    assert other.execute("SELECT value FROM items;").fetchall() == [("otra",)]
+    other.close()
+    pool.close()
+
+
+def test_history_backfill_skips_batch_sessions_and_empty_answers(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "logs.db"))
+    for version, _, migration in MIGRATIONS:
+        if version < 9:
+            migration(conn)
+    rows = [("1", "s1", "hola", "respuesta", "2024-05-01T10:00"),
+            ("2", "batch-0a1b2c3d4e5f", "pregunta", "respuesta", "2024-05-01T10:01"),
+            ("3", "s1", "y luego", "", "2024-05-01T10:02")]
+    conn.executemany("INSERT INTO logs (ID, session_id, user_question, llm_answer, date_processed) "
+                     "VALUES (?, ?, ?, ?, ?);", rows)
+    conn.commit()
+
+    run_migrations(conn)
+    assert conn.execute("SELECT session_id, turn FROM session_turns;").fetchall() == [
+        ("s1", '["hola","respuesta"]')
+    ]
+    conn.close()
+
+
+class _FakeConnection:
+    def __init__(self):
+        self.broken = False
+
+    def execute(self, sql, *args):
+        if self.broken:
+            raise ConnectionError("conexión rota")
+        return sqlite3.connect(":memory:").execute(sql)
+
+    def rollback(self):
+        if self.broken:
+            raise ConnectionError("conexión rota")
+
+    def close(self):
+        pass
+
+
+def test_waiter_opens_a_replacement_when_a_borrowed_connection_breaks():
+    opened = []
+
+    def connect():
+        opened.append(_FakeConnection())
+        return opened[-1]
+
+    pool = ConnectionPool(connect=connect, size=1, acquire_timeout=5, health_check_seconds=30)
+    borrowed = threading.Event()
+    result = {}
+
+    def waiter():
+        borrowed.wait()
+        started = time.perf_counter()
+        with pool.connection() as conn:
+            result["conn"] = conn
+        result["seconds"] = time.perf_counter() - started
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    with pytest.raises(ConnectionError):
+        with pool.connection() as conn:
+            borrowed.set()
+            time.sleep(0.1)
+            conn.broken = True
+            conn.execute("SELECT 1;")
+    thread.join(timeout=5)
+
+    # La conexión rota se descartó y quien esperaba abrió una nueva sin agotar su timeout
+    assert result["conn"] is opened[1]
+    assert result["seconds"] < 1
+    assert pool.stats()["open"] == 1
+    pool.close()
+
+
+def test_connections_are_reused_and_acquire_times_out_when_exhausted():
+    pool = ConnectionPool(connect=_FakeConnection, size=1, acquire_timeout=0.1, health_check_seconds=30)
+    with pool.connection() as first:
+        with pytest.raises(TimeoutError):
+            with pool.connection():
+                pass
+    with pool.connection() as second:
+        assert second is first
+    stats = pool.stats()
+    assert (stats["open"], stats["idle"], stats["acquired"], stats["timeouts"]) == (1, 1, 2, 1)
+    pool.close()
+
+
+def make_log(session_id: str, date_processed: str, question: str = "hola", **fields) -> dict:
+    return {"session_id": session_id, "total_tokens": 30, "prompt_tokens": 20, "completion_tokens": 10,
+            "total_cost_usd": 0.001, "user_question": question, "llm_answer": "respuesta",
+            "date_processed": date_processed, "deployment": "gpt-4o", **fields}
+
+
+def test_migrations_apply_once_and_create_the_history_index(sqlite_db):
+    with database.get_db_connection() as conn:
+        assert run_migrations(conn) == []
+        versions = [row[0] for row in conn.execute("SELECT version FROM schema_migrations ORDER BY version;")]
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index';")}
+    assert versions == [version for version, _, _ in MIGRATIONS]
+    assert versions == sorted(set(versions))
+    assert "idx_logs_session_date" in indexes
+
+
+def test_history_pages_follow_the_cursor_without_gaps_or_repeats(sqlite_db):
+    # Varios registros con la misma fecha: el ID desempata el orden
+    logs = [make_log("s1", f"2024-05-01T10:0{i // 2}:00", question=f"p{i}") for i in range(7)]
+    database.store_logs_batch(logs + [make_log("s2", "2024-05-01T10:00:00")])
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page, cursor = database.fetch_session_logs("s1", limit=3, cursor=cursor,
+                                                   fields=["user_question", "date_processed"])
+        seen += page
+        pages += 1
+        if cursor is None:
+            break
+    assert pages == 3
+    assert sorted(log["user_question"] for log in seen) == [f"p{i}" for i in range(7)]
+    assert [log["date_processed"] for log in seen] == sorted(log["date_processed"] for log in seen)
+    assert set(seen[0]) == {"user_question", "date_processed"}
+
+    with pytest.raises(ValueError):
+        database.fetch_session_logs("s1", fields=["password"])
+
+
+def test_history_cursor_round_trip():
+    cursor = database.encode_history_cursor("2024-05-01T10:00:00+00:00", "abc-123")
+    assert database.decode_history_cursor(cursor) == ("2024-05-01T10:00:00+00:00", "abc-123")
+    with pytest.raises(ValueError):
+        database.decode_history_cursor("no-es-un-cursor")
+
+
+def test_usage_rollups_match_the_logs_they_summarize(sqlite_db):
+    database.store_logs_batch([make_log("s1", "2024-05-01T10:05:00+00:00"),
+                               make_log("s1", "2024-05-01T10:40:00+00:00", cache_hit=True, saved_cost_usd=0.002)])
+    database.store_logs_batch([make_log("s2", "2024-05-01T10:59:00+00:00"),
+                               make_log("s1", "2024-05-01T11:01:00+00:00"),
+                               make_log("s3", "2024-05-02T09:00:00+00:00", deployment="gpt-4o-mini")])
+
+    hours = database.fetch_usage_rollups("hour", start="2024-05-01T00:00", end="2024-05-01T23:59", deployment="gpt-4o")
+    assert [(row["bucket"], row["requests"], row["sessions"]) for row in hours] == [
+        ("2024-05-01T10:00", 3, 2), ("2024-05-01T11:00", 1, 1)
+    ]
+    assert hours[0]["prompt_tokens"] == 60 and hours[0]["cache_hits"] == 1
+    assert abs(hours[0]["total_cost_usd"] - 0.003) < 1e-9 and abs(hours[0]["saved_cost_usd"] - 0.002) < 1e-9
+
+    days = database.fetch_usage_rollups("day")
+    assert [(row["bucket"], row["deployment"], row["requests"], row["sessions"]) for row in days] == [
+        ("2024-05-01", "gpt-4o", 4, 2), ("2024-05-02", "gpt-4o-mini", 1, 1)
+    ]
+    with pytest.raises(ValueError):
+        database.fetch_usage_rollups("week")
+
+
+def test_rollup_migration_backfills_existing_logs(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "logs.db"))
+    for version, _, migration in MIGRATIONS:
+        if version < 6:
+            migration(conn)
+    conn.executemany("INSERT INTO logs (ID, session_id, prompt_tokens, completion_tokens, total_tokens, "
+                     "total_cost_usd, date_processed) VALUES (?, ?, 20, 10, 30, 0.001, ?);",
+                     [("1", "s1", "2024-05-01T10:00"), ("2", "s2", "2024-05-01T10:30"), ("3", "s1", "2024-05-01T12:00")])
+    run_migrations(conn)
+    rows = conn.execute("SELECT bucket, requests, sessions, total_tokens FROM usage_rollups "
+                        "WHERE granularity = 'day';").fetchall()
+    assert rows == [("2024-05-01", 3, 2, 90)]
+    conn.close()
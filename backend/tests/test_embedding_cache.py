@@ -0,0 +1,36 @@
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from test_ingestion import FakeEmbeddings
+
+
+def test_only_missing_texts_are_embedded_once_per_batch(tmp_path):
+    model = FakeEmbeddings()
+    cached = CachedEmbeddings(model, EmbeddingCache(str(tmp_path / "cache.sqlite3")), model="ada")
+
+    assert cached.embed_documents(["uno", "dos", "uno"]) == [[3.0], [3.0], [3.0]]
+    assert model.texts == ["uno", "dos"] and model.calls == 1
+    assert cached.embed_documents(["dos", "cuatro"]) == [[3.0], [6.0]]
+    assert model.texts == ["uno", "dos", "cuatro"] and model.calls == 2
+    assert cached.stats() == {"hits": 2, "misses": 3}
+
+
+def test_vectors_survive_a_restart_and_are_keyed_by_model(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = EmbeddingCache(path)
+    CachedEmbeddings(FakeEmbeddings(), first, model="ada").embed_documents(["inventario"])
+    first.close()
+
+    model = FakeEmbeddings()
+    reopened = CachedEmbeddings(model, EmbeddingCache(path), model="ada")
+    assert reopened.embed_documents(["inventario"]) == [[10.0]] and model.calls == 0
+
+    other_model = CachedEmbeddings(model, EmbeddingCache(path), model="text-embedding-3-small")
+    other_model.embed_documents(["inventario"])
+    assert model.texts == ["inventario"]
+
+
+def test_lookups_larger_than_the_parameter_limit(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    items = {f"ada:{i}": [float(i)] for i in range(2000)}
+    cache.put_many(items)
+    found = cache.get_many(list(items) + ["ada:falta"])
+    assert len(found) == 2000 and found["ada:1999"] == [1999.0]
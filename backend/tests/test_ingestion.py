@@ -0,0 +1,146 @@
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from langchain_core.documents import Document
+import database
+from ingestion import IngestionConfig, IngestionPipeline
+from rate_limits import QuotaScheduler, RateLimitedEmbeddings
+
+
+class FakeContainer:
+    def __init__(self, blobs: dict):
+        self.blobs = blobs
+
+    def list_blobs(self):
+        return [SimpleNamespace(name=name, etag=etag, last_modified=datetime(2024, 5, 1, tzinfo=timezone.utc))
+                for name, (etag, _) in self.blobs.items()]
+
+    def load(self, name: str):
+        text = self.blobs[name][1]
+        return [Document(page_content=text, metadata={"source": name})], str(hash(text))
+
+
+class LineSplitter:
+    def split_documents(self, documents):
+        return [Document(page_content=line, metadata=doc.metadata)
+                for doc in documents for line in doc.page_content.splitlines() if line]
+
+
+class FakeEmbeddings:
+    def __init__(self, fail_on: str = ""):
+        self.fail_on = fail_on
+        self.calls = 0
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts.extend(texts)
+        if any(self.fail_on and self.fail_on in text for text in texts):
+            raise ValueError("embedding rechazado")
+        return [[float(len(text))] for text in texts]
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.chunks: dict = {}
+
+    def add_embeddings(self, text_embeddings, metadatas, keys):
+        for key, (text, _) in zip(keys, text_embeddings):
+            self.chunks[key] = text
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.chunks.pop(chunk_id, None)
+
+
+def make_pipeline(container, embeddings, vector_store=None, deduplicator=None, **config) -> IngestionPipeline:
+    config = IngestionConfig(**{"embed_batch_size": 2, "upload_batch_size": 2, "flush_interval_seconds": 0.01,
+                                "max_retries": 5, **config})
+    return IngestionPipeline(vector_store or FakeVectorStore(), container, embeddings, container.load,
+                             LineSplitter(), config, deduplicator)
+
+
+class Throttled(Exception):
+    status_code = 429
+    response = SimpleNamespace(headers={"retry-after-ms": "1"})
+
+
+class AlwaysThrottled:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        raise Throttled("429 Too Many Requests")
+
+
+def test_throttled_embeddings_are_retried_only_by_the_quota_scheduler(sqlite_db):
+    container = FakeContainer({"a.txt": ("1", "uno\ndos")})
+    throttled = AlwaysThrottled()
+    scheduler = QuotaScheduler(name="embeddings", requests_per_minute=0, tokens_per_minute=0, max_wait_seconds=60,
+                               max_retries=2, session_max_pending=4, request_tokens=0)
+    started = time.perf_counter()
+    summary = make_pipeline(container, RateLimitedEmbeddings(throttled, scheduler)).run()
+
+    assert summary["failed"] == ["a.txt"]
+    assert throttled.calls == 3
+    assert time.perf_counter() - started < 5
+
+
+def test_sync_only_processes_new_changed_and_removed_blobs(sqlite_db):
+    container = FakeContainer({"a.txt": ("1", "uno\ndos"), "b.txt": ("1", "tres")})
+    embeddings, store = FakeEmbeddings(), FakeVectorStore()
+    summary = make_pipeline(container, embeddings, store).run()
+    assert sorted(summary["added"]) == ["a.txt", "b.txt"] and summary["chunks_upserted"] == 3
+    assert sorted(store.chunks.values()) == ["dos", "tres", "uno"]
+
+    # Mismo ETag: no se descarga ni se embebe nada
+    embeddings.texts.clear()
+    summary = make_pipeline(container, embeddings, store).run()
+    assert sorted(summary["unchanged"]) == ["a.txt", "b.txt"] and embeddings.texts == []
+
+    # Un blob modificado y otro con ETag nuevo pero el mismo contenido
+    container.blobs = {"a.txt": ("2", "uno\ncuatro"), "b.txt": ("2", "tres")}
+    summary = make_pipeline(container, embeddings, store).run()
+    assert summary["updated"] == ["a.txt"] and summary["unchanged"] == ["b.txt"]
+    assert embeddings.texts == ["cuatro"]  # "uno" conserva su ID y no se vuelve a embeber
+    assert sorted(store.chunks.values()) == ["cuatro", "tres", "uno"]
+
+    del container.blobs["b.txt"]
+    summary = make_pipeline(container, embeddings, store).run()
+    assert summary["removed"] == ["b.txt"] and summary["chunks_deleted"] == 1
+    assert sorted(store.chunks.values()) == ["cuatro", "uno"]
+    assert sorted(database.load_kb_manifest()) == ["a.txt"]
+
+
+def test_failed_blob_is_not_checkpointed_and_is_retried_next_run(sqlite_db):
+    container = FakeContainer({"a.txt": ("1", "uno\ndos\ntres"), "b.txt": ("1", "roto\ncinco"), "c.txt": ("1", "seis")})
+    store = FakeVectorStore()
+    summary = make_pipeline(container, FakeEmbeddings(fail_on="roto"), store, embed_batch_size=1,
+                            embed_workers=2, upload_workers=2).run()
+    assert summary["failed"] == ["b.txt"]
+    assert sorted(summary["added"]) == ["a.txt", "c.txt"]
+    assert sorted(database.load_kb_manifest()) == ["a.txt", "c.txt"]
+    assert summary["stages"]["embed"]["errors"] >= 1
+
+    embeddings = FakeEmbeddings()
+    summary = make_pipeline(container, embeddings, store).run()
+    assert summary["added"] == ["b.txt"] and sorted(summary["unchanged"]) == ["a.txt", "c.txt"]
+    assert sorted(embeddings.texts) == ["cinco", "roto"]
+    assert "roto" in store.chunks.values()
+
+
+def test_unreadable_blob_fails_without_stopping_the_others(sqlite_db):
+    container = FakeContainer({"a.txt": ("1", "uno"), "b.txt": ("1", "dos")})
+    load = container.load
+
+    def flaky_load(name):
+        if name == "a.txt":
+            raise ValueError("formato no soportado")
+        return load(name)
+
+    pipeline = make_pipeline(container, FakeEmbeddings())
+    pipeline.load_blob = flaky_load
+    summary = pipeline.run()
+    assert summary["failed"] == ["a.txt"] and summary["added"] == ["b.txt"]
+    assert summary["stages"]["parse"]["errors"] == 1
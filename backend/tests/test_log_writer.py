@@ -0,0 +1,87 @@
+import json
+import os
+from log_writer import LogWriter
+
+
+class FakeLogStore:
+    def __init__(self):
+        self.rows = []
+        self.batches = []
+        self.available = True
+
+    def write_batch(self, records: list):
+        if not self.available:
+            raise ConnectionError("Turso no responde")
+        if any(record.get("invalid") for record in records):
+            raise ValueError("fila rechazada")
+        self.batches.append(len(records))
+        self.rows.extend(record["id"] for record in records)
+
+
+def make_writer(store: FakeLogStore, tmp_path, max_queue: int = 100, **kwargs) -> LogWriter:
+    return LogWriter(store.write_batch, max_queue=max_queue, batch_size=3, flush_interval_ms=20,
+                     spill_path=str(tmp_path / "spill.jsonl"), **kwargs)
+
+
+def test_records_are_written_in_batches_and_flushed_on_stop(tmp_path):
+    store = FakeLogStore()
+    writer = make_writer(store, tmp_path)
+    for i in range(7):
+        assert writer.submit({"id": i})
+    writer.start()
+    writer.stop()
+    assert store.rows == list(range(7)) and store.batches == [3, 3, 1]
+    stats = writer.stats()
+    assert stats["written"] == 7 and stats["batches"] == 3 and stats["queued"] == 0
+
+
+def test_overflow_spills_without_blocking_and_is_replayed(tmp_path):
+    store = FakeLogStore()
+    writer = make_writer(store, tmp_path, max_queue=1)
+    assert [writer.submit({"id": i}) for i in range(3)] == [True, False, False]
+    writer.start()
+    writer.stop()
+    assert sorted(store.rows) == [0, 1, 2]
+    assert writer.stats()["overflowed"] == 2 and writer.stats()["replayed"] == 2
+    assert not os.path.exists(writer.spill_path)
+
+    dropping = make_writer(FakeLogStore(), tmp_path, max_queue=1, overflow_policy="drop")
+    dropping.submit({"id": 0})
+    assert not dropping.submit({"id": 1}) and dropping.stats()["dropped"] == 1
+
+
+def test_failed_batches_spill_and_replay_after_the_next_successful_write(tmp_path):
+    store = FakeLogStore()
+    store.available = False
+    writer = make_writer(store, tmp_path)
+    writer.submit({"id": 1})
+    writer.start()
+    writer.stop()
+    assert store.rows == [] and writer.stats()["write_errors"] == 1
+    assert os.path.exists(writer.spill_path)
+
+    store.available = True
+    writer.submit({"id": 2})
+    writer.start()
+    writer.stop()
+    assert sorted(store.rows) == [1, 2] and not os.path.exists(writer.spill_path)
+
+
+def test_rejected_records_are_quarantined_after_repeated_replays(tmp_path):
+    store = FakeLogStore()
+    writer = make_writer(store, tmp_path)
+    with open(writer.spill_path, "w", encoding="utf-8") as spill_file:
+        for record in ({"id": 1}, {"id": 2, "invalid": True}, {"id": 3}):
+            spill_file.write(json.dumps(record) + "\n")
+
+    for _ in range(LogWriter.MAX_REPLAY_ATTEMPTS):
+        writer.start()  # Cada arranque reinserta el archivo local
+        writer.stop()
+
+    assert sorted(store.rows) == [1, 3]
+    assert not os.path.exists(writer.spill_path)
+    with open(f"{writer.spill_path}.quarantine", encoding="utf-8") as quarantine:
+        quarantined = [json.loads(line) for line in quarantine]
+    assert [record["id"] for record in quarantined] == [2]
+    assert quarantined[0]["_replay_attempts"] == LogWriter.MAX_REPLAY_ATTEMPTS
+    assert writer.stats()["quarantined"] == 1 and writer.stats()["replayed"] == 2
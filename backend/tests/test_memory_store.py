@@ -0,0 +1,47 @@
+from memory_store import SessionMemoryStore
+
+
+def _store(**limits) -> SessionMemoryStore:
+    return SessionMemoryStore(**{"max_sessions": 10, "max_bytes": 1000, "ttl_seconds": 60, **limits})
+
+
+def test_sessions_are_isolated_and_least_recently_used_is_evicted():
+    store = _store(max_sessions=2)
+    store.append_turn("a", "hola", "respuesta a")
+    store.append_turn("b", "hola", "respuesta b")
+    store.get_history("a")
+    store.append_turn("c", "hola", "respuesta c")
+
+    assert store.get_history("a") == [("hola", "respuesta a")]
+    assert store.get_history("b") == []
+    assert store.stats()["lru_evictions"] == 1
+
+
+def test_expired_sessions_are_dropped():
+    store = _store(ttl_seconds=0)
+    store.append_turn("a", "hola", "respuesta")
+
+    assert store.get_history("a") == []
+    assert store.stats()["ttl_evictions"] == 1
+    assert store.stats()["bytes"] == 0
+
+
+def test_a_session_over_the_byte_limit_keeps_its_latest_turns():
+    store = _store(max_bytes=30)
+    for number in range(5):
+        store.append_turn("a", f"pregunta {number}", "respuesta")
+
+    assert store.get_history("a") == [("pregunta 4", "respuesta")]
+    assert store.stats()["bytes"] <= 30
+
+
+def test_summaries_count_towards_the_byte_limit():
+    store = _store(max_bytes=100)
+    store.append_turn("a", "pregunta", "respuesta")
+    store.append_turn("b", "pregunta", "respuesta")
+    store.set_summary("b", "x" * 70, summarized_through_id=1)
+
+    # El resumen de "b" desaloja a la sesión menos usada en lugar de exceder el límite
+    assert store.get_history("a") == []
+    assert store.get_conversation("b").summary == "x" * 70
+    assert store.stats()["bytes"] == 70 + len("preguntarespuesta")
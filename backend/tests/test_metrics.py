@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from prometheus_client import REGISTRY
+from metrics import observe_interaction, render_metrics, stage_timer
+
+
+def _sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_stage_timer_records_durations_and_errors():
+    count = _sample("chatbot_stage_duration_seconds_count", stage="prueba")
+    errors = _sample("chatbot_stage_errors_total", stage="prueba")
+    timings: dict = {}
+    with stage_timer("prueba", timings):
+        pass
+    with pytest.raises(ValueError):
+        with stage_timer("prueba"):
+            raise ValueError("falla")
+    with pytest.raises(asyncio.CancelledError):
+        with stage_timer("prueba"):
+            raise asyncio.CancelledError()  # Una desconexión no es un error de la etapa
+
+    assert "prueba" in timings and timings["prueba"] >= 0
+    assert _sample("chatbot_stage_duration_seconds_count", stage="prueba") == count + 3
+    assert _sample("chatbot_stage_errors_total", stage="prueba") == errors + 1
+
+
+def test_interactions_add_tokens_and_cost_to_the_exposition():
+    prompt = _sample("chatbot_tokens_total", kind="prompt")
+    cached = _sample("chatbot_interactions_total", cache_hit="true")
+    observe_interaction({"prompt_tokens": 120, "completion_tokens": 8, "total_cost_usd": 0.01,
+                         "cache_hit": True, "saved_cost_usd": 0.02})
+    assert _sample("chatbot_tokens_total", kind="prompt") == prompt + 120
+    assert _sample("chatbot_interactions_total", cache_hit="true") == cached + 1
+
+    body, content_type = render_metrics()
+    assert content_type.startswith("text/plain")
+    assert b"chatbot_stage_duration_seconds_bucket" in body and b"chatbot_cost_usd_total" in body
@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from rate_limits import QuotaScheduler, RateLimitExceeded, TokenBucket
+
+
+def _scheduler(**overrides) -> QuotaScheduler:
+    return QuotaScheduler(**{"name": "llm", "requests_per_minute": 60, "tokens_per_minute": 6000,
+                             "max_wait_seconds": 5, "max_retries": 2, "session_max_pending": 2,
+                             "request_tokens": 100, **overrides})
+
+
+def test_token_bucket_refills_at_its_rate_up_to_the_burst():
+    bucket = TokenBucket(per_minute=600, burst_seconds=10)
+    start = bucket._updated
+    assert bucket.capacity == 100
+
+    bucket.take(150)
+    assert bucket.wait_for(10, start) == pytest.approx(6.0)
+    assert bucket.wait_for(10, start + 6) == pytest.approx(0.0)
+    bucket.wait_for(1, start + 600)
+    assert bucket.level == 100
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(per_minute=0, burst_seconds=10)
+    bucket.take(1_000_000)
+    assert bucket.wait_for(1_000_000, 0) == 0.0
+
+
+def test_admission_rejects_when_the_quota_cannot_be_served_in_time():
+    scheduler = _scheduler(tokens_per_minute=600, request_tokens=100, max_wait_seconds=5)
+    scheduler.admit("a")  # Consume la ráfaga completa (100 tokens)
+    with pytest.raises(RateLimitExceeded) as error:
+        scheduler.admit("b")
+    assert error.value.retry_after == pytest.approx(10, rel=0.05)
+    assert scheduler.stats()["rejected_quota"] == 1
+
+
+def test_a_session_cannot_exceed_its_pending_requests():
+    scheduler = _scheduler()
+    admissions = [scheduler.admit("a"), scheduler.admit("a")]
+    with pytest.raises(RateLimitExceeded):
+        scheduler.admit("a")
+    scheduler.release(admissions[0])
+    scheduler.release(scheduler.admit("a"))
+    assert scheduler.stats()["rejected_session"] == 1
+
+
+class Throttled(Exception):
+    status_code = 429
+    response = SimpleNamespace(headers={"retry-after-ms": "1"})
+
+
+def test_429s_are_retried_and_then_surface_as_rate_limit_exceeded():
+    scheduler = _scheduler(max_retries=2)
+    calls = []
+
+    async def throttled():
+        calls.append(1)
+        raise Throttled("429")
+
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(scheduler.call(throttled, tokens=10))
+    assert len(calls) == 3
+    stats = scheduler.stats()
+    assert (stats["retries"], stats["throttled"]) == (2, 2)
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from registry import ComponentRegistry
+
+
+def test_components_are_created_once_on_first_use():
+    calls = []
+
+    def factory():
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        return object()
+
+    registry = ComponentRegistry()
+    registry.register("cliente", factory)
+    assert calls == [] and registry.stats()["cliente"]["status"] == "pending"
+
+    async def scenario():
+        return await asyncio.gather(*(registry.aget("cliente") for _ in range(4)))
+
+    instances = asyncio.run(scenario())
+    assert len(calls) == 1 and all(instance is instances[0] for instance in instances)
+    assert registry.stats()["cliente"]["status"] == "ready"
+
+
+def test_failed_optional_component_is_retried_and_required_one_stops_startup():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("servicio no disponible")
+        return "cliente"
+
+    registry = ComponentRegistry()
+    registry.register("opcional", flaky)
+    registry.register("rapido", lambda: "listo")
+    stats = asyncio.run(registry.initialize())
+    assert stats["opcional"]["status"] == "failed" and stats["rapido"]["status"] == "ready"
+    assert registry.get("opcional") == "cliente"  # Se reintenta en el primer uso
+
+    registry.register("obligatorio", lambda: 1 / 0, required=True)
+    with pytest.raises(RuntimeError):
+        asyncio.run(registry.initialize(["obligatorio"]))
+
+    registry.override("obligatorio", "doble")
+    assert registry.get("obligatorio") == "doble"
+
+
+def test_importing_the_app_needs_no_credentials_or_connections():
+    env = {"PATH": os.environ.get("PATH", ""), "DATABASE_URL": "libsql://no-existe.invalid"}
+    code = ("import main, registry; "
+            "assert all(s['status'] == 'pending' for s in registry.get_component_registry().stats().values())")
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", code], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), timeout=60)
+    assert result.returncode == 0, result.stderr
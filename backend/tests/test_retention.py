@@ -0,0 +1,58 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+import database
+from retention import RetentionScheduler
+from test_database import make_log
+
+
+def make_scheduler(**kwargs) -> RetentionScheduler:
+    return RetentionScheduler(**{"interval_seconds": 3600, "max_age_hours": 24, "batch_size": 2,
+                                 "lease_seconds": 60, "pause_seconds": 0, **kwargs})
+
+
+def _session_ids() -> list:
+    with database.get_db_connection() as conn:
+        return sorted(row[0] for row in conn.execute("SELECT session_id FROM logs;"))
+
+
+def test_old_logs_are_deleted_in_batches(sqlite_db):
+    now = datetime.now(timezone.utc).isoformat()
+    database.store_logs_batch([make_log(f"viejo-{i}", f"2020-01-01T10:0{i}:00+00:00") for i in range(5)]
+                              + [make_log("nuevo", now)])
+
+    result = asyncio.run(make_scheduler().run_once())
+    assert result["status"] == "completed"
+    assert _session_ids() == ["nuevo"]
+    assert result["rows_deleted"] >= 5 and result["batches"] >= 3  # 5 logs en lotes de 2
+
+
+def test_only_the_lease_owner_runs_until_it_releases_the_lease(sqlite_db):
+    async def scenario():
+        first, second = make_scheduler(), make_scheduler()
+        results = [await first.run_once(), await second.run_once()]
+        await first.stop()
+        results.append(await second.run_once())
+        return [result["status"] for result in results], second.stats()["skipped"]
+
+    statuses, skipped = asyncio.run(scenario())
+    assert statuses == ["completed", "skipped", "completed"] and skipped == 1
+
+
+def test_concurrent_runs_in_one_process_are_skipped(sqlite_db):
+    async def scenario():
+        scheduler = make_scheduler()
+        return await asyncio.gather(scheduler.run_once(), scheduler.run_once())
+
+    statuses = sorted(result["status"] for result in asyncio.run(scenario()))
+    assert statuses == ["completed", "skipped"]
+
+
+def test_expired_lease_can_be_taken_over(sqlite_db):
+    assert database.acquire_job_lease("trabajo", "a", ttl_seconds=0.05)
+    assert not database.acquire_job_lease("trabajo", "b", ttl_seconds=60)
+    assert database.acquire_job_lease("trabajo", "a", ttl_seconds=0.05)  # El dueño lo renueva
+    time.sleep(0.1)
+    assert database.acquire_job_lease("trabajo", "b", ttl_seconds=60)
+    database.release_job_lease("trabajo", "a")  # Solo el dueño lo libera
+    assert not database.acquire_job_lease("trabajo", "a", ttl_seconds=60)
@@ -0,0 +1,54 @@
+import database
+from session_store import SQLSessionStore, _sqlite_connector
+
+
+def make_workers(tmp_path) -> tuple[SQLSessionStore, SQLSessionStore]:
+    path = str(tmp_path / "sessions.sqlite3")
+    return (SQLSessionStore(_sqlite_connector(path), cache_max_sessions=10, backend="sqlite"),
+            SQLSessionStore(_sqlite_connector(path), cache_max_sessions=10, backend="sqlite"))
+
+
+def test_any_worker_sees_turns_written_by_another(tmp_path):
+    first, second = make_workers(tmp_path)
+    first.append_turn("s1", "hola", "¡Hola!")
+    assert second.get_history("s1") == [("hola", "¡Hola!")]
+
+    first.append_turn("s1", "¿qué becas hay?", "Transporte y alimentación.")
+    assert second.get_history("s1") == [("hola", "¡Hola!"), ("¿qué becas hay?", "Transporte y alimentación.")]
+    assert second.get_history("s1")[-1][0] == "¿qué becas hay?"
+    stats = second.stats()
+    assert (stats["full_reads"], stats["delta_reads"], stats["cache_hits"]) == (1, 1, 1)
+
+
+def test_cleared_session_is_not_served_from_another_workers_cache(tmp_path):
+    first, second = make_workers(tmp_path)
+    first.append_turn("s1", "hola", "¡Hola!")
+    assert second.get_history("s1") == [("hola", "¡Hola!")]
+
+    assert first.clear("s1")
+    assert second.get_history("s1") == []
+    first.append_turn("s1", "de nuevo", "Hola otra vez")
+    assert second.get_history("s1") == [("de nuevo", "Hola otra vez")]
+    assert not first.clear("otra")
+
+
+def test_summary_only_moves_forward(tmp_path):
+    first, second = make_workers(tmp_path)
+    for i in range(3):
+        first.append_turn("s1", f"p{i}", f"r{i}")
+    turn_ids = first.get_conversation("s1").turn_ids
+    first.set_summary("s1", "resumen de dos turnos", turn_ids[1])
+    second.set_summary("s1", "resumen viejo", turn_ids[0])  # Llega tarde: no reemplaza al más nuevo
+
+    conversation = second.get_conversation("s1")
+    assert conversation.summary == "resumen de dos turnos" and conversation.summarized_turns == 2
+    conversation.turns.append(("mutado", "fuera"))
+    assert len(second.get_history("s1")) == 3  # Se devuelven copias de la caché
+
+
+def test_database_backend_uses_the_shared_turso_tables(sqlite_db):
+    store = SQLSessionStore(database.get_db_connection, cache_max_sessions=10, backend="database")
+    store.append_turn("s1", "hola", "¡Hola!")
+    assert store.get_history("s1") == [("hola", "¡Hola!")]
+    with database.get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM session_turns WHERE session_id = 's1';").fetchone()[0] == 1
@@ -0,0 +1,93 @@
+import numpy as np
+from vector_index import LocalVectorIndex
+
+
+def _vectors(count: int, dim: int = 8, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+def _add(index: LocalVectorIndex, vectors: np.ndarray, prefix: str = "c"):
+    index.add_embeddings([(f"texto {prefix}{i}", vector.tolist()) for i, vector in enumerate(vectors)],
+                         metadatas=[{"source": f"{prefix}{i}.txt"} for i in range(len(vectors))],
+                         keys=[f"{prefix}{i}" for i in range(len(vectors))])
+
+
+def test_exact_search_finds_each_vector_and_survives_a_reopen(tmp_path):
+    vectors = _vectors(50)
+    index = LocalVectorIndex(str(tmp_path))
+    _add(index, vectors)
+    index.close()
+
+    reopened = LocalVectorIndex(str(tmp_path))
+    document, score = reopened.search(vectors[7].tolist(), k=1)[0]
+    assert document.metadata["id"] == "c7" and document.page_content == "texto c7"
+    assert score > 0.999
+
+
+def test_ivf_search_recalls_the_exact_neighbours(tmp_path):
+    vectors = _vectors(2000, dim=16, seed=1)
+    exact = LocalVectorIndex(str(tmp_path / "exact"))
+    ivf = LocalVectorIndex(str(tmp_path / "ivf"), ivf_lists=16, nprobe=6, ivf_min_rows=500)
+    for index in (exact, ivf):
+        _add(index, vectors)
+
+    queries = _vectors(20, dim=16, seed=2)
+    hits = 0
+    for query in queries:
+        expected = {doc.metadata["id"] for doc, _ in exact.search(query.tolist(), k=10)}
+        hits += len(expected & {doc.metadata["id"] for doc, _ in ivf.search(query.tolist(), k=10)})
+    assert ivf.stats()["ivf_lists"] == 16
+    assert hits / (10 * len(queries)) >= 0.8
+
+
+def test_reader_sees_rows_added_and_compacted_by_another_instance(tmp_path):
+    vectors = _vectors(30)
+    writer = LocalVectorIndex(str(tmp_path))
+    _add(writer, vectors[:20])
+    reader = LocalVectorIndex(str(tmp_path))
+    assert reader.search(vectors[3].tolist(), k=1)[0][0].metadata["id"] == "c3"
+
+    # La ingesta (otro proceso) reemplaza y borra chunks y compacta el índice
+    writer.delete(ids=[f"c{i}" for i in range(10)])
+    _add(writer, vectors[20:], prefix="n")
+    assert reader.search(vectors[25].tolist(), k=1)[0][0].metadata["id"] == "n5"
+    assert writer.compact() == 10
+
+    assert len(reader) == 20
+    assert reader.search(vectors[3].tolist(), k=1)[0][0].metadata["id"] != "c3"
+    for position, key in ((15, "c15"), (25, "n5")):
+        document, score = reader.search(vectors[position].tolist(), k=1)[0]
+        assert document.metadata["id"] == key and score > 0.999
+
+
+def test_search_skips_rows_that_disappear_while_it_runs(tmp_path):
+    vectors = _vectors(10)
+    index = LocalVectorIndex(str(tmp_path))
+    _add(index, vectors)
+    other = LocalVectorIndex(str(tmp_path))
+    other.delete(ids=["c0"])
+
+    # Filas que el estado en memoria todavía cree vigentes pero ya no están en los metadatos
+    documents = index._documents(np.array([0, 1]), np.array([0.9, 0.8]))
+    assert [doc.metadata["id"] for doc, _ in documents] == ["c1"]
+
+
+def test_interrupted_compaction_keeps_the_previous_vectors(tmp_path, monkeypatch):
+    vectors = _vectors(10)
+    index = LocalVectorIndex(str(tmp_path))
+    _add(index, vectors)
+    index.delete(ids=["c0", "c1"])
+
+    def crash():
+        raise RuntimeError("proceso interrumpido")
+
+    monkeypatch.setattr(index, "_commit", crash)
+    try:
+        index.compact()
+    except RuntimeError:
+        pass
+
+    reopened = LocalVectorIndex(str(tmp_path))
+    for position in range(2, 10):
+        document, score = reopened.search(vectors[position].tolist(), k=1)[0]
+        assert document.metadata["id"] == f"c{position}" and score > 0.999
@@ -0,0 +1,417 @@
+"""Índice vectorial local en memoria mapeada, alternativa en proceso a Azure AI Search"""
+
+import os
+import json
+import sqlite3
+import threading
+from typing import Any, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from settings import get_settings
+
+
+class LocalVectorIndex:
+    """
+    Índice vectorial persistido en un directorio local.
+
+    - `vectors*.f32`: matriz float32 (filas x dimensión) abierta con `np.memmap`. Los vectores
+      se guardan normalizados, por lo que la similitud coseno es un producto punto.
+    - `metadata.sqlite3`: fila -> ID del chunk, texto, metadatos y marca de borrado, y en `info`
+      la dimensión, la capacidad, el archivo de vectores vigente y la generación del índice.
+    - `centroids.npy`: centroides del modo IVF (opcional).
+
+    Las altas se agregan al final de la matriz (que crece duplicando su capacidad) y las bajas
+    marcan la fila como borrada; `compact()` reescribe la matriz sin filas borradas en un
+    archivo nuevo. Con `ivf_lists > 0` las filas se agrupan con k-means y cada búsqueda solo
+    revisa las `nprobe` listas más cercanas a la consulta; con menos filas que `ivf_min_rows`
+    (o sin entrenar) la búsqueda es exhaustiva.
+
+    Cada escritura confirma sus metadatos junto con una generación nueva. Otro proceso que lee
+    el mismo directorio (la API mientras corre la ingesta) recarga su estado al cambiar la
+    generación, y descarta una búsqueda cuyos metadatos cambiaron mientras la resolvía.
+
+    Implementa `add_embeddings` y `delete` con la misma firma que el vector store de Azure,
+    así que el pipeline de ingesta puede escribir en cualquiera de los dos.
+    """
+
+    _INITIAL_CAPACITY = 1024
+    _VECTORS_FILE = "vectors.f32"
+
+    def __init__(self, path: str, ivf_lists: int = 0, nprobe: int = 8, ivf_min_rows: Optional[int] = None):
+        self.path = path
+        self.ivf_lists = ivf_lists
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows if ivf_min_rows is not None else 39 * ivf_lists
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(path, "metadata.sqlite3"), check_same_thread=False, timeout=30)
+        # WAL: los lectores de otros procesos no se bloquean mientras la ingesta escribe
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                key TEXT,
+                content TEXT,
+                metadata TEXT,
+                deleted INTEGER DEFAULT 0,
+                list_id INTEGER DEFAULT -1
+            );
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rows_key ON rows (key);")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, value TEXT);")
+        self._conn.commit()
+        self._vectors: Optional[np.memmap] = None
+        self._generation = -1
+        self._refresh()
+
+    def _load(self):
+        """Lee el estado confirmado del índice y abre su archivo de vectores vigente."""
+        info = dict(self._conn.execute("SELECT name, value FROM info;").fetchall())
+        self.dim: Optional[int] = int(info["dim"]) if "dim" in info else None
+        self._capacity = int(info.get("capacity", 0))
+        self._trained_rows = int(info.get("trained_rows", 0))
+        self._vectors_file = info.get("vectors_file", self._VECTORS_FILE)
+        rows = self._conn.execute("SELECT row, key, deleted, list_id FROM rows ORDER BY row;").fetchall()
+        self._count = rows[-1][0] + 1 if rows else 0
+        self._live = np.zeros(max(self._capacity, 1), dtype=bool)
+        self._lists = np.full(max(self._capacity, 1), -1, dtype=np.int32)
+        self._rows_by_key: dict[str, int] = {}
+        for row, key, deleted, list_id in rows:
+            self._live[row] = not deleted
+            self._lists[row] = list_id
+            if not deleted:
+                self._rows_by_key[key] = row
+
+        self._vectors = None
+        if self.dim is not None and self._capacity:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+        centroids_path = os.path.join(self.path, "centroids.npy")
+        self._centroids: Optional[np.ndarray] = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        # Al final: si la lectura falla a mitad, `_refresh` la repite
+        self._generation = int(info.get("generation", 0))
+
+    def _stored_generation(self) -> int:
+        row = self._conn.execute("SELECT value FROM info WHERE name = 'generation';").fetchone()
+        return int(row[0]) if row else 0
+
+    def _refresh(self):
+        """Recarga el estado si otro proceso confirmó cambios desde la última lectura."""
+        while self._stored_generation() != self._generation:
+            try:
+                self._load()
+            except FileNotFoundError:
+                # Una compactación reemplazó el archivo de vectores mientras se recargaba
+                continue
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, self._vectors_file)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._rows_by_key)
+
+    def add_embeddings(self, text_embeddings: list, metadatas: Optional[list] = None,
+                       keys: Optional[list] = None, **kwargs) -> list[str]:
+        """
+        Agrega (o reemplaza, si el ID ya existe) chunks con sus vectores.
+
+        Args:
+            text_embeddings (list): Pares (texto, vector).
+            metadatas (list): Metadatos de cada chunk.
+            keys (list): ID de cada chunk.
+
+        Returns:
+            list: IDs de los chunks agregados.
+        """
+        if not text_embeddings:
+            return []
+        texts = [text for text, _ in text_embeddings]
+        matrix = np.asarray([vector for _, vector in text_embeddings], dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        metadatas = metadatas or [{} for _ in texts]
+        keys = keys or [os.urandom(16).hex() for _ in texts]
+
+        with self._lock:
+            self._refresh()
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                self._set_info(dim=self.dim)
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"Dimensión {matrix.shape[1]} distinta de la del índice ({self.dim}).")
+
+            self._tombstone([key for key in keys if key in self._rows_by_key])
+            self._ensure_capacity(self._count + len(texts))
+            # Las filas nuevas quedan después de `_count`: los lectores no las ven hasta el commit
+            start = self._count
+            self._vectors[start:start + len(texts)] = matrix
+            self._vectors.flush()
+            lists = self._assign_lists(matrix)
+            self._conn.executemany(
+                "INSERT INTO rows (row, key, content, metadata, deleted, list_id) VALUES (?, ?, ?, ?, 0, ?);",
+                [
+                    (start + offset, key, text, json.dumps(metadata, ensure_ascii=False), int(list_id))
+                    for offset, (key, text, metadata, list_id) in enumerate(zip(keys, texts, metadatas, lists))
+                ]
+            )
+            self._commit()
+            self._live[start:start + len(texts)] = True
+            self._lists[start:start + len(texts)] = lists
+            for offset, key in enumerate(keys):
+                self._rows_by_key[key] = start + offset
+            self._count += len(texts)
+        return list(keys)
+
+    def delete(self, ids: Optional[list] = None, **kwargs) -> bool:
+        """Marca como borrados los chunks indicados."""
+        with self._lock:
+            self._refresh()
+            keys = [key for key in ids or [] if key in self._rows_by_key]
+            if keys:
+                self._tombstone(keys)
+                self._commit()
+        return True
+
+    def list_ids(self) -> list[str]:
+        """IDs de todos los chunks vigentes."""
+        with self._lock:
+            self._refresh()
+            return list(self._rows_by_key)
+
+    def search(self, query_vector: list[float], k: int = 10) -> list[tuple[Document, float]]:
+        """Devuelve los `k` chunks más similares (coseno) a la consulta."""
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            while True:
+                self._refresh()
+                if self.dim is None or not self._rows_by_key:
+                    return []
+                if self.ivf_lists and self._needs_training():
+                    self.train()
+                generation = self._generation
+                results = self._search(query, k)
+                # Si otro proceso compactó el índice entre el cálculo y la lectura de los
+                # metadatos, las filas ya no corresponden a los mismos chunks: repetir
+                if self._stored_generation() == generation or not self._renumbered_since(generation):
+                    return results
+
+    def _search(self, query: np.ndarray, k: int) -> list[tuple[Document, float]]:
+        candidates = np.flatnonzero(self._live[:self._count])
+        if self._centroids is not None:
+            nearest_lists = np.argsort(self._centroids @ query)[::-1][:self.nprobe]
+            candidates = candidates[np.isin(self._lists[candidates], nearest_lists)]
+        if candidates.size == 0:
+            return []
+
+        scores = np.asarray(self._vectors[candidates] @ query)
+        top = np.argpartition(-scores, min(k, scores.size) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return self._documents(candidates[top], scores[top])
+
+    def _renumbered_since(self, generation: int) -> bool:
+        """True si una compactación posterior a `generation` renumeró las filas."""
+        row = self._conn.execute("SELECT value FROM info WHERE name = 'compacted_generation';").fetchone()
+        return row is not None and int(row[0]) > generation
+
+    def train(self, iterations: int = 10, seed: int = 0):
+        """Agrupa las filas vigentes con k-means y asigna cada fila a su lista IVF."""
+        with self._lock:
+            self._refresh()
+            rows = np.flatnonzero(self._live[:self._count])
+            n_lists = min(self.ivf_lists, rows.size)
+            if n_lists == 0:
+                return
+            vectors = np.asarray(self._vectors[rows])
+            rng = np.random.default_rng(seed)
+            centroids = vectors[rng.choice(rows.size, n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignments = np.argmax(vectors @ centroids.T, axis=1)
+                for list_id in range(n_lists):
+                    members = vectors[assignments == list_id]
+                    if len(members):
+                        centroid = members.mean(axis=0)
+                        centroids[list_id] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+            lists = np.argmax(vectors @ centroids.T, axis=1)
+            temporary_path = os.path.join(self.path, "centroids.tmp.npy")
+            np.save(temporary_path, centroids)
+            os.replace(temporary_path, os.path.join(self.path, "centroids.npy"))
+            self._conn.executemany(
+                "UPDATE rows SET list_id = ? WHERE row = ?;",
+                [(int(list_id), int(row)) for row, list_id in zip(rows, lists)]
+            )
+            self._set_info(trained_rows=int(rows.size))
+            self._commit()
+            self._centroids = centroids
+            self._lists[rows] = lists
+            self._trained_rows = int(rows.size)
+
+    def compact(self) -> int:
+        """
+        Reescribe la matriz sin filas borradas. Devuelve cuántas filas se liberaron.
+
+        Los vectores compactados se escriben en un archivo nuevo (temporal y luego `os.replace`)
+        y recién después se confirman los metadatos renumerados, que apuntan a ese archivo. Si
+        el proceso se interrumpe antes del commit, el índice sigue usando el archivo anterior.
+        Los lectores que ya tenían abierto el archivo anterior lo conservan hasta recargar.
+        """
+        with self._lock:
+            self._refresh()
+            live_rows = np.flatnonzero(self._live[:self._count])
+            freed = self._count - live_rows.size
+            if freed == 0:
+                return 0
+            vectors = np.asarray(self._vectors[live_rows])
+            records = self._conn.execute(
+                "SELECT row, key, content, metadata, list_id FROM rows WHERE deleted = 0 ORDER BY row;"
+            ).fetchall()
+
+            vectors_file = f"vectors-{self._generation + 1}.f32"
+            temporary_path = os.path.join(self.path, vectors_file + ".tmp")
+            with open(temporary_path, "wb") as vectors_output:
+                vectors_output.write(vectors.astype(np.float32).tobytes())
+                vectors_output.truncate(self._capacity * self.dim * 4)
+                vectors_output.flush()
+                os.fsync(vectors_output.fileno())
+            os.replace(temporary_path, os.path.join(self.path, vectors_file))
+
+            self._conn.execute("DELETE FROM rows;")
+            self._conn.executemany(
+                "INSERT INTO rows (row, key, content, metadata, deleted, list_id) VALUES (?, ?, ?, ?, 0, ?);",
+                [(new_row, key, content, metadata, list_id)
+                 for new_row, (_, key, content, metadata, list_id) in enumerate(records)]
+            )
+            self._set_info(vectors_file=vectors_file, compacted_generation=self._generation + 1)
+            self._commit()
+
+            previous_path = self._vectors_path
+            self._vectors_file = vectors_file
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+            try:
+                os.remove(previous_path)
+            except OSError:
+                pass  # Otro proceso todavía lo tiene abierto (Windows); queda como archivo huérfano
+            self._lists[:live_rows.size] = self._lists[live_rows]
+            self._lists[live_rows.size:] = -1
+            self._live[:] = False
+            self._live[:live_rows.size] = True
+            self._count = int(live_rows.size)
+            self._rows_by_key = {record[1]: new_row for new_row, record in enumerate(records)}
+            return int(freed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {
+                "chunks": len(self._rows_by_key),
+                "rows": self._count,
+                "capacity": self._capacity,
+                "dim": self.dim,
+                "ivf_lists": 0 if self._centroids is None else len(self._centroids),
+                "generation": self._generation,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._conn.close()
+
+    def _tombstone(self, keys: list[str]):
+        rows = [self._rows_by_key.pop(key) for key in keys]
+        if rows:
+            self._live[rows] = False
+            self._conn.executemany("UPDATE rows SET deleted = 1 WHERE row = ?;", [(row,) for row in rows])
+
+    def _ensure_capacity(self, required: int):
+        """Agranda el archivo de vectores (duplicando su capacidad) si no alcanza."""
+        if required <= self._capacity:
+            return
+        capacity = max(self._capacity, self._INITIAL_CAPACITY)
+        while capacity < required:
+            capacity *= 2
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        with open(self._vectors_path, "ab") as vectors_file:
+            vectors_file.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._live = np.concatenate([self._live[:self._capacity], np.zeros(capacity - self._capacity, dtype=bool)])
+        self._lists = np.concatenate([self._lists[:self._capacity], np.full(capacity - self._capacity, -1, dtype=np.int32)])
+        self._capacity = capacity
+        self._set_info(capacity=capacity)
+
+    def _assign_lists(self, matrix: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.full(len(matrix), -1, dtype=np.int32)
+        return np.argmax(matrix @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _needs_training(self) -> bool:
+        """Entrenar al alcanzar `ivf_min_rows` filas y cada vez que el índice duplica su tamaño."""
+        live = len(self._rows_by_key)
+        return live >= max(self.ivf_min_rows, 1) and (self._centroids is None or live >= 2 * self._trained_rows)
+
+    def _set_info(self, **values):
+        """Guarda valores de `info` en la transacción en curso (se confirman con `_commit`)."""
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO info (name, value) VALUES (?, ?);",
+            [(name, str(value)) for name, value in values.items()]
+        )
+
+    def _commit(self):
+        """Confirma la transacción en curso junto con una generación nueva del índice."""
+        self._generation += 1
+        self._set_info(generation=self._generation)
+        self._conn.commit()
+
+    def _documents(self, rows: np.ndarray, scores: np.ndarray) -> list[tuple[Document, float]]:
+        placeholders = ",".join("?" * len(rows))
+        records = {
+            row: (key, content, metadata)
+            for row, key, content, metadata in self._conn.execute(
+                f"SELECT row, key, content, metadata FROM rows WHERE row IN ({placeholders}) AND deleted = 0;",
+                [int(row) for row in rows]
+            ).fetchall()
+        }
+        results = []
+        for row, score in zip(rows, scores):
+            # Una fila que otro proceso borró o compactó después de la última recarga se omite
+            if int(row) not in records:
+                continue
+            key, content, metadata = records[int(row)]
+            metadata = {**json.loads(metadata or "{}"), "id": key, "@search.score": float(score)}
+            results.append((Document(page_content=content, metadata=metadata), float(score)))
+        return results
+
+
+class LocalVectorRetriever(BaseRetriever):
+    """Retriever de LangChain sobre `LocalVectorIndex`, intercambiable con el de Azure AI Search."""
+
+    index: Any
+    embeddings: Any
+    k: int = 10
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list[Document]:
+        return [doc for doc, _ in self.index.search(self.embeddings.embed_query(query), self.k)]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> list[Document]:
+        query_vector = await self.embeddings.aembed_query(query)
+        return [doc for doc, _ in self.index.search(query_vector, self.k)]
+
+
+# Instancia global del índice local
+_local_vector_index = None
+
+def get_local_vector_index() -> LocalVectorIndex:
+    """Obtiene el índice vectorial local (singleton)."""
+    global _local_vector_index
+    if _local_vector_index is None:
+        settings = get_settings()
+        _local_vector_index = LocalVectorIndex(
+            path=settings.local_index_path,
+            ivf_lists=settings.local_index_ivf_lists,
+            nprobe=settings.local_index_nprobe,
+        )
+    return _local_vector_index